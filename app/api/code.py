@@ -1,16 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import uuid
+from typing import Awaitable, Optional, Tuple, TypeVar
+
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
 
+from app.core.config import EVALUATION_QUEUE
 from app.data.snippets import get_snippet
 from app.db import models
 from app.db.session import get_db
+from app.services.evaluator.dispatcher import Admission, EvaluationQueueFull, dispatcher
 from app.services.evaluator.evaluator import evaluate_code
+from app.services.evaluator.jobs import (
+    PENDING_STATUS,
+    record_result,
+    register_job,
+    run_evaluation_job,
+    wait_for_job,
+)
+from app.services.evaluator.work_queue import check_queue_room, enqueue_job
 from app.services.llm.intervention import get_rephrased_error_message
-from app.utils.enums import InterventionType
+from app.utils import cancellation
+from app.utils.enums import InterventionType, SubmissionMode
 
 router = APIRouter()
 
+# Maximum number of seconds a job status request may wait for the job to complete
+MAX_JOB_WAIT_SECONDS = 30
+
+# Interval (in seconds) at which long-running requests check whether the client went away
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Status code of requests abandoned by the client (nginx convention, never actually sent)
+CLIENT_CLOSED_REQUEST = 499
+
+T = TypeVar("T")
+
 
 class CodeSubmission(BaseModel):
     """
@@ -24,14 +61,30 @@ class CodeSubmission(BaseModel):
 
 
 @router.post("/submit")
-async def submit_code_fix(submission: CodeSubmission, db: Session = Depends(get_db)):
+async def submit_code_fix(
+    submission: CodeSubmission,
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    mode: SubmissionMode = SubmissionMode.SYNC,
+    db: Session = Depends(get_db),
+):
     """
     Submit the user's code for compilation check and evaluation.
     Records each attempt with attempt_number, error message shown, and evaluation status.
+    In job mode, the attempt is recorded as pending and evaluated in the background (or by
+    an evaluator worker, with `EVALUATION_QUEUE`), and the response (202 Accepted) carries a
+    job ID to query `/submit/{job_id}` with.
     :param submission: CodeSubmission model containing participant ID, snippet ID, and code.
+    :param request: The request, to stop evaluating (without recording the attempt) if the
+        client disconnects before the evaluation completes.
+    :param response: The response, whose status code is set to 202 in job mode.
+    :param background_tasks: Background tasks running the evaluation in job mode.
+    :param mode: Whether to evaluate before responding ("sync") or in the background ("job").
     :param db: Database session dependency.
-    :raises HTTPException: If participant does not exist, has not given consent, or intervention type is not assigned.
-    :return: A dictionary containing participant ID, snippet ID, status, and error message.
+    :raises HTTPException: If participant does not exist, has not given consent, or intervention type is not assigned,
+        or (429) if too many submissions are being evaluated, in which case the attempt does not count.
+    :return: A dictionary containing participant ID, snippet ID, status, and (in job mode) job ID.
     """
     participant = db.get(models.Participant, submission.participant_id)
     if not participant:
@@ -75,9 +128,82 @@ async def submit_code_fix(submission: CodeSubmission, db: Session = Depends(get_
             detail="Maximum number of attempts (3) reached for this snippet.",
         )
 
-    # Evaluate code (syntax + tests)
-    code_status, error, tests_passed, tests_total = evaluate_code(
-        submission.code, snippet_id
+    if mode == SubmissionMode.JOB and EVALUATION_QUEUE:
+        # Evaluated by the evaluator workers, whatever the load on this process, but only
+        # while they keep up with the queue (a rejection is free, like below)
+        try:
+            check_queue_room(db)
+        except EvaluationQueueFull as e:
+            raise too_many_submissions(e)
+        job_id = uuid.uuid4().hex
+        db.add(
+            models.CodeSubmission(
+                participant_id=pid,
+                snippet_id=snippet_id,
+                attempt_number=attempt_number,
+                code=submission.code,
+                status=PENDING_STATUS,
+                time_taken_ms=submission.time_taken_ms,
+                job_id=job_id,
+            )
+        )
+        enqueue_job(db, job_id)
+        commit_attempt(db)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "participant_id": pid,
+            "snippet_id": snippet_id,
+            "status": PENDING_STATUS,
+            "job_id": job_id,
+        }
+
+    # Reserve room for the evaluation before recording anything, so a rejection is free
+    admission = admit_evaluation()
+
+    if mode == SubmissionMode.JOB:
+        # Record the attempt right away, so it counts towards the limit while queued
+        job_id = uuid.uuid4().hex
+        sub = models.CodeSubmission(
+            participant_id=pid,
+            snippet_id=snippet_id,
+            attempt_number=attempt_number,
+            code=submission.code,
+            status=PENDING_STATUS,
+            time_taken_ms=submission.time_taken_ms,
+            job_id=job_id,
+        )
+        db.add(sub)
+        try:
+            commit_attempt(db)
+        except HTTPException:
+            admission.release()
+            raise
+        register_job(job_id)
+        background_tasks.add_task(
+            run_evaluation_job,
+            sessionmaker(bind=db.get_bind(), autocommit=False, autoflush=False),
+            job_id,
+            evaluate_code,
+            submission.code,
+            snippet_id,
+            admission,
+            pid,
+            attempt_number,
+        )
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {
+            "participant_id": pid,
+            "snippet_id": snippet_id,
+            "status": PENDING_STATUS,
+            "job_id": job_id,
+        }
+
+    # Evaluate code (syntax + tests) off the event loop, so other requests are still served
+    result = await until_disconnected(
+        request,
+        dispatcher.run(
+            evaluate_code, submission.code, snippet_id, admission, pid, attempt_number
+        ),
     )
 
     # Record the submission attempt
@@ -86,27 +212,171 @@ async def submit_code_fix(submission: CodeSubmission, db: Session = Depends(get_
         snippet_id=snippet_id,
         attempt_number=attempt_number,
         code=submission.code,
-        status=code_status,
-        error=error,
-        tests_passed=tests_passed,
-        tests_total=tests_total,
         time_taken_ms=submission.time_taken_ms,
     )
+    record_result(sub, result)
     db.add(sub)
-    db.commit()
+    commit_attempt(db)
+
+    return {"participant_id": pid, "snippet_id": snippet_id, "status": sub.status}
+
+
+@router.get("/submit/{job_id}")
+async def get_submission_status(
+    job_id: str,
+    wait: float = Query(0, ge=0, le=MAX_JOB_WAIT_SECONDS),
+    db: Session = Depends(get_db),
+):
+    """
+    Retrieve the status of a code submission made in job mode.
+    Supports long-polling: if the job is still pending, the request waits up to `wait`
+    seconds for the evaluation to complete before responding.
+    :param job_id: The job ID returned when submitting the code.
+    :param wait: The maximum number of seconds to wait for a pending job to complete.
+    :param db: Database session dependency.
+    :raises HTTPException: If no submission exists for the job ID.
+    :return: A dictionary containing the job ID, attempt, status, and test results.
+    """
+    sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one_or_none()
+    if not sub:
+        raise HTTPException(
+            status.HTTP_404_NOT_FOUND, detail="Submission job not found"
+        )
+    if sub.status == PENDING_STATUS and wait > 0:
+        await wait_for_job(db, job_id, wait)
+        db.refresh(sub)
+
+    return {
+        "job_id": job_id,
+        "participant_id": sub.participant_id,
+        "snippet_id": sub.snippet_id,
+        "attempt_number": sub.attempt_number,
+        "status": sub.status,
+        "tests_passed": sub.tests_passed,
+        "tests_total": sub.tests_total,
+    }
+
+
+async def until_disconnected(
+    request: Request,
+    awaitable: Awaitable[T],
+    scope: Optional[cancellation.CancelScope] = None,
+) -> T:
+    """
+    Wait for the work done for a request, cancelling it if the client disconnects first.
+    :param request: The request the work is done for.
+    :param awaitable: The work.
+    :param scope: The cancel scope of blocking work done on another thread, if any.
+    :raises HTTPException: (499) If the client disconnected before the work completed.
+    :return: The result of the work.
+    """
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            if scope is not None:
+                scope.cancel()
+            raise HTTPException(
+                CLIENT_CLOSED_REQUEST, detail="Client closed the request."
+            )
+
+
+def admit_evaluation() -> Admission:
+    """
+    Reserve room for evaluating a submission in the evaluation dispatcher.
+    :raises HTTPException: If too many submissions are already waiting to be evaluated.
+    :return: The admission, to pass on to the dispatcher.
+    """
+    try:
+        return dispatcher.admit()
+    except EvaluationQueueFull as e:
+        raise too_many_submissions(e)
+
+
+def too_many_submissions(e: EvaluationQueueFull) -> HTTPException:
+    """
+    Build the response to a submission rejected by admission control.
+    :param e: The rejection, with the delay after which the client should try again.
+    :return: The HTTP exception (429) to raise.
+    """
+    return HTTPException(
+        status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many submissions are being evaluated. Please try again shortly.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
 
-    return {"participant_id": pid, "snippet_id": snippet_id, "status": code_status}
+def commit_attempt(db: Session) -> None:
+    """
+    Commit a newly recorded submission attempt.
+    :param db: Database session holding the new CodeSubmission.
+    :raises HTTPException: If the same attempt was recorded concurrently by another request.
+    """
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another submission for the same attempt was recorded while this one was evaluated
+        db.rollback()
+        raise HTTPException(
+            status.HTTP_409_CONFLICT,
+            detail="Another submission for this snippet is already being evaluated.",
+        )
 
 
 @router.get("/snippet")
-def get_code_and_error(participant_id: str, db: Session = Depends(get_db)):
+async def get_code_and_error(
+    participant_id: str, request: Request, db: Session = Depends(get_db)
+):
     """
     Retrieve the code snippet and error message for the participant's assigned snippet.
+    The handler is async only to abort the rephrasing of the error message if the client
+    disconnects; its (blocking) database work runs on the thread pool, like a sync handler.
     :param participant_id: The ID of the participant requesting the snippet.
+    :param request: The request, to abort the rephrasing of the error message by the LLM if
+        the client disconnects before it completes.
     :param db: Database session dependency.
     :raises HTTPException: If participant does not exist, has not given consent, or snippet is not found.
     :return: A dictionary containing the snippet ID, code, and respective error message.
     """
+    snippet_id, code, error, intervention_type = await run_in_threadpool(
+        assigned_snippet, db, participant_id
+    )
+    markdown = False
+    if (
+        intervention_type == InterventionType.PRAGMATIC.value
+        or intervention_type == InterventionType.CONTINGENT.value
+    ):
+        scope = cancellation.CancelScope()
+
+        def rephrase() -> str:
+            with cancellation.activate(scope):
+                return get_rephrased_error_message(
+                    code, error, InterventionType(intervention_type).value
+                )
+
+        error = await until_disconnected(request, asyncio.to_thread(rephrase), scope)
+        markdown = True
+    await run_in_threadpool(
+        record_feedback_prompt, db, participant_id, snippet_id, error
+    )
+
+    return {"id": snippet_id, "code": code, "error": error, "markdown": markdown}
+
+
+def assigned_snippet(
+    db: Session, participant_id: str
+) -> Tuple[str, str, str, Optional[str]]:
+    """
+    Look up the snippet assigned to a participant.
+    :param db: Database session.
+    :param participant_id: The ID of the participant requesting the snippet.
+    :raises HTTPException: If participant does not exist, has not given consent, or snippet is not found.
+    :return: A tuple of the snippet ID, its code, its error message and the participant's
+        intervention type.
+    """
     participant = db.get(models.Participant, participant_id)
     if not participant:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Participant not found")
@@ -132,18 +402,19 @@ def get_code_and_error(participant_id: str, db: Session = Depends(get_db)):
     if not snippet:
         raise HTTPException(status.HTTP_404_NOT_FOUND, detail="Snippet not found")
 
-    code = snippet["code"]
-    error = snippet["error"]
-    intervention_type = participant.intervention_type
-    markdown = False
-    if (
-        intervention_type == InterventionType.PRAGMATIC.value
-        or intervention_type == InterventionType.CONTINGENT.value
-    ):
-        error = get_rephrased_error_message(
-            code, error, InterventionType(intervention_type).value
-        )
-        markdown = True
+    return snippet_id, snippet.code, snippet.error, participant.intervention_type
+
+
+def record_feedback_prompt(
+    db: Session, participant_id: str, snippet_id: str, error: str
+) -> None:
+    """
+    Record the error message shown to a participant, to be rated in their feedback.
+    :param db: Database session.
+    :param participant_id: The ID of the participant.
+    :param snippet_id: The ID of the participant's snippet.
+    :param error: The (possibly rephrased) error message shown to the participant.
+    """
     feedback_entry = models.Feedback(
         participant_id=participant_id,
         snippet_id=snippet_id,
@@ -151,5 +422,3 @@ def get_code_and_error(participant_id: str, db: Session = Depends(get_db)):
     )
     db.add(feedback_entry)
     db.commit()
-
-    return {"id": snippet_id, "code": code, "error": error, "markdown": markdown}
@@ -7,6 +7,7 @@ from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
 from app.data.questions import get_randomized_questions_for_participant
+from app.data.snippets import SNIPPETS
 from app.db import models
 from app.db.models import Participant
 from app.db.session import get_db
@@ -399,7 +400,7 @@ def assign_skill_and_intervention_and_snippet(participant, db: Session) -> None:
     skill_participants = get_skill_participants(db, skill_level)
 
     # All available code snippets for assignment
-    code_snippets = ["A", "B", "C", "D"]
+    code_snippets = list(SNIPPETS)
 
     # Check all the assigned snippets of participants with the same skill level
     assigned_snippets = [p.snippet_id for p in skill_participants]
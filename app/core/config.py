@@ -8,3 +8,29 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OLLAMA_URL = os.getenv("OLLAMA_URL")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+
+# Code evaluator settings
+EVALUATOR_ENGINE = os.getenv("EVALUATOR_ENGINE", "subprocess")
+EVALUATOR_POOL_SIZE = int(os.getenv("EVALUATOR_POOL_SIZE", "4"))
+EVALUATOR_POOL_MAX_JOBS = int(os.getenv("EVALUATOR_POOL_MAX_JOBS", "100"))
+EVALUATOR_MAX_CONCURRENCY = int(os.getenv("EVALUATOR_MAX_CONCURRENCY", "4"))
+EVALUATION_CACHE_SIZE = int(os.getenv("EVALUATION_CACHE_SIZE", "1024"))
+EVALUATION_CACHE_PERSISTENT = os.getenv("EVALUATION_CACHE_PERSISTENT", "true") == "true"
+EVALUATOR_SANDBOX_DIR = os.getenv("EVALUATOR_SANDBOX_DIR", "/dev/shm")
+EVALUATOR_MAX_MEMORY_MB = int(os.getenv("EVALUATOR_MAX_MEMORY_MB", "512"))
+EVALUATOR_MAX_CPU_SECONDS = int(os.getenv("EVALUATOR_MAX_CPU_SECONDS", "15"))
+EVALUATOR_MAX_FILE_SIZE_MB = int(os.getenv("EVALUATOR_MAX_FILE_SIZE_MB", "16"))
+EVALUATOR_MAX_OUTPUT_KB = int(os.getenv("EVALUATOR_MAX_OUTPUT_KB", "1024"))
+EVALUATOR_TEST_SHARDS = int(os.getenv("EVALUATOR_TEST_SHARDS", "1"))
+EVALUATOR_MAX_QUEUE = int(os.getenv("EVALUATOR_MAX_QUEUE", "32"))
+EVALUATOR_TIMEOUT_MULTIPLIER = float(os.getenv("EVALUATOR_TIMEOUT_MULTIPLIER", "10"))
+EVALUATOR_TIMEOUT_FLOOR_SECONDS = float(
+    os.getenv("EVALUATOR_TIMEOUT_FLOOR_SECONDS", "2")
+)
+EVALUATOR_LINE_COVERAGE = os.getenv("EVALUATOR_LINE_COVERAGE", "false") == "true"
+EVALUATION_QUEUE = os.getenv("EVALUATION_QUEUE", "false") == "true"
+EVALUATION_QUEUE_LEASE_SECONDS = float(
+    os.getenv("EVALUATION_QUEUE_LEASE_SECONDS", "60")
+)
+EVALUATION_QUEUE_MAX_ATTEMPTS = int(os.getenv("EVALUATION_QUEUE_MAX_ATTEMPTS", "3"))
+EVALUATION_QUEUE_MAX_WAITING = int(os.getenv("EVALUATION_QUEUE_MAX_WAITING", "256"))
@@ -1,55 +1,158 @@
+import json
 import os
-from typing import Dict, Tuple
+import threading
+from types import CodeType
+from typing import Dict, NamedTuple, Optional, Tuple
 
-SNIPPET_FILES = {
-    "A": ("snippetA/snippetA.py", "snippetA/snippetA_error.txt"),
-    "B": ("snippetB/snippetB.py", "snippetB/snippetB_error.txt"),
-    "C": ("snippetC/snippetC.py", "snippetC/snippetC_error.txt"),
-    "D": ("snippetD/snippetD.py", "snippetD/snippetD_error.txt"),
-}
+# The directory containing the snippet folders, and the manifest listing them
+CODE_DIR = os.path.join(os.path.dirname(__file__), "code")
+MANIFEST_PATH = os.path.join(CODE_DIR, "manifest.json")
 
 
-def read_snippet(filename: Tuple[str, str]) -> str:
+class Snippet(NamedTuple):
+    """A code snippet, its original error and its test suite, as listed in the manifest."""
+
+    snippet_id: str
+    source_file: str  # Relative to CODE_DIR, like the other files
+    error_file: str
+    test_file: str
+    test_class: str
+    code: str
+    error: str
+    test_code: CodeType  # The compiled test module, ready to be executed
+    cases_file: Optional[str] = None  # Test cases as data, for the function engine
+    cases: Optional[dict] = None  # See `user_runner` for the format
+    solution: Optional[str] = None  # A reference solution, passing every test
+    # Modification time and size of the test (and cases) file when they were loaded
+    test_stamp: Tuple[int, ...] = ()
+
+    @property
+    def test_spec(self) -> Tuple[str, str, str]:
+        """The (snippet file, test file, test class) triple used by the evaluator."""
+        return self.source_file, self.test_file, self.test_class
+
+
+def load_snippets(manifest_path: str = MANIFEST_PATH) -> Dict[str, Snippet]:
     """
-    Read a code snippet from a file.
-    :param filename: A tuple containing the directory and filename of the snippet.
-    :return: The content of the code snippet as a string.
-    :raises FileNotFoundError: If the snippet file does not exist.
-    :raises ValueError: If the filename is invalid.
+    Load every snippet listed in a manifest, reading and compiling its files once.
+    Each manifest entry names the snippet ID, its folder and its test class; the files default
+    to `<folder>/<folder>.py`, `<folder>/<folder>_error.txt` and `<folder>/test_<folder>.py`,
+    and can be overridden with the "source", "error" and "tests" keys. Snippets whose tests
+    can also be expressed exactly as data (grading every submission like the test class, see
+    `user_runner`) list a JSON file of test cases under the "cases" key. A reference solution
+    is loaded from `<folder>/<folder>_solution.py` (or the "solution" key) if that file exists.
+    :param manifest_path: The path of the JSON manifest.
+    :return: Mapping of snippet ID to snippet, in manifest order.
+    :raises FileNotFoundError: If the manifest or a file it lists does not exist.
+    :raises ValueError: If the manifest lists the same snippet ID twice.
     """
-    path = os.path.join(os.path.dirname(__file__), "code", filename[0])
-    with open(path, "r") as f:
-        return f.read()
+    code_dir = os.path.dirname(manifest_path)
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
 
+    snippets: Dict[str, Snippet] = {}
+    for entry in manifest["snippets"]:
+        snippet_id, folder = entry["id"], entry["folder"]
+        if snippet_id in snippets:
+            raise ValueError(f"Duplicate snippet ID in manifest: {snippet_id}")
+        source_file = entry.get("source", f"{folder}/{folder}.py")
+        error_file = entry.get("error", f"{folder}/{folder}_error.txt")
+        test_file = entry.get("tests", f"{folder}/test_{folder}.py")
+        with open(os.path.join(code_dir, source_file), "r") as f:
+            code = f.read()
+        with open(os.path.join(code_dir, error_file), "r") as f:
+            error = f.read()
+        cases_file = entry.get("cases")
+        test_code, cases, test_stamp = _load_tests(code_dir, test_file, cases_file)
+        solution_path = os.path.join(
+            code_dir, entry.get("solution", f"{folder}/{folder}_solution.py")
+        )
+        solution = None
+        if os.path.exists(solution_path):
+            with open(solution_path, "r") as f:
+                solution = f.read()
+        snippets[snippet_id] = Snippet(
+            snippet_id,
+            source_file,
+            error_file,
+            test_file,
+            entry["test_class"],
+            code,
+            error,
+            test_code,
+            cases_file,
+            cases,
+            solution,
+            test_stamp,
+        )
+    return snippets
 
-def read_error(snippet_key: str) -> str:
+
+def _load_tests(
+    code_dir: str, test_file: str, cases_file: Optional[str]
+) -> Tuple[CodeType, Optional[dict], Tuple[int, ...]]:
     """
-    Read the error message from a file for a given snippet.
-    :param snippet_key: The key identifying the snippet (e.g., "A", "B", etc.).
-    :return: The content of the error message as a string.
-    :raises FileNotFoundError: If the error file does not exist.
-    :raises ValueError: If the snippet key is invalid.
+    Compile a snippet's test module and read its test cases, if any.
+    :return: The compiled test module, the test cases, and the stamp of their files (taken
+        before reading them, so that a file changed meanwhile is reloaded next time).
     """
-    code_file, error_file = SNIPPET_FILES[snippet_key]
-    error_path = os.path.join(os.path.dirname(__file__), "code", error_file)
-    with open(error_path, "r") as f:
-        return f.read()
+    test_stamp = _stamp(code_dir, test_file, cases_file)
+    test_path = os.path.join(code_dir, test_file)
+    with open(test_path, "r") as f:
+        test_code = compile(f.read(), test_path, "exec", dont_inherit=True)
+    cases = None
+    if cases_file is not None:
+        with open(os.path.join(code_dir, cases_file), "r") as f:
+            cases = json.load(f)
+    return test_code, cases, test_stamp
+
+
+def _stamp(code_dir: str, *files: Optional[str]) -> Tuple[int, ...]:
+    """Return the modification time and size of each given file (skipping None)."""
+    stamp: Tuple[int, ...] = ()
+    for rel_path in files:
+        if rel_path is not None:
+            st = os.stat(os.path.join(code_dir, rel_path))
+            stamp += (st.st_mtime_ns, st.st_size)
+    return stamp
 
 
-SNIPPETS: Dict[str, dict] = {
-    key: {
-        "code": read_snippet(filename),
-        "error": read_error(key),
-        "filename": filename,
-    }
-    for key, filename in SNIPPET_FILES.items()
-}
+# Loaded once at startup, so that requests never read snippet files
+SNIPPETS: Dict[str, Snippet] = load_snippets()
 
 
-def get_snippet(snippet_id: str) -> dict | None:
+def get_snippet(snippet_id: str) -> Optional[Snippet]:
     """
     Retrieve a code snippet by its associated ID.
     :param snippet_id: The ID of the snippet to retrieve.
-    :return: A dictionary containing the code, error message, and filename, or None if not found.
+    :return: The snippet (code, error message, files and test suite), or None if not found.
     """
     return SNIPPETS.get(snippet_id)
+
+
+_reload_lock = threading.Lock()
+
+
+def refresh_tests(snippet_id: str, code_dir: str = CODE_DIR) -> Snippet:
+    """
+    Return a registered snippet, first reloading its test module and test cases if their
+    files changed on disk since they were loaded, so that edited tests apply without a restart.
+    :param snippet_id: The ID of the snippet.
+    :param code_dir: The directory the snippet's files are relative to.
+    :return: The (possibly reloaded) snippet, also replacing it in the registry.
+    """
+    snippet = SNIPPETS[snippet_id]
+    if _stamp(code_dir, snippet.test_file, snippet.cases_file) == snippet.test_stamp:
+        return snippet
+    with _reload_lock:
+        snippet = SNIPPETS[snippet_id]
+        stamp = _stamp(code_dir, snippet.test_file, snippet.cases_file)
+        if stamp != snippet.test_stamp:
+            test_code, cases, test_stamp = _load_tests(
+                code_dir, snippet.test_file, snippet.cases_file
+            )
+            snippet = snippet._replace(
+                test_code=test_code, cases=cases, test_stamp=test_stamp
+            )
+            SNIPPETS[snippet_id] = snippet
+        return snippet
@@ -1,4 +1,4 @@
-from sqlalchemy import JSON, Boolean, Column, Integer, String
+from sqlalchemy import JSON, BigInteger, Boolean, Column, Float, Integer, String
 
 from app.db.base import Base
 
@@ -33,7 +33,23 @@ class CodeSubmission(Base):
     error = Column(String, nullable=True)
     tests_passed = Column(Integer, nullable=True)
     tests_total = Column(Integer, nullable=True)
+    test_results = Column(JSON, nullable=True)  # Name, outcome & duration per test
+    tests_passed_mask = Column(BigInteger, nullable=True)  # Bit i: i-th test passed
+    cpu_user_ms = Column(Integer, nullable=True)  # CPU time of the evaluation process
+    cpu_system_ms = Column(Integer, nullable=True)
+    peak_rss_kb = Column(
+        Integer, nullable=True
+    )  # Peak memory of the evaluation process
+    timeout_seconds = Column(Float, nullable=True)  # Effective timeout of the run
+    timed_out = Column(Boolean, nullable=True)
+    phase_timings = Column(
+        JSON, nullable=True
+    )  # Duration (ms) of each phase of the evaluation
+    lines_executed = Column(
+        String, nullable=True
+    )  # Hex bitmap of the submitted lines that ran (bit i: line i + 1)
     time_taken_ms = Column(Integer, nullable=True)
+    job_id = Column(String, nullable=True, unique=True, index=True)
 
 
 class Event(Base):
@@ -74,3 +90,35 @@ class Feedback(Base):
     time_taken_ms_authoritativeness = Column(
         Integer, nullable=True
     )  # Time taken for authoritativeness feedback
+
+
+class EvaluationCacheEntry(Base):
+    """Model representing a cached code evaluation result (persistent tier of the evaluation cache)."""
+
+    __tablename__ = "evaluation_cache"
+    key = Column(
+        String, primary_key=True
+    )  # SHA-256 of normalized code, snippet, and suite version
+    snippet_id = Column(String, index=True, nullable=False)
+    suite_version = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    error = Column(String, nullable=True)
+    tests_passed = Column(Integer, nullable=True)
+    tests_total = Column(Integer, nullable=True)
+    details = Column(JSON, nullable=True)  # E.g., per-test records
+
+
+class EvaluationQueueEntry(Base):
+    """Model representing a pending code submission waiting for an evaluator worker."""
+
+    __tablename__ = "evaluation_queue"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(
+        String, unique=True, nullable=False
+    )  # Job ID of the pending CodeSubmission
+    attempts = Column(Integer, nullable=False, default=0)  # Times the job was claimed
+    available_at = Column(
+        Float, index=True, nullable=False
+    )  # Unix time from which the job may be claimed (i.e., when its lease expires)
+    leased_by = Column(String, nullable=True)  # ID of the worker holding the lease
+    last_error = Column(String, nullable=True)  # Why the last attempt failed, if it did
@@ -1,22 +1,45 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from app.api import code, events, feedback, participants
-from app.core.config import FRONTEND_URL
+from app.core.config import EVALUATION_QUEUE, FRONTEND_URL
 from app.db.base import Base
-from app.db.session import engine
+from app.db.session import SessionLocal, engine
+from app.services.evaluator.evaluator import (
+    evaluate_code,
+    start_evaluator,
+    stop_evaluator,
+)
+from app.services.evaluator.jobs import resume_orphaned_jobs
+from app.services.evaluator.work_queue import requeue_orphaned_jobs
+from app.utils.metrics import render_metrics
 
 
 @asynccontextmanager
 async def lifespan(application: FastAPI):
     """
     Lifespan context manager to handle application startup and shutdown events.
-    In our case, we create the database tables on startup.
+    In our case, we create the database tables, build the evaluator sandbox templates, warm
+    up the evaluator workers, calibrate the evaluation timeouts and load the recorded test
+    durations (to split slow test classes into shards) on startup. Jobs left pending by an
+    earlier run (e.g., a crash) are then queued for the evaluator workers with
+    `EVALUATION_QUEUE`, and evaluated again in the background otherwise.
     """
     Base.metadata.create_all(bind=engine)
+    start_evaluator()
+    resumed = None
+    if EVALUATION_QUEUE:
+        requeue_orphaned_jobs(SessionLocal)
+    else:
+        resumed = asyncio.create_task(resume_orphaned_jobs(SessionLocal, evaluate_code))
     yield
+    if resumed is not None:
+        resumed.cancel()
+    stop_evaluator()
 
 
 # Initialize FastAPI app with lifespan context manager
@@ -45,3 +68,9 @@ app.add_middleware(
 @app.get("/health", tags=["health", "infra", "monitoring", "status"])
 async def health_check():
     return {"status": "ok", "message": "API is running smoothly"}
+
+
+@app.get("/metrics", tags=["infra", "monitoring"], response_class=PlainTextResponse)
+async def metrics():
+    """Expose the API's metrics (e.g., evaluation cache hits) in the Prometheus text format."""
+    return render_metrics()
@@ -0,0 +1,300 @@
+import ast
+import errno
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.services.evaluator.dispatcher import EvaluationResult
+from app.services.evaluator.harness import (
+    TIMEOUT_COLUMNS,
+    TIMING_COLUMNS,
+    USAGE_COLUMNS,
+    DetailedResult,
+)
+from app.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a change to the evaluator can change the result for the same code
+CACHE_FORMAT_VERSION = "1"
+
+# Last lines of the tracebacks of errors raised by hitting a resource limit (see
+# `child.apply_limits`), which may not happen again under other limits or memory pressure
+LIMIT_ERRORS = ("MemoryError", f"OSError: [Errno {errno.EFBIG}]")
+
+CACHE_HITS = Counter(
+    "evaluation_cache_hits_total",
+    "Code evaluations answered from the evaluation cache.",
+    ("tier",),
+)
+CACHE_MISSES = Counter(
+    "evaluation_cache_misses_total",
+    "Code evaluations that were not found in the evaluation cache.",
+)
+
+
+def normalize_code(code: str) -> str:
+    """
+    Normalize user code for cache lookups, so that whitespace-only edits share an entry.
+    Line endings and trailing whitespace are only normalized if that leaves the parsed code
+    (including every position) unchanged, since participants see line and column numbers in
+    error messages, and trailing whitespace inside string literals is significant.
+    :param code: The user code.
+    :return: The normalized code (or the code itself, if it cannot be safely normalized).
+    """
+    normalized = "\n".join(line.rstrip() for line in code.split("\n"))
+    if normalized == code:
+        return code
+    try:
+        original_tree = ast.dump(ast.parse(code), include_attributes=True)
+        normalized_tree = ast.dump(ast.parse(normalized), include_attributes=True)
+    except (SyntaxError, ValueError):
+        return code
+    return normalized if original_tree == normalized_tree else code
+
+
+def is_cacheable(result: EvaluationResult) -> bool:
+    """
+    Check whether an evaluation result only depends on the code and the test suite.
+    Timeouts, crashed workers, errors raised by hitting a resource limit and other
+    infrastructure errors are never cached.
+    :param result: The evaluation result.
+    :return: True if the result may be cached, else False.
+    """
+    status, error = result[0], result[1]
+    if status in ("success", "test_failure", "syntax_error", "high_risk_code"):
+        return True
+    if status != "runtime_error" or not error.startswith("Traceback"):
+        return False
+    return not error.rstrip().rsplit("\n", 1)[-1].startswith(LIMIT_ERRORS)
+
+
+def without_run_details(result: EvaluationResult) -> DetailedResult:
+    """
+    Drop the details that describe a single run of the code (resource usage, timeout and phase
+    timings) from a result, to answer later evaluations of the same code with it.
+    :param result: The evaluation result.
+    :return: The result, with only the details that depend on the code and the test suite.
+    """
+    run_columns = USAGE_COLUMNS + TIMEOUT_COLUMNS + TIMING_COLUMNS
+    details = {
+        column: value
+        for column, value in getattr(result, "details", {}).items()
+        if column not in run_columns
+    }
+    return DetailedResult(*result, **details)
+
+
+class SuiteVersions:
+    """
+    Tracks a content hash of each snippet's test file, so that cached results are
+    invalidated automatically as soon as a test file changes on disk.
+    """
+
+    def __init__(self, code_dir: str, test_files: Dict[str, str]):
+        """
+        Initialize the tracker.
+        :param code_dir: The directory containing the snippet folders.
+        :param test_files: Mapping of snippet ID to its test file, relative to code_dir.
+        """
+        self.code_dir = code_dir
+        self.test_files = dict(test_files)
+        self._versions: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, snippet_id: str) -> Tuple[str, bool]:
+        """
+        Return the current version of a snippet's test suite.
+        :param snippet_id: The ID of the snippet.
+        :return: A tuple of the version and whether it is new to this process (i.e., whether
+            it was seen for the first time or changed since it was last checked).
+        """
+        path = os.path.join(self.code_dir, self.test_files[snippet_id])
+        stat = os.stat(path)
+        fingerprint = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            known = self._versions.get(snippet_id)
+            if known is not None and known[0] == fingerprint:
+                return known[1], False
+            with open(path, "rb") as f:
+                version = hashlib.sha256(f.read()).hexdigest()[:16]
+            self._versions[snippet_id] = (fingerprint, version)
+            return version, known is None or known[1] != version
+
+
+class EvaluationCache:
+    """
+    Content-addressed cache of evaluation results, keyed by a hash of the normalized code,
+    the snippet ID and the version of the snippet's test suite.
+    Results are kept in an in-memory LRU tier and, if a session factory is given, in the
+    `evaluation_cache` table, which is shared by all API processes and survives restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        session_factory: Optional[Callable[[], Session]] = None,
+    ):
+        """
+        Initialize the cache.
+        :param max_entries: The maximum number of entries kept in memory (0 disables the cache).
+        :param session_factory: Factory for database sessions of the persistent tier, if any.
+        """
+        self.max_entries = max_entries
+        self.session_factory = session_factory
+        self._entries: "OrderedDict[str, Tuple[str, EvaluationResult]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache stores anything at all."""
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(
+        code: str, snippet_id: str, suite_version: str, settings: str = ""
+    ) -> str:
+        """
+        Compute the cache key of a submission.
+        :param code: The user code.
+        :param snippet_id: The ID of the snippet.
+        :param suite_version: The version of the snippet's test suite.
+        :param settings: The evaluator settings that can change the result (e.g., resource
+            limits), so that changing them does not replay results obtained under others.
+        :return: The hex SHA-256 digest identifying the submission.
+        """
+        digest = hashlib.sha256()
+        for part in (CACHE_FORMAT_VERSION, snippet_id, suite_version, settings):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        digest.update(normalize_code(code).encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[EvaluationResult]:
+        """
+        Look up a result, first in memory and then in the database.
+        :param key: The cache key (see `make_key`).
+        :return: The cached result, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            CACHE_HITS.inc(tier="memory")
+            return entry[1]
+
+        row = self._query(lambda db: db.get(models.EvaluationCacheEntry, key))
+        if row is None:
+            CACHE_MISSES.inc()
+            return None
+        result = DetailedResult(
+            row.status,
+            row.error or "",
+            row.tests_passed,
+            row.tests_total,
+            **(row.details or {}),
+        )
+        self._remember(key, row.snippet_id, result)
+        CACHE_HITS.inc(tier="database")
+        return result
+
+    def put(
+        self, key: str, snippet_id: str, suite_version: str, result: EvaluationResult
+    ) -> None:
+        """
+        Store a result in both tiers, unless it is not cacheable.
+        :param key: The cache key (see `make_key`).
+        :param snippet_id: The ID of the snippet.
+        :param suite_version: The version of the snippet's test suite.
+        :param result: The evaluation result.
+        """
+        if not self.enabled or not is_cacheable(result):
+            return
+        # Resource usage, timeouts and timings describe a single run, a cache hit does not run
+        cached = without_run_details(result)
+        status, error, tests_passed, tests_total = cached
+        self._remember(key, snippet_id, cached)
+        self._query(
+            lambda db: db.merge(
+                models.EvaluationCacheEntry(
+                    key=key,
+                    snippet_id=snippet_id,
+                    suite_version=suite_version,
+                    status=status,
+                    error=error,
+                    tests_passed=tests_passed,
+                    tests_total=tests_total,
+                    details=cached.details or None,
+                )
+            ),
+            commit=True,
+        )
+
+    def invalidate(self, snippet_id: str, suite_version: str) -> None:
+        """
+        Drop every entry of a snippet that belongs to another version of its test suite.
+        :param snippet_id: The ID of the snippet.
+        :param suite_version: The current version of the snippet's test suite.
+        """
+        with self._lock:
+            for key in [k for k, (s, _) in self._entries.items() if s == snippet_id]:
+                del self._entries[key]
+        self._query(
+            lambda db: db.query(models.EvaluationCacheEntry)
+            .filter(
+                models.EvaluationCacheEntry.snippet_id == snippet_id,
+                models.EvaluationCacheEntry.suite_version != suite_version,
+            )
+            .delete(),
+            commit=True,
+        )
+
+    def stats(self) -> dict:
+        """Return the hit and miss counts and the resulting hit rate."""
+        memory_hits = CACHE_HITS.value(tier="memory")
+        database_hits = CACHE_HITS.value(tier="database")
+        misses = CACHE_MISSES.value()
+        lookups = memory_hits + database_hits + misses
+        return {
+            "memory_hits": memory_hits,
+            "database_hits": database_hits,
+            "misses": misses,
+            "hit_rate": (memory_hits + database_hits) / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, key: str, snippet_id: str, result: EvaluationResult) -> None:
+        """Store a result in the in-memory tier, evicting the least recently used entry."""
+        with self._lock:
+            self._entries[key] = (snippet_id, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _query(self, operation, commit: bool = False):
+        """
+        Run an operation against the persistent tier, treating database errors as misses.
+        :param operation: Function taking a session and returning the value of interest.
+        :param commit: Whether to commit the session after the operation.
+        :return: The value returned by the operation, or None without a persistent tier.
+        """
+        if self.session_factory is None:
+            return None
+        try:
+            with self.session_factory() as db:
+                value = operation(db)
+                if commit:
+                    db.commit()
+                return value
+        except SQLAlchemyError:
+            logger.warning("Evaluation cache database tier unavailable", exc_info=True)
+            return None
@@ -0,0 +1,118 @@
+"""
+Bounded capture of the output of code under evaluation. Output is read incrementally, and
+only the head and the tail of each stream are kept (a traceback ends the output, so the tail
+is the larger part), with an explicit marker where the middle was dropped. Like `child.py`,
+it must only depend on the standard library.
+"""
+
+import os
+import selectors
+import time
+from typing import Callable, Dict, Optional
+
+# Bytes kept from the start and from the end of each captured stream
+HEAD_BYTES = 4 * 1024
+TAIL_BYTES = 16 * 1024
+
+# Size of a single read from a child's pipe
+READ_SIZE = 64 * 1024
+
+
+def truncation_marker(omitted: int) -> str:
+    """Return the marker replacing the middle of an output that was too long to keep."""
+    return f"\n[... {omitted} bytes of output truncated ...]\n"
+
+
+def output_limit_error(stdout: str, stderr: str, max_bytes: int) -> str:
+    """
+    Return the error reported for a submission that was killed for printing too much.
+    :param stdout: The captured (truncated) standard output of the submission.
+    :param stderr: The captured (truncated) standard error of the submission.
+    :param max_bytes: The output budget the submission exceeded.
+    :return: The captured output (standard error if any), followed by the reason.
+    """
+    output = (stderr or stdout).rstrip("\n")
+    message = f"Execution stopped after producing more than {max_bytes} bytes of output"
+    return f"{output}\n{message}" if output else message
+
+
+class HeadTailBuffer:
+    """
+    Keeps the first `head_bytes` and the last `tail_bytes` of everything written to it, so
+    that its size stays bounded however much is written.
+    """
+
+    def __init__(self, head_bytes: int = HEAD_BYTES, tail_bytes: int = TAIL_BYTES):
+        """
+        Initialize an empty buffer.
+        :param head_bytes: The number of bytes kept from the start of the output.
+        :param tail_bytes: The number of bytes kept from the end of the output.
+        """
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    def write(self, data: bytes) -> None:
+        """Append data, dropping what falls between the head and the tail."""
+        self.total += len(data)
+        room = self.head_bytes - len(self._head)
+        if room > 0:
+            self._head += data[:room]
+            data = data[room:]
+        if data:
+            self._tail += data
+            if len(self._tail) > self.tail_bytes:
+                del self._tail[: len(self._tail) - self.tail_bytes]
+
+    @property
+    def omitted(self) -> int:
+        """The number of bytes dropped from the middle of the output."""
+        return self.total - len(self._head) - len(self._tail)
+
+    def getvalue(self) -> str:
+        """
+        Return the kept output as text.
+        :return: The head and the tail, separated by a truncation marker if bytes were dropped.
+        """
+        if not self.omitted:
+            return (self._head + self._tail).decode("utf-8", "replace")
+        return (
+            self._head.decode("utf-8", "replace")
+            + truncation_marker(self.omitted)
+            + self._tail.decode("utf-8", "replace")
+        )
+
+
+def drain(
+    sinks: Dict[int, Callable[[bytes], None]],
+    deadline: float,
+    over_budget: Callable[[], bool],
+) -> Optional[str]:
+    """
+    Read file descriptors (pipes from a child) until all of them are closed, passing every
+    chunk to the sink of its descriptor. The descriptors are not closed.
+    :param sinks: Mapping of file descriptor to the function receiving what is read from it.
+    :param deadline: The `time.monotonic()` time at which to stop reading.
+    :param over_budget: Called after every read; reading stops as soon as it returns True.
+    :return: None if all descriptors were closed, "timeout" if the deadline passed first,
+        or "output_limit" if the budget was exceeded first.
+    """
+    # Not `select.select`, which fails for descriptors numbered 1024 and up
+    with selectors.DefaultSelector() as selector:
+        for fd in sinks:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return "timeout"
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, READ_SIZE)
+                if not chunk:
+                    selector.unregister(key.fd)
+                    continue
+                sinks[key.fd](chunk)
+                if over_budget():
+                    return "output_limit"
+    return None
@@ -0,0 +1,171 @@
+"""
+Helpers shared by the scripts that run user code in a child process (the harness and the
+function-level runner). Kept apart from the harness, so that the runner does not pay for
+importing `unittest`; it must only depend on the standard library.
+"""
+
+import builtins
+import os
+import resource
+import signal
+import sys
+import traceback
+from types import CodeType, FrameType
+from typing import Optional, Set
+
+# Name under which line coverage claims the coverage tool ID of `sys.monitoring`
+COVERAGE_TOOL_NAME = "exceed-line-coverage"
+
+
+def apply_limits(
+    max_memory_mb: int = 0, max_cpu_seconds: int = 0, max_file_size_mb: int = 0
+) -> None:
+    """
+    Limit the resources of the current process (and of any process it starts).
+    Exceeding the memory limit raises MemoryError, exceeding the file size limit makes writes
+    fail with OSError, and exceeding the CPU time limit kills the process with SIGXCPU.
+    :param max_memory_mb: The maximum size of the address space in MiB (0 for unlimited).
+    :param max_cpu_seconds: The maximum CPU time (user and system) in seconds (0 for unlimited).
+    :param max_file_size_mb: The maximum size of a written file in MiB (0 for unlimited).
+    """
+    if max_memory_mb > 0:
+        _lower_limit(resource.RLIMIT_AS, max_memory_mb * 1024 * 1024)
+    if max_cpu_seconds > 0:
+        _lower_limit(resource.RLIMIT_CPU, max_cpu_seconds, max_cpu_seconds + 1)
+    if max_file_size_mb > 0:
+        # Report oversized writes as exceptions in the user's code, instead of killing it
+        signal.signal(signal.SIGXFSZ, signal.SIG_IGN)
+        _lower_limit(resource.RLIMIT_FSIZE, max_file_size_mb * 1024 * 1024)
+
+
+def run_as_main(user_code: CodeType, user_code_path: str) -> int:
+    """
+    Execute compiled user code as the `__main__` module, like `python <file>` would.
+    :param user_code: The compiled user code.
+    :param user_code_path: The path of the user code file.
+    :return: The exit code the interpreter would have exited with.
+    """
+    sys.argv = [user_code_path]
+    namespace = {
+        "__name__": "__main__",
+        "__file__": user_code_path,
+        "__builtins__": builtins,
+    }
+    exit_code = 0
+    try:
+        exec(user_code, namespace)
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Skip this frame, so that the traceback starts at the user's module
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return exit_code
+
+
+def peak_rss_kb() -> Optional[int]:
+    """
+    Return the peak resident set size of this process's own memory, in KiB. Unlike
+    `ru_maxrss`, which keeps the high-water mark of the process that forked this one (even
+    across exec, so that a child of a large API process reports the API process's size), the
+    `VmHWM` of `/proc/self/status` starts over from the current size on exec and fork.
+    :return: The peak resident set size, or None where `/proc` is not available.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+class LineCoverage:
+    """
+    Records which lines of one file (the user's module) run, as a bitmap.
+
+    On Python 3.12+, it listens to the LINE events of `sys.monitoring` and disables every
+    location after its first event, so that each line costs one callback however often it
+    runs (and lines of other files, e.g. of `unittest`, one callback each). Older interpreters
+    fall back to `sys.settrace`, tracing only the frames of the file, which is much slower.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Initialize without any line recorded.
+        :param filename: The path of the file whose lines are recorded.
+        """
+        self.filename = os.path.abspath(filename)
+        self.lines: Set[int] = set()
+        self._monitoring = getattr(sys, "monitoring", None)
+
+    def start(self) -> None:
+        """Start recording the lines that run (on every thread with `sys.monitoring`)."""
+        monitoring = self._monitoring
+        if monitoring is None:
+            sys.settrace(self._trace)
+            return
+        monitoring.use_tool_id(monitoring.COVERAGE_ID, COVERAGE_TOOL_NAME)
+        # Locations disabled by an earlier recording (in this interpreter) report again
+        monitoring.restart_events()
+        monitoring.register_callback(
+            monitoring.COVERAGE_ID, monitoring.events.LINE, self._on_line
+        )
+        monitoring.set_events(monitoring.COVERAGE_ID, monitoring.events.LINE)
+
+    def stop(self) -> None:
+        """Stop recording."""
+        monitoring = self._monitoring
+        if monitoring is None:
+            sys.settrace(None)
+            return
+        monitoring.set_events(monitoring.COVERAGE_ID, monitoring.events.NO_EVENTS)
+        monitoring.register_callback(
+            monitoring.COVERAGE_ID, monitoring.events.LINE, None
+        )
+        monitoring.free_tool_id(monitoring.COVERAGE_ID)
+
+    def bitmap(self) -> str:
+        """
+        Encode the recorded lines as a bitmap.
+        :return: The bitmap in hexadecimal, bit i being set if line i + 1 ran.
+        """
+        mask = 0
+        for line in self.lines:
+            if line > 0:
+                mask |= 1 << (line - 1)
+        return format(mask, "x")
+
+    def _on_line(self, code: CodeType, line: int) -> object:
+        if code.co_filename == self.filename:
+            self.lines.add(line)
+        return self._monitoring.DISABLE
+
+    def _trace(self, frame: FrameType, event: str, arg: object):
+        # Only the frames of the file are traced line by line
+        if frame.f_code.co_filename != self.filename:
+            return None
+        return self._trace_lines
+
+    def _trace_lines(self, frame: FrameType, event: str, arg: object):
+        if event == "line":
+            self.lines.add(frame.f_lineno)
+        return self._trace_lines
+
+
+def _lower_limit(limit: int, soft: int, hard: Optional[int] = None) -> None:
+    """Lower a resource limit, never raising it above the current hard limit."""
+    _, current_hard = resource.getrlimit(limit)
+    hard = soft if hard is None else hard
+    if current_hard != resource.RLIM_INFINITY:
+        soft, hard = min(soft, current_hard), min(hard, current_hard)
+    resource.setrlimit(limit, (soft, hard))
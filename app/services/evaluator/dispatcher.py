@@ -0,0 +1,320 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import EVALUATOR_MAX_CONCURRENCY, EVALUATOR_MAX_QUEUE
+from app.utils import cancellation
+from app.utils.metrics import Counter, Histogram
+
+EvaluationResult = Tuple[str, str, Optional[int], Optional[int]]
+
+# Number of recent evaluations the mean evaluation time is measured over
+DURATION_WINDOW = 100
+
+# Mean evaluation time (in seconds) assumed before any evaluation has completed
+DEFAULT_EVALUATION_SECONDS = 1.0
+
+EVALUATIONS_REJECTED = Counter(
+    "evaluations_rejected_total",
+    "Code evaluations rejected because the evaluation queue was full.",
+)
+
+EVALUATIONS_CANCELLED = Counter(
+    "evaluations_cancelled_total",
+    "Code evaluations cancelled because nobody waited for them anymore (e.g., the client "
+    "disconnected), by whether they were still waiting for a worker or already running.",
+    ("stage",),
+)
+EVALUATION_SECONDS_SAVED = Counter(
+    "evaluation_cancelled_seconds_saved_total",
+    "Estimated evaluation time saved by cancellations: the mean evaluation time for "
+    "evaluations still waiting, and what remained of it for running ones.",
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "evaluation_queue_wait_seconds",
+    "Time code evaluations waited for a worker, by snippet and kind of attempt.",
+    ("snippet_id", "attempt"),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+
+
+class EvaluationQueueFull(Exception):
+    """Raised when an evaluation is not admitted because the evaluation queue is full."""
+
+    def __init__(self, retry_after: int):
+        """
+        :param retry_after: The number of seconds after which a retry is likely to be admitted.
+        """
+        super().__init__(
+            f"Evaluation queue is full, retry after {retry_after} seconds."
+        )
+        self.retry_after = retry_after
+
+
+class Admission:
+    """A slot in the dispatcher, held from admission until the evaluation completes."""
+
+    def __init__(self, dispatcher: "EvaluationDispatcher"):
+        self._dispatcher = dispatcher
+        self._released = False
+
+    def release(self) -> None:
+        """Give the slot back (e.g., if the evaluation will not run after all)."""
+        if not self._released:
+            self._released = True
+            self._dispatcher._release()
+
+
+class FairQueue:
+    """
+    Evaluations waiting for a worker, served by deficit round-robin across participants.
+    Participants with waiting evaluations take turns; a turn credits the participant a
+    quantum of evaluation time, and the participant's evaluations are charged their
+    duration (estimated when they start, corrected once they complete). Participants whose
+    evaluations take long, or who resubmit in quick succession, therefore get the same share
+    of the workers as everyone else. First attempts are always served before retries.
+    Not thread-safe: the dispatcher holds its lock around every call.
+    """
+
+    def __init__(self):
+        # First attempts, then retries: participant -> its waiting evaluations, in turn order
+        self._rounds: Tuple[OrderedDict, OrderedDict] = (OrderedDict(), OrderedDict())
+        # Participant -> evaluation time (in seconds) it may still use in the current turn
+        self._deficits: Dict[str, float] = {}
+        self._running: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return sum(len(items) for rnd in self._rounds for items in rnd.values())
+
+    def push(self, participant_id: str, retry: bool, item: Any) -> None:
+        """
+        Add an evaluation to the queue.
+        :param participant_id: The participant the evaluation is for.
+        :param retry: Whether the evaluation is a retry (i.e., not the first attempt).
+        :param item: The evaluation, returned as is by `pop`.
+        """
+        self._rounds[retry].setdefault(participant_id, deque()).append(item)
+
+    def pop(self, cost: float, quantum: float) -> Optional[Tuple[str, Any]]:
+        """
+        Take the next evaluation to run, charging its participant the estimated cost.
+        :param cost: The estimated duration of the evaluation (in seconds).
+        :param quantum: The evaluation time credited to a participant every turn.
+        :return: The participant and the evaluation, or None if the queue is empty.
+        """
+        for rnd in self._rounds:
+            while rnd:
+                participant_id, items = next(iter(rnd.items()))
+                deficit = self._deficits.get(participant_id, 0.0)
+                if deficit <= 0:
+                    # Turn over: credit the next one and go to the back of the round
+                    self._deficits[participant_id] = deficit + quantum
+                    rnd.move_to_end(participant_id)
+                    continue
+                item = items.popleft()
+                if not items:
+                    del rnd[participant_id]
+                self._deficits[participant_id] = deficit - cost
+                self._running[participant_id] = self._running.get(participant_id, 0) + 1
+                return participant_id, item
+        return None
+
+    def done(self, participant_id: str, correction: float) -> None:
+        """
+        Record that an evaluation taken from the queue completed.
+        :param participant_id: The participant the evaluation was for.
+        :param correction: The actual duration of the evaluation minus its estimated cost.
+        """
+        self._deficits[participant_id] = (
+            self._deficits.get(participant_id, 0.0) - correction
+        )
+        self._running[participant_id] -= 1
+        if self._running[participant_id] > 0 or any(
+            participant_id in rnd for rnd in self._rounds
+        ):
+            return
+        # Idle: unused credit is not kept for later, debt is
+        del self._running[participant_id]
+        if self._deficits[participant_id] >= 0:
+            del self._deficits[participant_id]
+
+
+class EvaluationDispatcher:
+    """
+    Runs blocking code evaluations on a bounded thread pool, off the event loop.
+    Evaluations wait for subprocesses (or pool workers) for up to tens of seconds, so running
+    them directly inside an `async def` endpoint would stall every other request served by
+    the same worker. At most `max_workers` evaluations run at once and at most `max_queue`
+    more wait their turn; further evaluations are not admitted (see `admit`), so that a burst
+    of submissions cannot pile up unbounded work on the host. Waiting evaluations are
+    started in fair-share order across participants, first attempts first (see `FairQueue`).
+    """
+
+    def __init__(self, max_workers: int, max_queue: int = 0):
+        """
+        Initialize the dispatcher.
+        :param max_workers: The maximum number of evaluations running at the same time.
+        :param max_queue: The maximum number of admitted evaluations waiting for a worker.
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="evaluator"
+        )
+        self._admitted = 0
+        self._running = 0
+        self._waiting = FairQueue()
+        # Evaluations running on a worker -> when they started
+        self._started: Dict[Future, float] = {}
+        self._durations: deque = deque(maxlen=DURATION_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of admitted evaluations waiting for a worker."""
+        return max(0, self._admitted - self.max_workers)
+
+    def admit(self) -> Admission:
+        """
+        Reserve a slot for an evaluation, either on a worker or in the queue.
+        :raises EvaluationQueueFull: If all workers are busy and the queue is full.
+        :return: The admission, to pass to `run` (or to release if the evaluation is dropped).
+        """
+        with self._lock:
+            if self._admitted >= self.max_workers + self.max_queue:
+                EVALUATIONS_REJECTED.inc()
+                raise EvaluationQueueFull(self._retry_after())
+            self._admitted += 1
+        return Admission(self)
+
+    async def run(
+        self,
+        evaluate: Callable[[str, str], EvaluationResult],
+        code: str,
+        snippet_id: str,
+        admission: Optional[Admission] = None,
+        participant_id: str = "",
+        attempt_number: int = 1,
+    ) -> EvaluationResult:
+        """
+        Run an evaluation function on the thread pool, once it is the evaluation's turn, and
+        wait for its result.
+        :param evaluate: The (blocking) evaluation function, usually `evaluate_code`.
+        :param code: The user code to evaluate.
+        :param snippet_id: The ID of the snippet to evaluate against.
+        :param admission: The admission obtained for this evaluation (admitted now if None).
+        :param participant_id: The participant the evaluation is for, to share the workers
+            fairly between participants.
+        :param attempt_number: The attempt the evaluation is for; first attempts are started
+            before retries.
+        :raises EvaluationQueueFull: If no admission was given and the queue is full.
+        :return: The status tuple returned by the evaluation function.
+        """
+        if admission is None:
+            admission = self.admit()
+        job = Future()
+        retry = attempt_number > 1
+        scope = cancellation.CancelScope()
+        try:
+            with self._lock:
+                self._waiting.push(
+                    participant_id,
+                    retry,
+                    (evaluate, code, snippet_id, job, scope, retry, time.monotonic()),
+                )
+            self._start_waiting()
+            return await asyncio.wrap_future(job)
+        except asyncio.CancelledError:
+            self._cancel(job, scope)
+            raise
+        finally:
+            admission.release()
+
+    def _cancel(self, job: Future, scope: cancellation.CancelScope) -> None:
+        """Stop an evaluation nobody waits for anymore (e.g., the client disconnected)."""
+        with self._lock:
+            mean = self._mean_duration()
+            started = self._started.get(job)
+        if job.cancel():
+            # Still waiting for a worker, so it will not run at all
+            EVALUATIONS_CANCELLED.inc(stage="waiting")
+            EVALUATION_SECONDS_SAVED.inc(mean)
+        elif not job.done():
+            scope.cancel()
+            EVALUATIONS_CANCELLED.inc(stage="running")
+            if started is not None:
+                EVALUATION_SECONDS_SAVED.inc(
+                    max(0.0, mean - (time.monotonic() - started))
+                )
+
+    def _start_waiting(self) -> None:
+        """Start the next waiting evaluations, as long as workers are free."""
+        with self._lock:
+            while self._running < self.max_workers:
+                cost = self._mean_duration()
+                taken = self._waiting.pop(cost, quantum=cost)
+                if taken is None:
+                    return
+                self._running += 1
+                self._executor.submit(self._execute, *taken, cost)
+
+    def _execute(self, participant_id: str, item: tuple, cost: float) -> None:
+        """Run a waiting evaluation on a worker thread, recording how long it took."""
+        evaluate, code, snippet_id, job, scope, retry, queued_at = item
+        duration = result = error = None
+        # Not run at all if the caller stopped waiting for it in the meantime
+        if job.set_running_or_notify_cancel():
+            QUEUE_WAIT_SECONDS.observe(
+                time.monotonic() - queued_at,
+                snippet_id=snippet_id,
+                attempt="retry" if retry else "first",
+            )
+            start = time.monotonic()
+            with self._lock:
+                self._started[job] = start
+            try:
+                with cancellation.activate(scope):
+                    result = evaluate(code, snippet_id)
+            except BaseException as e:
+                error = e
+            duration = time.monotonic() - start
+        with self._lock:
+            self._started.pop(job, None)
+            # Cancelled evaluations say nothing about how long an evaluation takes
+            if duration is not None and not isinstance(error, cancellation.Cancelled):
+                self._durations.append(duration)
+            self._waiting.done(participant_id, (duration or 0.0) - cost)
+            self._running -= 1
+        self._start_waiting()
+        if duration is not None:
+            if error is not None:
+                job.set_exception(error)
+            else:
+                job.set_result(result)
+
+    def _release(self) -> None:
+        """Free the slot of a completed (or dropped) evaluation."""
+        with self._lock:
+            self._admitted -= 1
+
+    def _mean_duration(self) -> float:
+        """Return the mean duration (in seconds) of recent evaluations (the caller holds the lock)."""
+        if not self._durations:
+            return DEFAULT_EVALUATION_SECONDS
+        return sum(self._durations) / len(self._durations)
+
+    def _retry_after(self) -> int:
+        """
+        Estimate when a new evaluation would be admitted (the caller holds the lock): the
+        queue drains at `max_workers` evaluations per mean evaluation time.
+        :return: The estimate, in whole seconds (at least 1).
+        """
+        waiting = self.queue_depth + 1
+        return max(1, math.ceil(waiting * self._mean_duration() / self.max_workers))
+
+
+dispatcher = EvaluationDispatcher(EVALUATOR_MAX_CONCURRENCY, EVALUATOR_MAX_QUEUE)
@@ -1,13 +1,237 @@
-import importlib.util
+import atexit
+import contextlib
+import json
+import logging
 import os
-import re
-import shutil
+import signal
 import subprocess
 import sys
-import tempfile
-import ast
-from types import ModuleType
-from typing import Optional, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+from app.core.config import (
+    EVALUATION_CACHE_PERSISTENT,
+    EVALUATION_CACHE_SIZE,
+    EVALUATOR_ENGINE,
+    EVALUATOR_LINE_COVERAGE,
+    EVALUATOR_MAX_CPU_SECONDS,
+    EVALUATOR_MAX_FILE_SIZE_MB,
+    EVALUATOR_MAX_MEMORY_MB,
+    EVALUATOR_MAX_OUTPUT_KB,
+    EVALUATOR_POOL_MAX_JOBS,
+    EVALUATOR_POOL_SIZE,
+    EVALUATOR_SANDBOX_DIR,
+    EVALUATOR_TEST_SHARDS,
+    EVALUATOR_TIMEOUT_FLOOR_SECONDS,
+    EVALUATOR_TIMEOUT_MULTIPLIER,
+)
+from app.data.snippets import CODE_DIR, SNIPPETS, refresh_tests
+from app.db.session import SessionLocal
+from app.services.evaluator.cache import EvaluationCache, SuiteVersions
+from app.services.evaluator.capture import HeadTailBuffer, drain, output_limit_error
+from app.services.evaluator.harness import (
+    DetailedResult,
+    outcome_to_result,
+    timeout_message,
+    usage_details,
+)
+from app.services.evaluator.phases import PhaseTimings
+from app.services.evaluator.pool import EvaluatorPool
+from app.services.evaluator.reference import ReferenceOutcomes
+from app.services.evaluator.sandbox import SandboxTemplates
+from app.services.evaluator.scanner import detect_malicious_code
+from app.services.evaluator.sharding import (
+    DurationHistory,
+    list_test_methods,
+    merge_shard_results,
+    plan_shards,
+)
+from app.services.evaluator.syntax_check import check_syntax
+from app.services.evaluator.timeouts import AdaptiveTimeouts
+from app.utils import cancellation
+from app.utils.enums import EvaluatorEngine
+from app.utils.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+EVALUATION_PROCESSES_CANCELLED = Counter(
+    "evaluation_processes_cancelled_total",
+    "Processes running user code that were killed because their evaluation was cancelled.",
+)
+
+# Snippet ID -> (snippet file, test file, test class), relative to CODE_DIR
+SNIPPET_TESTS = {
+    snippet_id: snippet.test_spec for snippet_id, snippet in SNIPPETS.items()
+}
+
+# Timeout (in seconds) for running the user code, and for running the tests, before the
+# snippet's timeout is calibrated against its reference solution
+EXECUTION_TIMEOUT = 10
+
+# Resource limits applied to every process running user code (0 meaning unlimited)
+RESOURCE_LIMITS = {
+    "max_memory_mb": EVALUATOR_MAX_MEMORY_MB,
+    "max_cpu_seconds": EVALUATOR_MAX_CPU_SECONDS,
+    "max_file_size_mb": EVALUATOR_MAX_FILE_SIZE_MB,
+}
+
+# Output (standard output and error together) after which a process running user code is
+# killed; only the head and tail of its output are kept in any case
+MAX_OUTPUT_BYTES = EVALUATOR_MAX_OUTPUT_KB * 1024
+
+# Script running the user code and its tests in one interpreter, and the file it reports to
+HARNESS_PATH = os.path.join(os.path.dirname(__file__), "harness.py")
+HARNESS_RESULT_FILE = ".harness_result.json"
+
+# Script running the user code against test cases given as data (`function` engine)
+RUNNER_PATH = os.path.join(os.path.dirname(__file__), "user_runner.py")
+
+# Per-snippet directories holding everything but the user file, built once on a tmpfs
+sandbox_templates = SandboxTemplates(CODE_DIR, SNIPPET_TESTS, EVALUATOR_SANDBOX_DIR)
+atexit.register(sandbox_templates.cleanup)
+
+# Results of earlier evaluations, invalidated whenever a snippet's test file changes
+evaluation_cache = EvaluationCache(
+    EVALUATION_CACHE_SIZE, SessionLocal if EVALUATION_CACHE_PERSISTENT else None
+)
+suite_versions = SuiteVersions(
+    CODE_DIR,
+    {
+        # The `function` engine checks a snippet's test cases instead of its test file
+        snippet_id: (
+            snippet.cases_file
+            if EVALUATOR_ENGINE == EvaluatorEngine.FUNCTION.value and snippet.cases
+            else snippet.test_file
+        )
+        for snippet_id, snippet in SNIPPETS.items()
+    },
+)
+
+# Outcomes of the original snippets, computed on startup (see `compute_reference_outcomes`)
+reference_outcomes = ReferenceOutcomes(CODE_DIR, suite_versions.test_files)
+
+# Per-snippet timeouts of a whole run, calibrated on startup (see `calibrate_timeouts`)
+adaptive_timeouts = AdaptiveTimeouts(
+    EVALUATOR_TIMEOUT_MULTIPLIER, EVALUATOR_TIMEOUT_FLOOR_SECONDS, 2 * EXECUTION_TIMEOUT
+)
+
+# Durations of the snippets' tests, to split test classes into shards of similar duration
+test_durations = DurationHistory()
+
+_pool: Optional[EvaluatorPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_evaluator_pool() -> EvaluatorPool:
+    """
+    Return the shared evaluator worker pool, creating and starting it on first use.
+    :return: The started EvaluatorPool instance.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EvaluatorPool(
+                size=EVALUATOR_POOL_SIZE,
+                max_jobs=EVALUATOR_POOL_MAX_JOBS,
+                code_dir=CODE_DIR,
+                snippet_tests=SNIPPET_TESTS,
+                test_code={
+                    snippet_id: snippet.test_code
+                    for snippet_id, snippet in SNIPPETS.items()
+                },
+                timeout=EXECUTION_TIMEOUT,
+                sandbox=sandbox_templates,
+                limits=RESOURCE_LIMITS,
+                max_output_bytes=MAX_OUTPUT_BYTES,
+                coverage=EVALUATOR_LINE_COVERAGE,
+            )
+            _pool.start()
+        return _pool
+
+
+def calibrate_timeouts() -> dict:
+    """
+    Time the reference solution of every snippet that has one with the configured engine,
+    and derive the snippet's timeout from it (snippets without one keep the default timeout).
+    :return: Mapping of snippet ID to the calibrated timeout (in seconds).
+    """
+    for snippet_id, snippet in SNIPPETS.items():
+        if snippet.solution is None:
+            continue
+        baseline = adaptive_timeouts.calibrate(
+            snippet_id, lambda: _evaluate_uncached(snippet.solution, snippet_id)
+        )
+        if baseline is None:
+            logger.warning(
+                "Reference solution of snippet %s does not pass its tests, "
+                "keeping the default timeout",
+                snippet_id,
+            )
+    return {
+        snippet_id: adaptive_timeouts.timeout(snippet_id)
+        for snippet_id in adaptive_timeouts.baselines()
+    }
+
+
+def compute_reference_outcomes() -> dict:
+    """
+    Evaluate the original code of every snippet with the configured engine, to answer
+    submissions of the unchanged original code without evaluating them.
+    :return: Mapping of snippet ID to the status of the original code (for the snippets
+        whose outcome is deterministic, e.g., not a timeout).
+    """
+    return reference_outcomes.compute(
+        {snippet_id: snippet.code for snippet_id, snippet in SNIPPETS.items()},
+        _evaluate_uncached,
+    )
+
+
+def check_engine() -> None:
+    """
+    Check that `EVALUATOR_ENGINE` names one of the engines, rather than silently running
+    every submission with the `subprocess` engine.
+    :raises ValueError: If the engine is not supported.
+    """
+    engines = [engine.value for engine in EvaluatorEngine]
+    if EVALUATOR_ENGINE not in engines:
+        raise ValueError(
+            f"Unsupported evaluator engine: {EVALUATOR_ENGINE} "
+            f"(EVALUATOR_ENGINE must be one of {', '.join(engines)})"
+        )
+
+
+def start_evaluator() -> None:
+    """
+    Get ready to evaluate submissions: build the sandbox templates, warm up the evaluator
+    workers, calibrate the evaluation timeouts, evaluate the original snippets and load the
+    recorded test durations (to split slow test classes into shards).
+    :raises ValueError: If `EVALUATOR_ENGINE` is not supported.
+    """
+    check_engine()
+    sandbox_templates.prepare()
+    if EVALUATOR_ENGINE == EvaluatorEngine.POOL.value:
+        get_evaluator_pool()
+    calibrate_timeouts()
+    compute_reference_outcomes()
+    if EVALUATOR_TEST_SHARDS > 1:
+        test_durations.load(SessionLocal)
+
+
+def stop_evaluator() -> None:
+    """Stop the evaluator workers and remove the sandbox templates."""
+    shutdown_evaluator_pool()
+    sandbox_templates.cleanup()
+
+
+def shutdown_evaluator_pool() -> None:
+    """Stop the shared evaluator worker pool, if it was started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
 
 
 def evaluate_code(
@@ -17,235 +241,343 @@ def evaluate_code(
     Evaluate user code against a predefined snippet and its test suite.
     This function performs the following steps:
 
-    1) Syntax‐check the code.
-    2) Copy user code and test suite to temp dir.
-    3) Run the user code to check for runtime errors.
-    4) Run only the relevant unittest class for the snippet.
+    1) Return the outcome of the original snippet, computed on startup, if the code is the
+       original code (up to trailing whitespace), else the cached result if the same
+       (normalized) code was evaluated before against the current version of the snippet's
+       test suite.
+    2) Scan for malicious code (single pass, verdicts remembered per code hash).
+    3) Write the user code to a fresh directory on top of the snippet's sandbox template,
+       and syntax-check the code in-process (reusing the scan's parse).
+    4) Run the user code to check for runtime errors and, in the same child process,
+       run only the relevant unittest class for the snippet (or, with the `function`
+       engine, the snippet's test cases given as data, if it has any). Test classes
+       that take long enough may be split across several child processes (see
+       `EVALUATOR_TEST_SHARDS`).
     5) If errors are encountered, rephrase the error message using an LLM.
     6) Return the evaluation status, rephrased error message, and test results.
 
     :param code: The user code to evaluate.
     :param snippet_id: The ID of the snippet to evaluate against.
+    :raises cancellation.Cancelled: If the active cancel scope (see `app.utils.cancellation`)
+        is cancelled, in which case the evaluation's child processes are killed.
     :return: A tuple containing:
         - status: "success", "syntax_error", "runtime_error", "test_failure", "not_found", or "high_risk_code"
         - produced error message (if applicable)
         - number of tests passed (if applicable)
         - total number of tests (if applicable)
     """
-    snippet_map = {
-        "A": ("snippetA/snippetA.py", "snippetA/test_snippetA.py", "TestSnippetA"),
-        "B": ("snippetB/snippetB.py", "snippetB/test_snippetB.py", "TestSnippetB"),
-        "C": ("snippetC/snippetC.py", "snippetC/test_snippetC.py", "TestSnippetC"),
-        "D": ("snippetD/snippetD.py", "snippetD/test_snippetD.py", "TestSnippetD"),
-    }
-    if snippet_id not in snippet_map:
+    if snippet_id not in SNIPPET_TESTS:
         return "not_found", f"No test suite defined for {snippet_id}", None, None
-    snippet_file, test_file, test_class = snippet_map[snippet_id]
-    code_dir = os.path.join(os.path.dirname(__file__), "../../data/code")
-
-    with tempfile.TemporaryDirectory() as td:
-        # Write user code to temp dir (overwriting the reference snippet file)
-        user_code_path = os.path.join(td, os.path.basename(snippet_file))
-        with open(user_code_path, "w") as f:
-            f.write(code)
-        # Copy all other snippet files (from their folders)
-        for folder in ["snippetA", "snippetB", "snippetC", "snippetD"]:
-            src = os.path.join(code_dir, folder, f"{folder}.py")
-            dst = os.path.join(td, f"{folder}.py")
-            if src != os.path.join(code_dir, snippet_file):
-                shutil.copyfile(src, dst)
-
-        # Copy only the relevant test file from its snippet folder
-        test_src = os.path.join(code_dir, test_file)
-        test_dst = os.path.join(td, os.path.basename(test_file))
-        shutil.copyfile(test_src, test_dst)
-
-        # Malicious code detection
-        if _detect_malicious_code(code):
-            return "high_risk_code", "Malicious or high-risk code detected.", None, None
-
-        # Syntax check user code
-        try:
-            subprocess.check_output(
-                [sys.executable, "-m", "py_compile", user_code_path],
-                stderr=subprocess.STDOUT,
-            )
-        except subprocess.CalledProcessError as e:
-            # Syntax error when compiling the file, return the error
-            return "syntax_error", e.output.decode("utf-8"), None, None
+    cancellation.raise_if_cancelled()
 
-        # Run the file itself
-        try:
-            run_result = subprocess.run(
-                [sys.executable, user_code_path],
-                cwd=td,
-                capture_output=True,
-                text=True,
-                timeout=10,
+    timings = PhaseTimings()
+    with timings.phase("reference"):
+        reference = reference_outcomes.get(code, snippet_id)
+    if reference is not None:
+        # Unchanged original snippet: its outcome is known, nothing to run
+        return timings.attach(reference)
+    if not evaluation_cache.enabled:
+        return timings.attach(_evaluate_uncached(code, snippet_id, timings))
+
+    with timings.phase("cache"):
+        suite_version, changed = suite_versions.get(snippet_id)
+        if changed:
+            evaluation_cache.invalidate(snippet_id, suite_version)
+        key = evaluation_cache.make_key(
+            code, snippet_id, suite_version, cache_settings()
+        )
+        cached = evaluation_cache.get(key)
+    if cached is not None:
+        return timings.attach(cached)
+    result = _evaluate_uncached(code, snippet_id, timings)
+    evaluation_cache.put(key, snippet_id, suite_version, result)
+    return timings.attach(result)
+
+
+def cache_settings() -> str:
+    """Return the evaluator settings that can change a result, for its cache key."""
+    return json.dumps(
+        {**RESOURCE_LIMITS, "line_coverage": EVALUATOR_LINE_COVERAGE}, sort_keys=True
+    )
+
+
+def _evaluate_uncached(
+    code: str, snippet_id: str, timings: Optional[PhaseTimings] = None
+) -> Tuple[str, str, Optional[int], Optional[int]]:
+    """
+    Evaluate user code against a known snippet, without consulting the evaluation cache.
+    :param code: The user code to evaluate.
+    :param snippet_id: The ID of the snippet to evaluate against.
+    :param timings: Records the duration of each phase of the evaluation, if given.
+    :return: The status tuple (see `evaluate_code`).
+    """
+    timings = timings or PhaseTimings()
+    # Edited test files (and test cases) apply right away, without a restart
+    snippet = refresh_tests(snippet_id)
+    # Scan for malicious code first, so that rejected code costs no I/O at all
+    with timings.phase("scan"):
+        high_risk, tree = detect_malicious_code(code)
+    if high_risk:
+        return "high_risk_code", "Malicious or high-risk code detected.", None, None
+
+    # A single timeout for the whole run (the user code and its tests)
+    timeout = adaptive_timeouts.timeout(snippet_id)
+    if EVALUATOR_ENGINE == EvaluatorEngine.POOL.value:
+        # Pre-warmed workers take care of the remaining steps
+        pool = get_evaluator_pool()
+        pool.update_tests(snippet_id, snippet.test_code)
+        with timings.phase("execute"):
+            result = pool.evaluate(code, snippet_id, timeout)
+        if result[0] == "syntax_error":
+            return result
+        return _with_timeout(result, timeout)
+
+    _, test_file, test_class = SNIPPET_TESTS[snippet_id]
+    with contextlib.ExitStack() as stack:
+        # Only the user file is written, the other modules and the (precompiled) test module
+        # are found in the snippet's template, right after the user's directory on sys.path
+        with timings.phase("setup"):
+            template_dir = sandbox_templates.template_dir(snippet_id)
+            td, user_code_path = stack.enter_context(
+                sandbox_templates.submission_dir(snippet_id, code)
             )
-            if run_result.returncode != 0:
-                # Runtime error when running the file
-                error_msg = run_result.stderr or run_result.stdout
-                return "runtime_error", error_msg, None, None
-        except Exception as e:
-            return "runtime_error", str(e), None, None
-
-        # Run only the relevant test class in the relevant test file
-        try:
-            result = subprocess.run(
-                [
-                    sys.executable,
-                    "-m",
-                    "unittest",
-                    f"{os.path.splitext(os.path.basename(test_file))[0]}.{test_class}",
-                    "-v",
-                ],
-                cwd=td,
-                capture_output=True,
-                text=True,
-                timeout=10,
+
+        # Syntax check user code, reusing the tree parsed by the scan (if any)
+        with timings.phase("compile"):
+            syntax = check_syntax(code, user_code_path, tree)
+        if syntax.error is not None:
+            return "syntax_error", syntax.error, None, None
+
+        # Run the file itself and then only the relevant tests, in a single interpreter
+        cases = snippet.cases
+        if EVALUATOR_ENGINE == EvaluatorEngine.FUNCTION.value and cases:
+            with timings.phase("execute"):
+                return _run_child(
+                    RUNNER_PATH,
+                    [json.dumps(cases)],
+                    td,
+                    user_code_path,
+                    template_dir,
+                    timeout,
+                )
+        tests = [os.path.splitext(os.path.basename(test_file))[0], test_class]
+        methods = list_test_methods(snippet.test_code, test_class)
+        estimates = test_durations.estimates(snippet_id, methods)
+        shards = plan_shards(estimates, EVALUATOR_TEST_SHARDS)
+        with timings.phase("execute"):
+            if len(shards) > 1:
+                result = _run_shards(code, snippet_id, shards, td, tests, timeout)
+            else:
+                result = _run_child(
+                    HARNESS_PATH, tests, td, user_code_path, template_dir, timeout
+                )
+        test_durations.record(
+            snippet_id, getattr(result, "details", {}).get("test_results")
+        )
+        return result
+
+
+def _run_shards(
+    code: str,
+    snippet_id: str,
+    shards: List[List[str]],
+    td: str,
+    tests: List[str],
+    timeout: float,
+) -> Tuple[str, str, Optional[int], Optional[int]]:
+    """
+    Run the harness once per shard of the test class, in parallel, and merge the results.
+    Every shard runs in a submission directory of its own (the first one in `td`), so that
+    tests working with files do not get in each other's way.
+    :param code: The user code.
+    :param snippet_id: The ID of the snippet to evaluate against.
+    :param shards: The names of the test methods of each shard (see `sharding.plan_shards`).
+    :param td: The submission directory already holding the user file.
+    :param tests: The harness arguments naming the test module and class.
+    :param timeout: The timeout (in seconds) of each shard.
+    :return: The status tuple (see `evaluate_code`), as if the test class ran in one process.
+    """
+    template_dir = sandbox_templates.template_dir(snippet_id)
+    user_file = os.path.basename(SNIPPET_TESTS[snippet_id][0])
+    scope = cancellation.current_scope()
+    with contextlib.ExitStack() as stack:
+        dirs = [(td, os.path.join(td, user_file))]
+        for _ in shards[1:]:
+            dirs.append(
+                stack.enter_context(sandbox_templates.submission_dir(snippet_id, code))
             )
-        except Exception as e:
-            # If there is an error running the unittest command
-            return "runtime_error", str(e), None, None
-        if result.returncode == 0:
-            # Parse output for test count
-            passed, total = _parse_unittest_output(result.stdout, result.stderr)
-            return "success", "", passed, total
-        else:
-            passed, total = _parse_unittest_output(result.stdout, result.stderr)
-            # Return the number of tests passed and total tests
-            return "test_failure", "", passed, total
-
-
-def _detect_malicious_code(code: str) -> bool:
-    """
-    Scan code using AST to detect potentially malicious usage.
-    Only blocks os.system calls, allows other os usages (including os.path.exists).
-    :param code: The user code to scan.
-    :return: True if high-risk code is detected, else False.
+
+        def run_shard(shard: List[str], submission: Tuple[str, str]) -> tuple:
+            shard_dir, user_code_path = submission
+            options = ["--tests", ",".join(shard)]
+            with cancellation.activate(scope):
+                return _run_child(
+                    HARNESS_PATH,
+                    tests,
+                    shard_dir,
+                    user_code_path,
+                    template_dir,
+                    timeout,
+                    options,
+                )
+
+        with ThreadPoolExecutor(len(shards), thread_name_prefix="shard") as executor:
+            results = list(executor.map(run_shard, shards, dirs))
+    return _with_timeout(merge_shard_results(results), timeout)
+
+
+def _run_child(
+    script: str,
+    tests: List[str],
+    td: str,
+    user_code_path: str,
+    template_dir: str,
+    timeout: float,
+    options: Sequence[str] = (),
+) -> Tuple[str, str, Optional[int], Optional[int]]:
+    """
+    Run the harness (or the function-level runner) on a submission in a child process.
+    :param script: The path of the script to run.
+    :param tests: The script's arguments naming the tests to run.
+    :param td: The submission directory, the working directory of the child.
+    :param user_code_path: The path of the user file, in the submission directory.
+    :param template_dir: The snippet's sandbox template directory.
+    :param timeout: The number of seconds after which the child is killed.
+    :param options: Further options for the script.
+    :return: The status tuple (see `evaluate_code`), with the resource use and the timeout.
     """
+    result_path = os.path.join(td, HARNESS_RESULT_FILE)
+    args = [sys.executable, script, "--search-path", template_dir, *options]
+    for name, value in RESOURCE_LIMITS.items():
+        args += [f"--{name.replace('_', '-')}", str(value)]
+    if EVALUATOR_LINE_COVERAGE:
+        args.append("--coverage")
+    args += [user_code_path, *tests, result_path]
     try:
-        tree = ast.parse(code)
-    except Exception:
-        return False
-
-    risky_names = {
-        "sys",
-        "subprocess",
-        "shutil",
-        "socket",
-        "threading",
-        "multiprocessing",
-        "ctypes",
-        "pickle",
-        "eval",
-        "exec",
-        "compile",
-        "__import__",
-    }
+        returncode, stdout, stderr, usage, exceeded = _run_process(
+            args, td, timeout, MAX_OUTPUT_BYTES
+        )
+    except Exception as e:
+        return "runtime_error", str(e), None, None
+    if returncode is None:
+        message = timeout_message(timeout)
+        return DetailedResult(
+            "runtime_error",
+            message,
+            None,
+            None,
+            timeout_seconds=timeout,
+            timed_out=True,
+            **usage,
+        )
+    if exceeded:
+        error = output_limit_error(stdout, stderr, MAX_OUTPUT_BYTES)
+        result = DetailedResult("runtime_error", error, None, None, **usage)
+        return _with_timeout(result, timeout)
+
+    outcome = None
+    if os.path.exists(result_path):
+        with open(result_path, "r") as f:
+            outcome = json.loads(f.read())
+    result = outcome_to_result(outcome, returncode, stdout, stderr, usage)
+    return _with_timeout(result, timeout)
+
+
+def _with_timeout(result: tuple, timeout: float) -> DetailedResult:
+    """
+    Record the effective timeout of a run, and whether it was hit, with its result.
+    :param result: The status tuple of the run (timed out runs set `timed_out` already).
+    :param timeout: The timeout (in seconds) the run had.
+    :return: The result, with the timeout details added.
+    """
+    details = dict(getattr(result, "details", {}))
+    details.setdefault("timed_out", False)
+    details["timeout_seconds"] = timeout
+    return DetailedResult(*result, **details)
 
-    for node in ast.walk(tree):
-        # Detect risky imports (allow os completely)
-        if isinstance(node, ast.Import):
-            for alias in node.names:
-                modname = alias.name.split(".")[0]
-                if modname != "os" and modname in risky_names:
-                    return True
-        if isinstance(node, ast.ImportFrom):
-            if node.module:
-                modname = node.module.split(".")[0]
-                if modname != "os" and modname in risky_names:
-                    return True
-
-        # Detect risky calls
-        if isinstance(node, ast.Call):
-            # Allow os.path.exists only
-            if isinstance(node.func, ast.Attribute):
-                # Allow: os.path.exists(...)
-                if (
-                    isinstance(node.func.value, ast.Attribute)
-                    and isinstance(node.func.value.value, ast.Name)
-                    and node.func.value.value.id == "os"
-                    and node.func.value.attr == "path"
-                    and node.func.attr == "exists"
-                ):
-                    continue
-
-                # Block: os.system(...)
-                if isinstance(node.func.value, ast.Name) and node.func.value.id == "os":
-                    if node.func.attr == "system":
-                        return True
-
-                # Block other risky attributes (e.g., subprocess.call)
-                full_name = f"{getattr(node.func.value, 'id', '')}.{node.func.attr}"
-                if node.func.attr in risky_names or full_name in risky_names:
-                    return True
-
-            if isinstance(node.func, ast.Name) and node.func.id in risky_names:
-                return True
-
-    return False
-
-
-def _load_module(path: str, module_name: str) -> ModuleType:
-    """Dynamically load a Python file as a module."""
-    spec = importlib.util.spec_from_file_location(module_name, path)
-    mod = importlib.util.module_from_spec(spec)
-    sys.modules[module_name] = mod
-    spec.loader.exec_module(mod)  # type: ignore
-    return mod
-
-
-def _load_original_code_and_error(code_dir, snippet_file) -> Tuple[str, str]:
-    """
-    Load the original code and error message for a given snippet file.
-    :param code_dir: the directory containing the code snippets.
-    :param snippet_file: the relative path to the snippet file.
-    :return: Tuple containing the original code and error message.
-    """
-    orig_code_path = os.path.join(code_dir, snippet_file)
-    orig_error_path = os.path.join(
-        code_dir,
-        os.path.dirname(snippet_file),
-        f"{os.path.splitext(os.path.basename(snippet_file))[0]}_error.txt",
+
+def _run_process(
+    args: list, cwd: str, timeout: float, max_output_bytes: int
+) -> Tuple[Optional[int], str, str, dict, bool]:
+    """
+    Run a process to completion, killing it after the timeout, and measure its resource use.
+    Its output is read as it is produced, keeping only the head and tail of each stream (see
+    `capture.HeadTailBuffer`), and the process is killed as soon as its output (standard
+    output and error together) exceeds `max_output_bytes`. Unlike `subprocess.run`, the
+    process is reaped with `os.wait4`, which also reports its CPU time. The
+    process runs in a process group of its own, which is killed (and the process reaped)
+    whatever happens while its output is read.
+    :param args: The command line of the process.
+    :param cwd: The working directory of the process.
+    :param timeout: The number of seconds after which the process is killed.
+    :param max_output_bytes: The number of bytes of output after which the process is killed.
+    :return: A tuple of the exit code (None on timeout), the (truncated) standard output and
+        error, the resources used (see `usage_details`), and whether the process was killed
+        for exceeding its output budget.
+    """
+    stdout, stderr = HeadTailBuffer(), HeadTailBuffer()
+    proc = subprocess.Popen(
+        args,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    timed_out, reaped = threading.Event(), threading.Event()
+
+    def kill_group() -> None:
+        """Kill the process and anything it started, unless it was reaped already."""
+        if reaped.is_set():
+            return
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def kill() -> None:
+        timed_out.set()
+        kill_group()
+
+    def cancel() -> None:
+        EVALUATION_PROCESSES_CANCELLED.inc()
+        kill_group()
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    status = None
+    try:
+        with cancellation.on_cancel(cancel):
+            # The process is killed on time by the timer, the grace period only guards
+            # against anything it started that keeps the pipes open
+            stopped = drain(
+                {
+                    proc.stdout.fileno(): stdout.write,
+                    proc.stderr.fileno(): stderr.write,
+                },
+                time.monotonic() + timeout + 1,
+                lambda: stdout.total + stderr.total > max_output_bytes,
+            )
+            if stopped is not None:
+                kill_group()
+            _, status, usage = os.wait4(proc.pid, 0)
+            reaped.set()
+    finally:
+        timer.cancel()
+        if status is None:
+            # Reading failed: the process must neither keep running nor become a zombie
+            kill_group()
+            _, status, usage = os.wait4(proc.pid, 0)
+            reaped.set()
+        proc.stdout.close()
+        proc.stderr.close()
+        # Reaped already, so tell Popen not to wait for the process again
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    cancellation.raise_if_cancelled()
+    returncode = None if timed_out.is_set() or stopped == "timeout" else proc.returncode
+    return (
+        returncode,
+        stdout.getvalue(),
+        stderr.getvalue(),
+        usage_details(usage),
+        stopped == "output_limit",
     )
-    with open(orig_code_path, "r") as f:
-        orig_code = f.read()
-    with open(orig_error_path, "r") as f:
-        orig_error = f.read()
-    return orig_code, orig_error
-
-
-def _parse_unittest_output(
-    output: str, stderr: str = None
-) -> Tuple[Optional[int], Optional[int]]:
-    """
-    Parse unittest output (stdout and optionally stderr) to extract number of passed and total tests.
-    :param output: The output string from unittest stdout.
-    :param stderr: The output string from unittest stderr (optional).
-    :return: A tuple containing the number of passed tests and total tests.
-    """
-    # Combine stdout and stderr for parsing
-    combined = output
-    if stderr:
-        combined += "\n" + stderr
-
-    # Look for lines like: 'Ran 3 tests in 0.001s'
-    m = re.search(r"Ran (\d+) tests?", combined)
-    total = int(m.group(1)) if m else None
-    # Look for 'OK' or 'FAILED (failures=1)' etc.
-    if "OK" in combined:
-        passed = total
-    else:
-        # Try to count failures/errors/skips
-        fail_match = re.search(r"FAILED \((.*?)\)", combined)
-        failed = 0
-        if fail_match:
-            fail_str = fail_match.group(1)
-            # e.g. 'failures=1, errors=1, skipped=1'
-            for part in fail_str.split(","):
-                if "=" in part:
-                    failed += int(part.split("=")[1])
-        passed = total - failed if total is not None else None
-    return passed, total
@@ -0,0 +1,395 @@
+"""
+Evaluation harness that runs a submitted snippet and its test class in a single interpreter.
+
+Usage: python harness.py [--search-path DIR] [--max-memory-mb N] [--max-cpu-seconds N]
+                         [--max-file-size-mb N]
+                         [--tests NAME,...] [--coverage]
+                         <user_code_path> <test_module> <test_class> <result_path>
+
+The user module is first executed as `__main__`, exactly like `python <user_code_path>`:
+uncaught exceptions are printed on stderr in the interpreter's format and the harness exits
+with the same code. Only if that succeeds is the test class run (or only the given --tests of
+it, when the class is split across several processes). The outcome of each phase is
+written as JSON to <result_path>, so that callers never need to parse console output; the
+outcome of the test phase includes a record (name, outcome, duration) of every test run.
+Modules that are not next to the user module (e.g., the test module) are looked up in the
+optional --search-path, which is placed right after the user module's directory on `sys.path`.
+The resource limits (0 meaning unlimited) are applied before any user code runs. With
+--coverage, the outcome also holds a bitmap of the lines of the user module that ran (see
+`child.LineCoverage`).
+
+This file is also imported by the pool engine, so it must only depend on the standard library
+(and `child.py`, next to it).
+"""
+
+import argparse
+import io
+import json
+import os
+import resource
+import signal
+import sys
+import time
+import types
+import unittest
+from types import CodeType
+from typing import List, Optional, Tuple
+
+if __package__:
+    from app.services.evaluator.child import (
+        LineCoverage,
+        apply_limits,
+        peak_rss_kb,
+        run_as_main,
+    )
+else:  # Run as a script, the helpers are next to this file
+    from child import LineCoverage, apply_limits, peak_rss_kb, run_as_main
+
+# Test outcomes counted as passed (like `unittest` does when deciding overall success)
+PASSING_OUTCOMES = ("passed", "skipped", "expected_failure")
+
+# Details describing the resources used by a run (see `usage_details`), by CodeSubmission column
+USAGE_COLUMNS = ("cpu_user_ms", "cpu_system_ms", "peak_rss_kb")
+
+# Details describing the timeout a run was given and whether it ran out, by CodeSubmission column
+TIMEOUT_COLUMNS = ("timeout_seconds", "timed_out")
+
+# Details describing how long each phase of a run took, by CodeSubmission column
+TIMING_COLUMNS = ("phase_timings",)
+
+# Detail holding the bitmap of the user's lines that ran (see `child.LineCoverage`), by
+# CodeSubmission column
+COVERAGE_COLUMN = "lines_executed"
+
+
+class DetailedResult(tuple):
+    """
+    Status tuple of an evaluation (status, error, tests passed, total tests), carrying
+    further details (e.g., per-test records) in `details`, keyed by CodeSubmission column.
+    Callers that only unpack the four values keep working unchanged.
+    """
+
+    def __new__(
+        cls,
+        status: str,
+        error: str,
+        tests_passed: Optional[int],
+        tests_total: Optional[int],
+        **details,
+    ):
+        result = super().__new__(cls, (status, error, tests_passed, tests_total))
+        result.details = details
+        return result
+
+    def __reduce__(self):
+        # Keep the details when results are sent between processes
+        return self.__class__, tuple(self), {"details": self.details}
+
+
+def usage_details(usage: resource.struct_rusage) -> dict:
+    """
+    Summarize the CPU time used by a finished child process. Its peak memory is reported by
+    the child itself (see `child.peak_rss_kb`): the `ru_maxrss` of a forked child is at least
+    the size of the process it was forked from.
+    :param usage: The resource usage of the child, as returned by `os.wait4`.
+    :return: The CPU times (in ms), by USAGE_COLUMNS.
+    """
+    return {
+        "cpu_user_ms": round(usage.ru_utime * 1000),
+        "cpu_system_ms": round(usage.ru_stime * 1000),
+    }
+
+
+def load_test_class(
+    test_module: str,
+    test_class: str,
+    test_code: Optional[CodeType] = None,
+    test_names: Optional[List[str]] = None,
+) -> unittest.TestSuite:
+    """
+    Load the test class to run, like `python -m unittest <test_module>.<test_class>` would.
+    :param test_module: The name of the test module.
+    :param test_class: The name of the test class within the module.
+    :param test_code: The pre-compiled test module, if already available.
+    :param test_names: Only load these test methods of the class (all if None).
+    :return: The test suite; like with unittest's loader, a module raising ImportError yields
+        a single erroring test (other exceptions propagate).
+    """
+    loader = unittest.defaultTestLoader
+    names = [test_class]
+    if test_names is not None:
+        names = [f"{test_class}.{name}" for name in test_names]
+    if test_code is None:
+        return loader.loadTestsFromNames([f"{test_module}.{name}" for name in names])
+
+    module = types.ModuleType(test_module)
+    module.__file__ = test_code.co_filename
+    sys.modules[test_module] = module
+    try:
+        exec(test_code, module.__dict__)
+    except ImportError as e:
+        return unittest.TestSuite([_FailedImport(test_module, e)])
+    return loader.loadTestsFromNames(names, module)
+
+
+def run_tests(suite: unittest.TestSuite) -> dict:
+    """
+    Run a test suite, discarding the human-readable report.
+    :param suite: The test suite to run.
+    :return: A dictionary with the number of passed and total tests, overall success, and
+        a record of each test in the order they ran.
+    """
+    sys.argv = ["python -m unittest"]
+    runner = unittest.TextTestRunner(
+        stream=io.StringIO(), verbosity=2, resultclass=_RecordingResult
+    )
+    result = runner.run(suite)
+    failed = len(result.failures) + len(result.errors) + len(result.unexpectedSuccesses)
+    return {
+        "passed": result.testsRun - failed,
+        "total": result.testsRun,
+        "successful": result.wasSuccessful(),
+        "tests": result.records,
+    }
+
+
+def passed_mask(records: List[dict]) -> int:
+    """
+    Encode which tests passed as a bitmask (bit i is set if the i-th test run passed).
+    :param records: The per-test records reported by `run_tests`.
+    :return: The bitmask.
+    """
+    mask = 0
+    for i, record in enumerate(records):
+        if record["outcome"] in PASSING_OUTCOMES:
+            mask |= 1 << i
+    return mask
+
+
+def run_submission(
+    user_code: CodeType,
+    user_code_path: str,
+    test_module: str,
+    test_class: str,
+    test_code: Optional[CodeType] = None,
+    test_names: Optional[List[str]] = None,
+    coverage: bool = False,
+) -> Tuple[int, dict]:
+    """
+    Run the user module and, if it exits cleanly, its test class.
+    :param user_code: The compiled user code.
+    :param user_code_path: The path of the user code file.
+    :param test_module: The name of the test module.
+    :param test_class: The name of the test class within the module.
+    :param test_code: The pre-compiled test module, if already available.
+    :param test_names: Only run these test methods of the class (all if None).
+    :param coverage: Whether to record which lines of the user module run (in both phases).
+    :return: The exit code for the process, and the outcome of the last phase that ran,
+        including the duration (in ms) of each phase that ran, the peak memory of the process
+        (see `child.peak_rss_kb`) and, with `coverage`, the bitmap of the lines that ran.
+    """
+    lines = LineCoverage(user_code_path) if coverage else None
+    if lines is not None:
+        lines.start()
+    try:
+        exit_code, outcome = _run_phases(
+            user_code, user_code_path, test_module, test_class, test_code, test_names
+        )
+    finally:
+        if lines is not None:
+            lines.stop()
+    if lines is not None:
+        outcome[COVERAGE_COLUMN] = lines.bitmap()
+    outcome["peak_rss_kb"] = peak_rss_kb()
+    return exit_code, outcome
+
+
+def _run_phases(
+    user_code: CodeType,
+    user_code_path: str,
+    test_module: str,
+    test_class: str,
+    test_code: Optional[CodeType],
+    test_names: Optional[List[str]],
+) -> Tuple[int, dict]:
+    """Run the user module and then its test class (see `run_submission`)."""
+    started = time.perf_counter()
+    exit_code = run_as_main(user_code, user_code_path)
+    timings = {"run_ms": _elapsed_ms(started)}
+    if exit_code != 0:
+        return exit_code, {"phase": "run", "returncode": exit_code, "timings": timings}
+    started = time.perf_counter()
+    suite = load_test_class(test_module, test_class, test_code, test_names)
+    outcome = run_tests(suite)
+    timings["test_ms"] = _elapsed_ms(started)
+    return 0, {"phase": "test", **outcome, "timings": timings}
+
+
+def _elapsed_ms(started: float) -> float:
+    """Return the milliseconds elapsed since `started` (a `time.perf_counter()` value)."""
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+def outcome_to_result(
+    outcome: Optional[dict],
+    returncode: int,
+    stdout: str,
+    stderr: str,
+    usage: Optional[dict] = None,
+) -> Tuple[str, str, Optional[int], Optional[int]]:
+    """
+    Translate the outcome reported by the harness into an `evaluate_code` status tuple.
+    :param outcome: The JSON outcome written by the harness (None if it wrote nothing).
+    :param returncode: The exit code of the process that ran the harness.
+    :param stdout: The captured standard output of that process.
+    :param stderr: The captured standard error of that process.
+    :param usage: The resources used by that process (see `usage_details`), if known.
+    :return: A tuple of status, error message, number of tests passed, and total tests.
+    """
+    usage = dict(usage or {})
+    if outcome is not None and "timings" in outcome:
+        usage["phase_timings"] = outcome["timings"]
+    if outcome is not None and COVERAGE_COLUMN in outcome:
+        usage[COVERAGE_COLUMN] = outcome[COVERAGE_COLUMN]
+    if outcome is not None and outcome.get("peak_rss_kb") is not None:
+        usage["peak_rss_kb"] = outcome["peak_rss_kb"]
+    if outcome is None or outcome["phase"] == "run":
+        # Runtime error when running the file (or the process died before reporting)
+        if returncode == -signal.SIGXCPU:
+            error = CPU_LIMIT_MESSAGE
+        elif returncode == 0 and outcome is None:
+            error = "Evaluation exited without a result."
+        else:
+            error = stderr or stdout
+        return DetailedResult("runtime_error", error, None, None, **usage)
+    status = "success" if outcome["successful"] else "test_failure"
+    records = outcome.get("tests", [])
+    return DetailedResult(
+        status,
+        "",
+        outcome["passed"],
+        outcome["total"],
+        test_results=records,
+        tests_passed_mask=passed_mask(records),
+        **usage,
+    )
+
+
+# Error reported for a submission killed for exceeding its CPU time limit
+CPU_LIMIT_MESSAGE = "Execution exceeded its CPU time limit"
+
+
+def timeout_message(timeout: float) -> str:
+    """Return the error message reported for a submission that ran out of time."""
+    return f"Execution timed out after {timeout:g} seconds"
+
+
+class _RecordingResult(unittest.TextTestResult):
+    """Test result that also keeps a compact record (name, outcome, duration) of each test."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.records: List[dict] = []
+        self._outcome = "passed"
+        self._started = 0.0
+
+    def startTest(self, test: unittest.TestCase) -> None:
+        super().startTest(test)
+        self._outcome = "passed"
+        self._started = time.perf_counter()
+
+    def stopTest(self, test: unittest.TestCase) -> None:
+        duration_ms = (time.perf_counter() - self._started) * 1000
+        super().stopTest(test)
+        self.records.append(
+            {
+                "name": test.id().rsplit(".", 1)[-1],
+                "outcome": self._outcome,
+                "duration_ms": round(duration_ms, 3),
+            }
+        )
+
+    def addFailure(self, test, err) -> None:
+        super().addFailure(test, err)
+        self._outcome = "failed"
+
+    def addError(self, test, err) -> None:
+        super().addError(test, err)
+        self._outcome = "error"
+
+    def addSubTest(self, test, subtest, err) -> None:
+        super().addSubTest(test, subtest, err)
+        if err is not None and self._outcome == "passed":
+            failed = issubclass(err[0], test.failureException)
+            self._outcome = "failed" if failed else "error"
+
+    def addSkip(self, test, reason) -> None:
+        super().addSkip(test, reason)
+        self._outcome = "skipped"
+
+    def addExpectedFailure(self, test, err) -> None:
+        super().addExpectedFailure(test, err)
+        self._outcome = "expected_failure"
+
+    def addUnexpectedSuccess(self, test) -> None:
+        super().addUnexpectedSuccess(test)
+        self._outcome = "unexpected_success"
+
+
+class _FailedImport(unittest.TestCase):
+    """Stand-in test reporting a test module that could not be imported."""
+
+    def __init__(self, test_module: str, error: Exception):
+        super().__init__("run_test")
+        self._test_module = test_module
+        self._error = error
+
+    def id(self) -> str:
+        return f"unittest.loader._FailedTest.{self._test_module}"
+
+    def run_test(self) -> None:
+        raise ImportError(f"Failed to import test module: {self._test_module}") from (
+            self._error
+        )
+
+
+def main() -> int:
+    """Run the harness from the command line (see module docstring)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-path")
+    parser.add_argument("--max-memory-mb", type=int, default=0)
+    parser.add_argument("--max-cpu-seconds", type=int, default=0)
+    parser.add_argument("--max-file-size-mb", type=int, default=0)
+    parser.add_argument(
+        "--tests", help="comma-separated test methods to run (default: all)"
+    )
+    parser.add_argument(
+        "--coverage", action="store_true", help="record the user's lines that ran"
+    )
+    for name in ("user_code_path", "test_module", "test_class", "result_path"):
+        parser.add_argument(name)
+    args = parser.parse_args()
+    # Behave like a script living next to the user's module, not next to the harness
+    sys.path[0] = os.path.dirname(os.path.abspath(args.user_code_path))
+    if args.search_path:
+        sys.path.insert(1, args.search_path)
+
+    with open(args.user_code_path, "rb") as f:
+        user_code = compile(f.read(), args.user_code_path, "exec", dont_inherit=True)
+    apply_limits(args.max_memory_mb, args.max_cpu_seconds, args.max_file_size_mb)
+    test_names = args.tests.split(",") if args.tests else None
+    exit_code, outcome = run_submission(
+        user_code,
+        args.user_code_path,
+        args.test_module,
+        args.test_class,
+        test_names=test_names,
+        coverage=args.coverage,
+    )
+    with open(args.result_path, "w") as f:
+        f.write(json.dumps(outcome))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
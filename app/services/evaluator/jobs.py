@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.db import models
+from app.services.evaluator.dispatcher import (
+    Admission,
+    EvaluationQueueFull,
+    EvaluationResult,
+    dispatcher,
+)
+
+logger = logging.getLogger(__name__)
+
+# Status of a submission that has been accepted but not evaluated yet
+PENDING_STATUS = "pending"
+
+# Interval (in seconds) at which the database is polled for jobs run by other processes
+POLL_INTERVAL = 0.5
+
+# Events set when a job started by this process completes, keyed by job ID
+_completed: Dict[str, asyncio.Event] = {}
+
+
+def record_result(sub: models.CodeSubmission, result: EvaluationResult) -> None:
+    """
+    Store an evaluation result on a submission, including any details attached to it
+    (e.g., the per-test records), which are keyed by CodeSubmission column.
+    :param sub: The submission to update.
+    :param result: The status tuple returned by the evaluation function.
+    """
+    sub.status, sub.error, sub.tests_passed, sub.tests_total = result
+    for column, value in getattr(result, "details", {}).items():
+        setattr(sub, column, value)
+
+
+def register_job(job_id: str) -> None:
+    """
+    Register a job that will be evaluated by this process, so that waiters get notified.
+    :param job_id: The ID of the job.
+    """
+    _completed[job_id] = asyncio.Event()
+
+
+async def run_evaluation_job(
+    session_factory: sessionmaker,
+    job_id: str,
+    evaluate: Callable[[str, str], EvaluationResult],
+    code: str,
+    snippet_id: str,
+    admission: Optional[Admission] = None,
+    participant_id: str = "",
+    attempt_number: int = 1,
+) -> None:
+    """
+    Evaluate a pending submission and record the outcome on its CodeSubmission row.
+    :param session_factory: Factory for sessions on the database holding the submission.
+    :param job_id: The ID of the job (i.e., of the pending CodeSubmission).
+    :param evaluate: The (blocking) evaluation function, usually `evaluate_code`.
+    :param code: The user code to evaluate.
+    :param snippet_id: The ID of the snippet to evaluate against.
+    :param admission: The dispatcher admission obtained when the job was accepted.
+    :param participant_id: The participant who submitted the code (for fair scheduling).
+    :param attempt_number: The attempt the submission is for (first attempts go first).
+    """
+    try:
+        try:
+            result = await dispatcher.run(
+                evaluate, code, snippet_id, admission, participant_id, attempt_number
+            )
+        except Exception as e:
+            result = ("runtime_error", str(e), None, None)
+        with session_factory() as db:
+            sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one()
+            record_result(sub, result)
+            db.commit()
+    finally:
+        event = _completed.pop(job_id, None)
+        if event is not None:
+            event.set()
+
+
+async def wait_for_job(db: Session, job_id: str, timeout: float) -> None:
+    """
+    Wait until a job is no longer pending, or until the timeout expires (long-polling).
+    :param db: The database session used to look up the job.
+    :param job_id: The ID of the job to wait for.
+    :param timeout: The maximum number of seconds to wait.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            return
+        event = _completed.get(job_id)
+        if event is not None:
+            # Evaluated by this process: wake up as soon as it is done
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            return
+        # Possibly evaluated by another process: poll the database
+        db.expire_all()
+        sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one_or_none()
+        if sub is None or sub.status != PENDING_STATUS:
+            return
+        await asyncio.sleep(min(POLL_INTERVAL, remaining))
+
+
+def find_orphaned_jobs(db: Session) -> List[models.CodeSubmission]:
+    """
+    Find the pending submissions whose job is not in the evaluation queue: they were being
+    evaluated in the background by an API process that stopped (e.g., restarted or crashed)
+    before recording their outcome, and would otherwise stay pending forever.
+    :param db: The database session to query.
+    :return: The orphaned submissions, first attempts first.
+    """
+    sub = models.CodeSubmission
+    queued = db.query(models.EvaluationQueueEntry.job_id)
+    return (
+        db.query(sub)
+        .filter(
+            sub.status == PENDING_STATUS,
+            sub.job_id.isnot(None),
+            sub.job_id.notin_(queued),
+        )
+        .order_by(sub.attempt_number, sub.participant_id, sub.snippet_id)
+        .all()
+    )
+
+
+async def resume_orphaned_jobs(
+    session_factory: sessionmaker, evaluate: Callable[[str, str], EvaluationResult]
+) -> int:
+    """
+    Evaluate the orphaned jobs (see `find_orphaned_jobs`) again in this process, on startup.
+    Each job waits for room in the dispatcher, like a new submission would. Should several
+    API processes start together, each of them evaluates the orphans, recording the same
+    outcome.
+    :param session_factory: Factory for sessions on the database holding the submissions.
+    :param evaluate: The (blocking) evaluation function, usually `evaluate_code`.
+    :return: The number of jobs resumed, once they are all evaluated.
+    """
+    with session_factory() as db:
+        orphans = [
+            (s.job_id, s.code, s.snippet_id, s.participant_id, s.attempt_number)
+            for s in find_orphaned_jobs(db)
+        ]
+    if orphans:
+        logger.warning("Resuming %d jobs left pending by a restart", len(orphans))
+    for job_id, *_ in orphans:
+        register_job(job_id)
+    jobs = []
+    try:
+        for job_id, code, snippet_id, participant_id, attempt_number in orphans:
+            while True:
+                try:
+                    admission = dispatcher.admit()
+                    break
+                except EvaluationQueueFull:
+                    await asyncio.sleep(POLL_INTERVAL)
+            job = run_evaluation_job(
+                session_factory,
+                job_id,
+                evaluate,
+                code,
+                snippet_id,
+                admission,
+                participant_id,
+                attempt_number,
+            )
+            jobs.append(asyncio.ensure_future(job))
+        await asyncio.gather(*jobs)
+    finally:
+        for job in jobs:
+            job.cancel()
+        for job_id, *_ in orphans:
+            event = _completed.pop(job_id, None)
+            if event is not None:
+                event.set()
+    return len(orphans)
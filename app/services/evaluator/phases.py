@@ -0,0 +1,55 @@
+import contextlib
+import time
+from typing import Dict, Iterator
+
+from app.services.evaluator.harness import DetailedResult
+from app.utils.metrics import Histogram
+
+EVALUATION_PHASE_SECONDS = Histogram(
+    "evaluation_phase_seconds",
+    "Duration of each phase of a code evaluation (cache lookup, scan, sandbox setup, "
+    "syntax check, child execution, and the user code and test runs inside the child).",
+    ("phase",),
+)
+
+
+class PhaseTimings:
+    """
+    Durations of the phases of a single evaluation, measured with the monotonic
+    `time.perf_counter` clock. Phases that run in the child process (running the user code
+    and the tests) are timed by the child itself, and reported with its outcome.
+    """
+
+    def __init__(self):
+        self.durations_ms: Dict[str, float] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block as a phase (adding up if the phase is entered repeatedly).
+        :param name: The name of the phase (e.g., "scan").
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            key = f"{name}_ms"
+            self.durations_ms[key] = self.durations_ms.get(key, 0.0) + elapsed_ms
+
+    def attach(self, result: tuple) -> DetailedResult:
+        """
+        Add the phase durations to a result, next to those reported by the child, and
+        export them all to the phase histogram.
+        :param result: The status tuple of the evaluation.
+        :return: The result, with the durations (in ms) by phase in `phase_timings`.
+        """
+        details = dict(getattr(result, "details", {}))
+        timings = dict(details.get("phase_timings") or {})
+        timings.update(
+            {key: round(value, 3) for key, value in self.durations_ms.items()}
+        )
+        for key, value in timings.items():
+            EVALUATION_PHASE_SECONDS.observe(value / 1000, phase=key[: -len("_ms")])
+        details["phase_timings"] = timings
+        return DetailedResult(*result, **details)
@@ -0,0 +1,509 @@
+import json
+import marshal
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import tempfile
+import threading
+import time
+from types import CodeType
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from app.services.evaluator.capture import HeadTailBuffer, drain, output_limit_error
+from app.services.evaluator.child import apply_limits
+from app.services.evaluator.harness import (
+    DetailedResult,
+    outcome_to_result,
+    run_submission,
+    timeout_message,
+    usage_details,
+)
+from app.services.evaluator.sandbox import SandboxTemplates
+from app.services.evaluator.syntax_check import check_syntax
+from app.utils import cancellation
+
+# Modules imported by the snippets and their test suites, loaded once per worker
+PREWARMED_MODULES = ("datetime", "math", "os", "random", "unittest")
+
+
+class EvaluatorPool:
+    """
+    Pool of long-lived, pre-warmed evaluator worker processes.
+
+    Each worker imports the modules used by the snippets and compiles every snippet test
+    module once at startup. Jobs are (code, snippet_id) pairs; a worker runs each job through
+    the evaluation harness in a short-lived child forked from its warm state, so user code
+    never runs inside the worker itself. Jobs only write the user file, next to the shared
+    sandbox template of their snippet. Workers are recycled after `max_jobs` jobs, as soon as
+    they crash or stop responding, or before their next job once a test module is updated
+    (see `update_tests`).
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_jobs: int,
+        code_dir: str,
+        snippet_tests: Dict[str, Tuple[str, str, str]],
+        test_code: Optional[Dict[str, CodeType]] = None,
+        timeout: int = 10,
+        sandbox: Optional[SandboxTemplates] = None,
+        limits: Optional[Dict[str, int]] = None,
+        max_output_bytes: Optional[int] = None,
+        coverage: bool = False,
+    ):
+        """
+        Initialize the pool (workers are only spawned once `start` is called).
+        :param size: The number of worker processes to keep alive.
+        :param max_jobs: The number of jobs after which a worker is replaced by a fresh one.
+        :param code_dir: The directory containing the snippet folders.
+        :param snippet_tests: Mapping of snippet ID to (snippet file, test file, test class).
+        :param test_code: Mapping of snippet ID to its compiled test module (e.g., from the
+            snippet registry); workers compile the test files of any other snippet themselves.
+        :param timeout: The timeout (in seconds) for each of the run and test phases of a job.
+        :param sandbox: The sandbox templates to run jobs in (the pool builds its own if None).
+        :param limits: The resource limits of each job, as keyword arguments for
+            `child.apply_limits` (unlimited if None).
+        :param max_output_bytes: The output (in bytes) after which a job is stopped (unlimited
+            if None).
+        :param coverage: Whether jobs record which lines of the user code run (see
+            `child.LineCoverage`).
+        """
+        if size < 1:
+            raise ValueError("Evaluator pool size must be at least 1.")
+        self.size = size
+        self.max_jobs = max_jobs
+        self.code_dir = os.path.abspath(code_dir)
+        self.snippet_tests = dict(snippet_tests)
+        self._test_code = dict(test_code or {})
+        # Code objects cannot be pickled, so they are sent to the workers as bytecode
+        self.test_bytecode = {
+            snippet_id: marshal.dumps(code)
+            for snippet_id, code in self._test_code.items()
+        }
+        # Bumped whenever a test module changes, to replace the workers holding the old one
+        self._tests_generation = 0
+        self.timeout = timeout
+        self.limits = dict(limits or {})
+        self.max_output_bytes = max_output_bytes
+        self.coverage = coverage
+        self._owns_sandbox = sandbox is None
+        self.sandbox = sandbox or SandboxTemplates(self.code_dir, self.snippet_tests)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: set = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self) -> None:
+        """Spawn the worker processes so that they warm up before the first job arrives."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def shutdown(self) -> None:
+        """Stop all worker processes."""
+        with self._lock:
+            self._started = False
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+        while not self._idle.empty():
+            self._idle.get_nowait()
+        if self._owns_sandbox:
+            self.sandbox.cleanup()
+
+    def update_tests(self, snippet_id: str, test_code: CodeType) -> None:
+        """
+        Use a new compiled test module for a snippet (e.g., after its test file was edited);
+        workers compiled the old one at startup, so they are replaced before their next job.
+        :param snippet_id: The ID of the snippet.
+        :param test_code: The compiled test module.
+        """
+        with self._lock:
+            if self._test_code.get(snippet_id) is test_code:
+                return
+            self._test_code[snippet_id] = test_code
+            self.test_bytecode = {
+                **self.test_bytecode,
+                snippet_id: marshal.dumps(test_code),
+            }
+            self._tests_generation += 1
+
+    def evaluate(
+        self, code: str, snippet_id: str, timeout: Optional[float] = None
+    ) -> Tuple[str, str, Optional[int], Optional[int]]:
+        """
+        Evaluate user code on the next idle worker, blocking until one is available.
+        :param code: The user code to evaluate.
+        :param snippet_id: The ID of the snippet to evaluate against.
+        :param timeout: The timeout (in seconds) of the whole job (by default, the pool's
+            timeout for each of the run and test phases).
+        :return: The same status tuple as `evaluate_code`.
+        """
+        if timeout is None:
+            timeout = 2 * self.timeout
+        self.start()
+        worker = self._idle.get()
+        if worker.tests_generation != self._tests_generation:
+            worker = self._replace(worker)
+        try:
+            with cancellation.on_cancel(worker.kill):
+                worker.conn.send((code, snippet_id, timeout, self.max_output_bytes))
+                # The job may run up to the timeout, plus some slack for the fork/IPC overhead
+                if not worker.conn.poll(timeout + 5):
+                    raise TimeoutError
+                result = worker.conn.recv()
+        except TimeoutError:
+            worker = self._replace(worker)
+            message = timeout_message(timeout)
+            return DetailedResult("runtime_error", message, None, None, timed_out=True)
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            # Killed on purpose if the evaluation was cancelled
+            cancellation.raise_if_cancelled()
+            return "runtime_error", "Evaluation worker crashed.", None, None
+        else:
+            worker.jobs_done += 1
+            if worker.jobs_done >= self.max_jobs:
+                worker = self._replace(worker)
+            return result
+        finally:
+            self._idle.put(worker)
+
+    def _spawn(self) -> "_Worker":
+        """Start a new worker process and register it with the pool."""
+        templates = self.sandbox.prepare()
+        with self._lock:
+            test_bytecode, generation = self.test_bytecode, self._tests_generation
+        worker = _Worker(
+            self._ctx,
+            self.code_dir,
+            self.snippet_tests,
+            test_bytecode,
+            (self.sandbox.root, templates),
+            self.limits,
+            self.coverage,
+        )
+        worker.tests_generation = generation
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker: "_Worker") -> "_Worker":
+        """Stop the given worker and return a freshly spawned one in its place."""
+        with self._lock:
+            self._workers.discard(worker)
+        worker.stop()
+        return self._spawn()
+
+
+class _Worker:
+    """Parent-side handle of a single evaluator worker process."""
+
+    def __init__(
+        self,
+        ctx,
+        code_dir: str,
+        snippet_tests: dict,
+        test_bytecode: dict,
+        sandbox: tuple,
+        limits: dict,
+        coverage: bool,
+    ):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                code_dir,
+                snippet_tests,
+                test_bytecode,
+                sandbox,
+                limits,
+                coverage,
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.jobs_done = 0
+        self.tests_generation = 0  # See `EvaluatorPool.update_tests`
+
+    def kill(self) -> None:
+        """Kill the worker right away, along with the job it may be running."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            # Not in a group of its own yet (still starting up)
+            self.process.kill()
+
+    def stop(self) -> None:
+        """Ask the worker to exit, killing it if it does not do so promptly."""
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+def _worker_main(
+    conn,
+    code_dir: str,
+    snippet_tests: dict,
+    test_bytecode: dict,
+    sandbox: tuple,
+    limits: dict,
+    coverage: bool = False,
+) -> None:
+    """
+    Entry point of a worker process: warm up, then serve jobs until told to stop.
+    :param conn: The connection to the parent process.
+    :param code_dir: The directory containing the snippet folders.
+    :param snippet_tests: Mapping of snippet ID to (snippet file, test file, test class).
+    :param test_bytecode: Mapping of snippet ID to its marshalled, compiled test module.
+    :param sandbox: The directory for submissions, and the template directory of each snippet.
+    :param limits: The resource limits of each job (see `child.apply_limits`).
+    :param coverage: Whether jobs record which lines of the user code run.
+    """
+    # The parent handles interrupts, the worker should only exit when asked to
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Own process group, so that killing the worker also kills the job it is running
+    os.setpgid(0, 0)
+    for name in PREWARMED_MODULES:
+        __import__(name)
+    compiled_tests = _compile_test_modules(code_dir, snippet_tests, test_bytecode)
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        code, snippet_id, timeout, max_output_bytes = job
+        try:
+            result = _run_job(
+                code,
+                snippet_id,
+                sandbox,
+                compiled_tests,
+                timeout,
+                limits,
+                max_output_bytes,
+                coverage,
+            )
+        except Exception as e:
+            result = ("runtime_error", str(e), None, None)
+        conn.send(result)
+
+
+def _compile_test_modules(
+    code_dir: str, snippet_tests: dict, test_bytecode: dict
+) -> dict:
+    """
+    Load the test module of every snippet once, so that jobs only need to execute them.
+    Test modules are taken from the given bytecode where possible, and compiled otherwise.
+    :param code_dir: The directory containing the snippet folders.
+    :param snippet_tests: Mapping of snippet ID to (snippet file, test file, test class).
+    :param test_bytecode: Mapping of snippet ID to its marshalled, compiled test module.
+    :return: Mapping of snippet ID to (snippet file, test file, test class, test code object).
+    """
+    compiled = {}
+    for snippet_id, (snippet_file, test_file, test_class) in snippet_tests.items():
+        if snippet_id in test_bytecode:
+            test_code = marshal.loads(test_bytecode[snippet_id])
+        else:
+            test_path = os.path.join(code_dir, test_file)
+            with open(test_path, "r") as f:
+                test_code = compile(f.read(), test_path, "exec", dont_inherit=True)
+        compiled[snippet_id] = (snippet_file, test_file, test_class, test_code)
+    return compiled
+
+
+def _run_job(
+    code: str,
+    snippet_id: str,
+    sandbox: tuple,
+    compiled_tests: dict,
+    timeout: float,
+    limits: dict,
+    max_output_bytes: Optional[int] = None,
+    coverage: bool = False,
+) -> Tuple[str, str, Optional[int], Optional[int]]:
+    """
+    Evaluate a single job inside the worker, mirroring the steps of `evaluate_code`.
+    :param code: The user code to evaluate.
+    :param snippet_id: The ID of the snippet to evaluate against.
+    :param sandbox: The directory for submissions, and the template directory of each snippet.
+    :param compiled_tests: The pre-compiled test modules (see `_compile_test_modules`).
+    :param timeout: The timeout (in seconds) of the whole job.
+    :param limits: The resource limits of the job (see `child.apply_limits`).
+    :param max_output_bytes: The output budget of the job (unlimited if None).
+    :param coverage: Whether to record which lines of the user code run.
+    :return: The same status tuple as `evaluate_code`.
+    """
+    if snippet_id not in compiled_tests:
+        return "not_found", f"No test suite defined for {snippet_id}", None, None
+    snippet_file, test_file, test_class, test_code = compiled_tests[snippet_id]
+    sandbox_root, templates = sandbox
+
+    with tempfile.TemporaryDirectory(dir=sandbox_root) as td:
+        # Only the user file is written, the other modules are found in the snippet's template
+        user_code_path = os.path.join(td, os.path.basename(snippet_file))
+        with open(user_code_path, "w") as f:
+            f.write(code)
+
+        # Syntax check user code, reporting errors the way `python -m py_compile` does
+        syntax = check_syntax(code, user_code_path)
+        if syntax.error is not None:
+            return "syntax_error", syntax.error, None, None
+        user_code = syntax.code
+
+        # Run the file itself and then only the relevant test class, in one forked child
+        test_module = os.path.splitext(os.path.basename(test_file))[0]
+        run = _fork_call(
+            _run_harness,
+            (
+                limits,
+                user_code,
+                user_code_path,
+                test_module,
+                test_class,
+                test_code,
+                None,
+                coverage,
+            ),
+            td,
+            timeout,
+            templates[snippet_id],
+            max_output_bytes,
+        )
+        if run.returncode is None:
+            message = timeout_message(timeout)
+            return DetailedResult(
+                "runtime_error", message, None, None, timed_out=True, **run.usage
+            )
+        if run.output_exceeded:
+            error = output_limit_error(run.stdout, run.stderr, max_output_bytes)
+            return DetailedResult("runtime_error", error, None, None, **run.usage)
+        return outcome_to_result(
+            json.loads(run.payload) if run.payload else None,
+            run.returncode,
+            run.stdout,
+            run.stderr,
+            run.usage,
+        )
+
+
+class _ChildRun(NamedTuple):
+    """What a forked child (see `_fork_call`) produced."""
+
+    returncode: Optional[int]  # None if the child timed out
+    payload: bytes
+    stdout: str  # Head and tail only (see `capture.HeadTailBuffer`)
+    stderr: str
+    usage: dict  # See `harness.usage_details`
+    output_exceeded: bool  # Whether the child was killed for producing too much output
+
+
+def _fork_call(
+    target,
+    args: tuple,
+    cwd: str,
+    timeout: float,
+    search_path: Optional[str] = None,
+    max_output_bytes: Optional[int] = None,
+) -> _ChildRun:
+    """
+    Run `target(*args)` in a child forked from the (warm) worker.
+    The child runs in `cwd` with the directory at the front of `sys.path`, like a script would,
+    followed by `search_path` (if given), and the value returned by `target` (bytes, if any)
+    is sent back over a pipe. The child's standard output and error are read as they are
+    produced, and the child is killed once they exceed `max_output_bytes` together.
+    :param target: The function to run in the child; its return value is its payload.
+    :param args: The positional arguments to pass to the function.
+    :param cwd: The working directory of the child.
+    :param timeout: The number of seconds after which the child is killed.
+    :param search_path: An extra directory to look up modules in, after `cwd`.
+    :param max_output_bytes: The output budget of the child (unlimited if None).
+    :return: The exit code, payload, output and resource use of the child.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pipes = [os.pipe() for _ in range(3)]  # Payload, standard output, standard error
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 1
+        try:
+            for read_fd, _ in pipes:
+                os.close(read_fd)
+            os.chdir(cwd)
+            sys.path.insert(0, cwd)
+            if search_path is not None:
+                sys.path.insert(1, search_path)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.dup2(pipes[1][1], 1)
+            os.dup2(pipes[2][1], 2)
+            exit_code, payload = target(*args)
+            if payload:
+                os.write(pipes[0][1], payload)
+        finally:
+            os._exit(exit_code)
+
+    for _, write_fd in pipes:
+        os.close(write_fd)
+    chunks = []
+    stdout, stderr = HeadTailBuffer(), HeadTailBuffer()
+    (payload_fd, _), (stdout_fd, _), (stderr_fd, _) = pipes
+    stopped = (
+        "timeout"  # Until reading is done, so that the child is killed should it fail
+    )
+    try:
+        stopped = drain(
+            {
+                payload_fd: chunks.append,
+                stdout_fd: stdout.write,
+                stderr_fd: stderr.write,
+            },
+            time.monotonic() + timeout,
+            lambda: max_output_bytes is not None
+            and stdout.total + stderr.total > max_output_bytes,
+        )
+    finally:
+        for read_fd, _ in pipes:
+            os.close(read_fd)
+        if stopped is not None:
+            os.kill(pid, signal.SIGKILL)
+        _, status, usage = os.wait4(pid, 0)
+    return _ChildRun(
+        None if stopped == "timeout" else os.waitstatus_to_exitcode(status),
+        b"".join(chunks),
+        stdout.getvalue(),
+        stderr.getvalue(),
+        usage_details(usage),
+        stopped == "output_limit",
+    )
+
+
+def _run_harness(limits: dict, *args) -> Tuple[int, bytes]:
+    """
+    Run the harness in a forked child.
+    :param limits: The resource limits of the child (see `child.apply_limits`).
+    :param args: The arguments for `harness.run_submission`.
+    :return: The exit code of the child, and the JSON outcome of the harness as payload.
+    """
+    apply_limits(**limits)
+    exit_code, outcome = run_submission(*args)
+    return exit_code, json.dumps(outcome).encode()
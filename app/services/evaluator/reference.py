@@ -0,0 +1,105 @@
+import ast
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from app.services.evaluator.cache import (
+    SuiteVersions,
+    is_cacheable,
+    normalize_code,
+    without_run_details,
+)
+from app.services.evaluator.dispatcher import EvaluationResult
+from app.services.evaluator.harness import DetailedResult
+from app.utils.metrics import Counter
+
+REFERENCE_HITS = Counter(
+    "evaluation_reference_hits_total",
+    "Code evaluations answered with the precomputed outcome of the unchanged original snippet.",
+    ("snippet_id",),
+)
+
+
+def code_fingerprint(code: str) -> str:
+    """
+    Fingerprint code so that only edits that cannot show in its outcome keep the same
+    fingerprint: trailing whitespace (see `cache.normalize_code`) and, for parsable code,
+    blank lines at the end. Errors quote source lines and point at columns, so any other
+    edit (even moving code within a line, or adding a comment) changes the fingerprint.
+    :param code: The code.
+    :return: The fingerprint of the code.
+    """
+    normalized = normalize_code(code)
+    try:
+        ast.parse(normalized)
+    except (SyntaxError, ValueError):
+        # Where a syntax error is reported may depend on anything, even the end of the file
+        return "text:" + normalized
+    return "code:" + normalized.rstrip("\n")
+
+
+class ReferenceOutcomes:
+    """
+    The outcomes of the original (broken) snippets, evaluated once at startup, to answer
+    submissions that do not change the original code without evaluating them. An outcome is
+    dropped as soon as the snippet's test file changes.
+    """
+
+    def __init__(self, code_dir: str, test_files: Dict[str, str]):
+        """
+        Initialize without any outcome.
+        :param code_dir: The directory containing the snippet folders.
+        :param test_files: Mapping of snippet ID to its test file, relative to code_dir.
+        """
+        self.suite_versions = SuiteVersions(code_dir, test_files)
+        # Snippet ID -> (suite version, fingerprint of the original code, outcome)
+        self._outcomes: Dict[str, Tuple[str, str, DetailedResult]] = {}
+        self._lock = threading.Lock()
+
+    def compute(
+        self,
+        originals: Dict[str, str],
+        evaluate: Callable[[str, str], EvaluationResult],
+    ) -> Dict[str, str]:
+        """
+        Evaluate the original code of every snippet, and keep the deterministic outcomes
+        (e.g., not a timeout).
+        :param originals: Mapping of snippet ID to the original code of the snippet.
+        :param evaluate: The evaluation function, bypassing any short-circuit or cache.
+        :return: Mapping of snippet ID to the status of its kept outcome.
+        """
+        for snippet_id, code in originals.items():
+            suite_version, _ = self.suite_versions.get(snippet_id)
+            result = evaluate(code, snippet_id)
+            if not is_cacheable(result):
+                continue
+            outcome = without_run_details(result)
+            with self._lock:
+                self._outcomes[snippet_id] = (
+                    suite_version,
+                    code_fingerprint(code),
+                    outcome,
+                )
+        with self._lock:
+            return {sid: outcome[0] for sid, (_, _, outcome) in self._outcomes.items()}
+
+    def get(self, code: str, snippet_id: str) -> Optional[DetailedResult]:
+        """
+        Look up the outcome of a submission, if it is the original code of the snippet.
+        :param code: The user code.
+        :param snippet_id: The ID of the snippet.
+        :return: The outcome of the original code, or None if the code differs from it (or
+            the snippet's outcome is not known for the current version of its tests).
+        """
+        with self._lock:
+            known = self._outcomes.get(snippet_id)
+        if known is None:
+            return None
+        suite_version, fingerprint, outcome = known
+        if self.suite_versions.get(snippet_id)[0] != suite_version:
+            with self._lock:
+                self._outcomes.pop(snippet_id, None)
+            return None
+        if code_fingerprint(code) != fingerprint:
+            return None
+        REFERENCE_HITS.inc(snippet_id=snippet_id)
+        return outcome
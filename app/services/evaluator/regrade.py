@@ -0,0 +1,301 @@
+"""
+Re-grade stored code submissions against the current test suites (e.g., after fixing a bug
+in a snippet's test file), and report which statuses and test counts changed.
+
+Usage: python -m app.services.evaluator.regrade [--snippet B] [--workers 4] [--no-cache]
+                                                [--checkpoint regrade_checkpoint.jsonl]
+                                                [--fresh] [--report regrade_report.json]
+
+Submissions are streamed from the database in primary key order (never all loaded at once)
+and evaluated with `evaluate_code` on a pool of worker processes, with a bounded number of
+submissions in flight. Every result is appended to the checkpoint file as soon as it is
+known, so that an interrupted run picks up where it stopped when started again with the
+same checkpoint. The checkpoint starts with a header naming the version of each test suite
+and the snippet filter: a checkpoint written for other test suites (or other submissions) is
+refused, unless --fresh is given to discard it. Once all submissions are graded, a JSON
+report of the changes is written. The stored submissions are only read, never updated.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Executor, ProcessPoolExecutor, wait
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import EVALUATOR_SANDBOX_DIR
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.evaluator import evaluator
+from app.services.evaluator.cache import EvaluationCache
+from app.services.evaluator.dispatcher import EvaluationResult
+from app.services.evaluator.jobs import PENDING_STATUS
+from app.services.evaluator.sandbox import SandboxTemplates, remove_tree, sandbox_parent
+
+# (participant_id, snippet_id, attempt_number) of a stored submission
+SubmissionKey = Tuple[str, str, int]
+
+# Number of rows fetched from the database at a time
+BATCH_SIZE = 500
+
+
+def stream_submissions(
+    session_factory: sessionmaker,
+    snippet_id: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[Tuple[SubmissionKey, str, tuple]]:
+    """
+    Stream the graded submissions from the database, in primary key order.
+    :param session_factory: Factory for sessions on the database holding the submissions.
+    :param snippet_id: Only stream the submissions for this snippet (all if None).
+    :param batch_size: The number of rows fetched from the database at a time.
+    :return: An iterator of (key, code, (status, tests passed, tests total)) per submission.
+    """
+    sub = models.CodeSubmission
+    with session_factory() as db:
+        query = db.query(
+            sub.participant_id,
+            sub.snippet_id,
+            sub.attempt_number,
+            sub.code,
+            sub.status,
+            sub.tests_passed,
+            sub.tests_total,
+        ).filter(sub.status.isnot(None), sub.status != PENDING_STATUS)
+        if snippet_id is not None:
+            query = query.filter(sub.snippet_id == snippet_id)
+        query = query.order_by(sub.participant_id, sub.snippet_id, sub.attempt_number)
+        for row in query.yield_per(batch_size):
+            key = (row.participant_id, row.snippet_id, row.attempt_number)
+            yield key, row.code, (row.status, row.tests_passed, row.tests_total)
+
+
+def checkpoint_header(snippet_id: Optional[str] = None) -> dict:
+    """
+    Describe what the results of a run are graded against, for the header of its checkpoint.
+    :param snippet_id: The snippet whose submissions are re-graded (all if None).
+    :return: The snippet filter, and the current version of each re-graded test suite.
+    """
+    snippet_ids = [snippet_id] if snippet_id is not None else evaluator.SNIPPET_TESTS
+    return {
+        "snippet": snippet_id,
+        "suite_versions": {
+            sid: evaluator.suite_versions.get(sid)[0] for sid in snippet_ids
+        },
+    }
+
+
+def load_checkpoint(
+    path: str, header: Optional[dict] = None
+) -> Dict[SubmissionKey, dict]:
+    """
+    Load the results recorded by an earlier (possibly interrupted) run.
+    :param path: The path of the checkpoint file (JSON lines).
+    :param header: The header the checkpoint must have (see `checkpoint_header`), if any.
+    :return: Mapping of submission key to its record (see `regrade`); empty if no file.
+    :raises ValueError: If the checkpoint holds results but not the given header.
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+    found = None
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may have been cut off when the run was interrupted
+                continue
+            if "header" in record:
+                found = record["header"]
+            else:
+                records[tuple(record["key"])] = record
+    if header is not None and (records or found is not None) and found != header:
+        raise ValueError(f"Checkpoint {path} was written for {found}, not for {header}")
+    return records
+
+
+def regrade(
+    submissions: Iterator[Tuple[SubmissionKey, str, tuple]],
+    evaluate: Callable[[str, str], EvaluationResult],
+    executor: Executor,
+    checkpoint_path: str,
+    max_in_flight: int = 64,
+    header: Optional[dict] = None,
+) -> Dict[SubmissionKey, dict]:
+    """
+    Evaluate submissions again, skipping those already recorded in the checkpoint.
+    :param submissions: The stored submissions (see `stream_submissions`).
+    :param evaluate: The evaluation function, usually `evaluate_code`; it must be picklable
+        if the executor runs it in other processes.
+    :param executor: The executor evaluating the submissions.
+    :param checkpoint_path: The checkpoint file, to which every new result is appended.
+    :param max_in_flight: The maximum number of submissions submitted but not yet graded.
+    :param header: What the submissions are graded against (by default, the current test
+        suites of all snippets, see `checkpoint_header`).
+    :return: Mapping of submission key to its record, with the "key" and the "old" and "new"
+        (status, tests passed, tests total) of the submission, for every streamed submission.
+    :raises ValueError: If the checkpoint was written with another header.
+    """
+    if header is None:
+        header = checkpoint_header()
+    checkpointed = load_checkpoint(checkpoint_path, header)
+    records = {}
+    in_flight = {}
+    with open(checkpoint_path, "a+") as checkpoint:
+        # Start on a new line should the last one have been cut off
+        if checkpoint.tell() > 0:
+            checkpoint.seek(checkpoint.tell() - 1)
+            if checkpoint.read(1) != "\n":
+                checkpoint.write("\n")
+        if not checkpointed:
+            checkpoint.write(json.dumps({"header": header}) + "\n")
+            checkpoint.flush()
+
+        def collect(futures) -> None:
+            for future in futures:
+                key, old = in_flight.pop(future)
+                try:
+                    status, _, tests_passed, tests_total = future.result()
+                except Exception as e:
+                    status, tests_passed, tests_total = "runtime_error", None, None
+                    print(f"Evaluating {key} failed: {e}", file=sys.stderr)
+                record = {
+                    "key": list(key),
+                    "old": list(old),
+                    "new": [status, tests_passed, tests_total],
+                }
+                checkpoint.write(json.dumps(record) + "\n")
+                checkpoint.flush()
+                records[key] = record
+
+        for key, code, old in submissions:
+            if key in checkpointed:
+                records[key] = checkpointed[key]
+                continue
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(evaluate, code, key[1])] = (key, old)
+        collect(wait(in_flight).done)
+    return records
+
+
+def diff_report(records: Dict[SubmissionKey, dict]) -> dict:
+    """
+    Summarize which submissions changed status or test counts.
+    :param records: The records returned by `regrade`.
+    :return: The number of submissions graded and changed, the number of submissions per
+        status transition (e.g., "test_failure -> success"), and every changed submission.
+    """
+    changes = []
+    transitions = Counter()
+    for key, record in sorted(records.items()):
+        old, new = record["old"], record["new"]
+        if old == new:
+            continue
+        transitions[f"{old[0]} -> {new[0]}"] += 1
+        changes.append(
+            {
+                "participant_id": key[0],
+                "snippet_id": key[1],
+                "attempt_number": key[2],
+                "old": dict(zip(("status", "tests_passed", "tests_total"), old)),
+                "new": dict(zip(("status", "tests_passed", "tests_total"), new)),
+            }
+        )
+    return {
+        "graded": len(records),
+        "changed": len(changes),
+        "transitions": dict(transitions.most_common()),
+        "changes": changes,
+    }
+
+
+@contextlib.contextmanager
+def worker_pool(workers: int, use_cache: bool) -> Iterator[ProcessPoolExecutor]:
+    """
+    Start the worker processes evaluating submissions, and remove their sandbox templates
+    once they are done. Worker processes exit without running `atexit` handlers, so they
+    build their templates in a directory of this process, removed here.
+    :param workers: The number of worker processes.
+    :param use_cache: Whether the workers use the evaluation cache.
+    :return: A context manager yielding the executor.
+    """
+    sandbox_root = tempfile.mkdtemp(
+        prefix="regrade-", dir=sandbox_parent(EVALUATOR_SANDBOX_DIR)
+    )
+    try:
+        with ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(use_cache, sandbox_root)
+        ) as executor:
+            yield executor
+    finally:
+        remove_tree(sandbox_root)
+
+
+def _init_worker(use_cache: bool, sandbox_root: str) -> None:
+    """Prepare a worker process to evaluate submissions like the API would."""
+    if not use_cache:
+        evaluator.evaluation_cache = EvaluationCache(0)
+    evaluator.sandbox_templates = SandboxTemplates(
+        evaluator.CODE_DIR, evaluator.SNIPPET_TESTS, sandbox_root
+    )
+    evaluator.calibrate_timeouts()
+
+
+def main() -> int:
+    """Run the re-grading from the command line (see module docstring)."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--snippet", help="only re-grade submissions for this snippet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="evaluate every submission, even if its result is in the evaluation cache",
+    )
+    parser.add_argument("--checkpoint", default="regrade_checkpoint.jsonl")
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="discard the results in the checkpoint instead of resuming from it",
+    )
+    parser.add_argument("--report", default="regrade_report.json")
+    args = parser.parse_args()
+
+    evaluator.check_engine()
+    header = checkpoint_header(args.snippet)
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    try:
+        # Refuse a stale checkpoint before starting any worker
+        load_checkpoint(args.checkpoint, header)
+    except ValueError as e:
+        print(f"{e}; use --fresh to discard it.", file=sys.stderr)
+        return 1
+    with worker_pool(args.workers, not args.no_cache) as executor:
+        records = regrade(
+            stream_submissions(SessionLocal, args.snippet),
+            evaluator.evaluate_code,
+            executor,
+            args.checkpoint,
+            max_in_flight=4 * args.workers,
+            header=header,
+        )
+    report = diff_report(records)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(
+        f"Re-graded {report['graded']} submissions, {report['changed']} changed "
+        f"(report written to {args.report})."
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
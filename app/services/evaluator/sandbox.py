@@ -0,0 +1,176 @@
+import importlib.util
+import os
+import py_compile
+import shutil
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# Free space (in bytes) below which the requested root is not used, e.g. Docker's 64 MiB
+# /dev/shm, which a few submissions writing files up to their size limit would fill up
+MIN_ROOT_FREE_BYTES = 256 * 1024 * 1024
+
+
+def sandbox_parent(requested: Optional[str]) -> Optional[str]:
+    """
+    Choose the directory to create sandbox roots in.
+    :param requested: The requested directory, preferably on a tmpfs.
+    :return: The requested directory, or None (the default temporary directory) if it is
+        missing, not writable, or with less than MIN_ROOT_FREE_BYTES free.
+    """
+    if not requested or not os.access(requested, os.W_OK | os.X_OK):
+        return None
+    if shutil.disk_usage(requested).free < MIN_ROOT_FREE_BYTES:
+        return None
+    return requested
+
+
+def remove_tree(path: str) -> None:
+    """
+    Remove a directory holding sandbox templates (made writable first, since `shutil.rmtree`
+    cannot empty their read-only directories).
+    :param path: The directory to remove.
+    """
+    for dirpath, dirnames, _ in os.walk(path):
+        for name in dirnames:
+            os.chmod(os.path.join(dirpath, name), stat.S_IRWXU)
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class SandboxTemplates:
+    """
+    Per-snippet sandbox templates, prepared once on a RAM-backed directory (tmpfs).
+
+    The template of a snippet holds the reference modules of all other snippets and the
+    snippet's test module, together with its precompiled bytecode. A submission then only
+    needs a fresh directory holding the user file: the evaluator puts that directory first on
+    `sys.path` and the template right after it, so imports resolve exactly as if all files
+    had been copied next to each other. Template files are made read-only, which only guards
+    against accidental writes: submissions run as the same user, so they can change the
+    permissions back and modify the files shared by all submissions.
+    """
+
+    def __init__(
+        self,
+        code_dir: str,
+        snippet_tests: Dict[str, Tuple[str, str, str]],
+        root: Optional[str] = None,
+    ):
+        """
+        Initialize the templates (they are only built once `prepare` is called).
+        :param code_dir: The directory containing the snippet folders.
+        :param snippet_tests: Mapping of snippet ID to (snippet file, test file, test class).
+        :param root: The directory to build the templates in, preferably on a tmpfs
+            (falls back to the default temporary directory if missing, not writable, or with
+            less than MIN_ROOT_FREE_BYTES free).
+        """
+        self.code_dir = os.path.abspath(code_dir)
+        self.snippet_tests = dict(snippet_tests)
+        self.requested_root = root
+        self.root: Optional[str] = None
+        # Snippet ID -> (template directory, fingerprint of the test file it was built from)
+        self._templates: Dict[str, Tuple[str, Tuple[int, int]]] = {}
+        self._builds = 0
+        self._lock = threading.RLock()
+
+    def prepare(self) -> Dict[str, str]:
+        """
+        Build the template of every snippet, unless already built.
+        :return: Mapping of snippet ID to its template directory.
+        """
+        return {
+            snippet_id: self.template_dir(snippet_id)
+            for snippet_id in self.snippet_tests
+        }
+
+    def template_dir(self, snippet_id: str) -> str:
+        """
+        Return the template directory of a snippet, (re)building it if its test file changed.
+        :param snippet_id: The ID of the snippet.
+        :return: The path of the template directory.
+        """
+        fingerprint = self._fingerprint(snippet_id)
+        with self._lock:
+            template = self._templates.get(snippet_id)
+            if template is None or template[1] != fingerprint:
+                # Concurrent submissions may still use the old template, so build a new one
+                template = (self._build(snippet_id), fingerprint)
+                self._templates[snippet_id] = template
+            return template[0]
+
+    @contextmanager
+    def submission_dir(self, snippet_id: str, code: str) -> Iterator[Tuple[str, str]]:
+        """
+        Materialize a submission: a fresh directory holding only the user file.
+        :param snippet_id: The ID of the snippet the code is submitted for.
+        :param code: The user code.
+        :return: A context manager yielding the submission directory and the user file path
+            (the directory is removed on exit).
+        """
+        snippet_file = self.snippet_tests[snippet_id][0]
+        with tempfile.TemporaryDirectory(dir=self._ensure_root()) as td:
+            user_code_path = os.path.join(td, os.path.basename(snippet_file))
+            with open(user_code_path, "w") as f:
+                f.write(code)
+            yield td, user_code_path
+
+    def cleanup(self) -> None:
+        """Remove every template (they are rebuilt on next use)."""
+        with self._lock:
+            root, self.root = self.root, None
+            self._templates.clear()
+        if root is not None:
+            remove_tree(root)
+
+    def _ensure_root(self) -> str:
+        """Create the (process-private) directory holding the templates and submissions."""
+        with self._lock:
+            if self.root is None:
+                parent = sandbox_parent(self.requested_root)
+                self.root = tempfile.mkdtemp(prefix="evaluator-", dir=parent)
+            return self.root
+
+    def _fingerprint(self, snippet_id: str) -> Tuple[int, int]:
+        """Return the modification time and size of a snippet's test file."""
+        test_file = self.snippet_tests[snippet_id][1]
+        st = os.stat(os.path.join(self.code_dir, test_file))
+        return st.st_mtime_ns, st.st_size
+
+    def _build(self, snippet_id: str) -> str:
+        """
+        Build a read-only template of a snippet (the caller holds the lock).
+        :param snippet_id: The ID of the snippet.
+        :return: The path of the new template directory.
+        """
+        snippet_file, test_file, _ = self.snippet_tests[snippet_id]
+        self._builds += 1
+        template = os.path.join(
+            self._ensure_root(), f"template-{snippet_id}-{self._builds}"
+        )
+        os.makedirs(template)
+
+        # Copy all other snippet modules, so that imports behave as in the original folders
+        files = [other for other, _, _ in self.snippet_tests.values()]
+        files = [f for f in files if f != snippet_file] + [test_file]
+        for rel_path in files:
+            dst = os.path.join(template, os.path.basename(rel_path))
+            shutil.copy2(os.path.join(self.code_dir, rel_path), dst)
+            try:
+                # Unchecked hash-based bytecode is loaded without even reading the source
+                py_compile.compile(
+                    dst,
+                    cfile=importlib.util.cache_from_source(dst),
+                    doraise=True,
+                    invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+                )
+            except py_compile.PyCompileError:
+                # Broken reference snippets (e.g., A) fail to import just like the originals
+                pass
+
+        for dirpath, _, filenames in os.walk(template):
+            for name in filenames:
+                os.chmod(os.path.join(dirpath, name), stat.S_IRUSR | stat.S_IRGRP)
+            os.chmod(dirpath, stat.S_IRUSR | stat.S_IXUSR | stat.S_IRGRP | stat.S_IXGRP)
+        return template
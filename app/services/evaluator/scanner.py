@@ -0,0 +1,190 @@
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+# Modules that may not be imported, and functions/methods that may not be called
+RISKY_NAMES = frozenset(
+    {
+        "sys",
+        "subprocess",
+        "shutil",
+        "socket",
+        "threading",
+        "multiprocessing",
+        "ctypes",
+        "pickle",
+        "eval",
+        "exec",
+        "compile",
+        "__import__",
+    }
+)
+
+# Fields that never hold child nodes worth scanning (names, constants, expression contexts)
+_LEAF_FIELDS = frozenset(
+    {
+        "arg",
+        "asname",
+        "attr",
+        "conversion",
+        "ctx",
+        "id",
+        "is_async",
+        "kind",
+        "level",
+        "module",
+        "name",
+        "type_comment",
+    }
+)
+
+# Number of verdicts remembered by `detect_malicious_code`
+VERDICT_CACHE_SIZE = 4096
+
+
+class RiskScanner(ast.NodeVisitor):
+    """
+    Single-pass scanner for potentially malicious usage in user code.
+    Only node types that can be risky have a handler, looked up in a dispatch table built
+    once per node type (instead of `NodeVisitor`'s per-node method name lookup), and child
+    nodes are found through a precomputed table of each node type's child fields. The
+    traversal uses an explicit stack, so that deeply nested code cannot exhaust the
+    recursion limit, and stops at the first risky node.
+    """
+
+    # Node type -> the fields that may hold child nodes, filled in as node types are seen
+    _child_fields: Dict[type, Tuple[str, ...]] = {}
+
+    def visit(self, node: ast.AST) -> bool:
+        """
+        Scan a (parsed) tree.
+        :param node: The root of the tree, usually an `ast.Module`.
+        :return: True if high-risk code is detected, else False.
+        """
+        dispatch = self._dispatch
+        child_fields = self._child_fields
+        stack = [node]
+        pop, push, extend = stack.pop, stack.append, stack.extend
+        while stack:
+            node = pop()
+            node_type = type(node)
+            handler = dispatch.get(node_type)
+            if handler is not None and handler(node):
+                return True
+            fields = child_fields.get(node_type)
+            if fields is None:
+                fields = child_fields[node_type] = tuple(
+                    f for f in node_type._fields if f not in _LEAF_FIELDS
+                )
+            for field in fields:
+                value = getattr(node, field, None)
+                if type(value) is list:
+                    extend(v for v in value if isinstance(v, ast.AST))
+                elif isinstance(value, ast.AST):
+                    push(value)
+        return False
+
+    @staticmethod
+    def visit_Import(node: ast.Import) -> bool:
+        """Detect risky imports (allow os completely)."""
+        for alias in node.names:
+            if alias.name.partition(".")[0] in RISKY_NAMES:
+                return True
+        return False
+
+    @staticmethod
+    def visit_ImportFrom(node: ast.ImportFrom) -> bool:
+        """Detect risky `from ... import ...` statements."""
+        return bool(node.module) and node.module.partition(".")[0] in RISKY_NAMES
+
+    @staticmethod
+    def visit_Call(node: ast.Call) -> bool:
+        """Detect risky calls: os.system(...), and risky functions or methods."""
+        func = node.func
+        func_type = type(func)
+        if func_type is ast.Name:
+            return func.id in RISKY_NAMES
+        if func_type is not ast.Attribute:
+            return False
+        value = func.value
+        value_type = type(value)
+        if value_type is ast.Name:
+            # Block: os.system(...)
+            if value.id == "os" and func.attr == "system":
+                return True
+        elif (
+            # Allow: os.path.exists(...)
+            value_type is ast.Attribute
+            and func.attr == "exists"
+            and value.attr == "path"
+            and type(value.value) is ast.Name
+            and value.value.id == "os"
+        ):
+            return False
+        # Block other risky attributes (e.g., subprocess.call)
+        return func.attr in RISKY_NAMES
+
+    _dispatch: Dict[type, Callable[[ast.AST], bool]] = {
+        ast.Import: visit_Import.__func__,
+        ast.ImportFrom: visit_ImportFrom.__func__,
+        ast.Call: visit_Call.__func__,
+    }
+
+
+class _Verdicts:
+    """Least recently used cache of scan verdicts, keyed by a hash of the code."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, bool]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[bool]:
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is not None:
+                self._entries.move_to_end(key)
+            return verdict
+
+    def put(self, key: bytes, verdict: bool) -> None:
+        with self._lock:
+            self._entries[key] = verdict
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_scanner = RiskScanner()
+_verdicts = _Verdicts(VERDICT_CACHE_SIZE)
+
+
+def is_high_risk_tree(tree: ast.AST) -> bool:
+    """
+    Scan an already parsed AST for potentially malicious usage.
+    :param tree: The parsed user code.
+    :return: True if high-risk code is detected, else False.
+    """
+    return _scanner.visit(tree)
+
+
+def detect_malicious_code(code: str) -> Tuple[bool, Optional[ast.Module]]:
+    """
+    Scan code for potentially malicious usage, remembering the verdict for identical code.
+    Only blocks os.system calls, allows other os usages (including os.path.exists).
+    Code that cannot be parsed is not considered malicious (it fails the syntax check).
+    :param code: The user code to scan.
+    :return: A tuple of the verdict (True if high-risk code is detected) and the parsed
+        tree, if the code had to be parsed (None on a remembered verdict or a parse error).
+    """
+    key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+    verdict = _verdicts.get(key)
+    if verdict is not None:
+        return verdict, None
+    try:
+        tree = ast.parse(code)
+    except Exception:
+        tree = None
+    verdict = tree is not None and is_high_risk_tree(tree)
+    _verdicts.put(key, verdict)
+    return verdict, tree
@@ -0,0 +1,175 @@
+import statistics
+import threading
+from types import CodeType
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import sessionmaker
+
+from app.db import models
+from app.services.evaluator.harness import (
+    COVERAGE_COLUMN,
+    PASSING_OUTCOMES,
+    USAGE_COLUMNS,
+    DetailedResult,
+    passed_mask,
+)
+
+# Weight of the latest duration in a test's running average
+DURATION_SMOOTHING = 0.2
+
+# Estimated duration (in ms) of a test that has never been timed, if no test of its snippet has
+DEFAULT_TEST_MS = 1.0
+
+# Suites estimated to run faster than this (in ms) are not worth starting more processes for
+MIN_SHARDED_SUITE_MS = 50.0
+
+
+class DurationHistory:
+    """
+    Running average of the duration of every test of every snippet, learned from the
+    per-test records of evaluated submissions (and of the submissions stored in the database).
+    """
+
+    def __init__(self, smoothing: float = DURATION_SMOOTHING):
+        """
+        Initialize without any recorded duration.
+        :param smoothing: The weight of the latest duration in a test's running average.
+        """
+        self.smoothing = smoothing
+        self._durations: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, snippet_id: str, records: Optional[List[dict]]) -> None:
+        """
+        Update the durations of a snippet's tests with the records of a test run.
+        :param snippet_id: The ID of the snippet the tests belong to.
+        :param records: The per-test records of the run (see `harness.run_tests`), if any.
+        """
+        with self._lock:
+            durations = self._durations.setdefault(snippet_id, {})
+            for record in records or []:
+                name, duration = record["name"], record["duration_ms"]
+                if name in durations:
+                    duration += (1 - self.smoothing) * (durations[name] - duration)
+                durations[name] = duration
+
+    def load(self, session_factory: sessionmaker, per_snippet: int = 100) -> None:
+        """
+        Learn the test durations recorded with the submissions stored in the database.
+        :param session_factory: Factory for sessions on the database holding the submissions.
+        :param per_snippet: The maximum number of submissions to read per snippet.
+        """
+        sub = models.CodeSubmission
+        with session_factory() as db:
+            snippet_ids = [row[0] for row in db.query(sub.snippet_id).distinct()]
+            for snippet_id in snippet_ids:
+                rows = (
+                    db.query(sub.test_results)
+                    .filter(sub.snippet_id == snippet_id, sub.test_results.isnot(None))
+                    .limit(per_snippet)
+                )
+                for (records,) in rows:
+                    self.record(snippet_id, records)
+
+    def estimates(self, snippet_id: str, names: List[str]) -> Dict[str, float]:
+        """
+        Estimate the duration of some of a snippet's tests.
+        :param snippet_id: The ID of the snippet.
+        :param names: The names of the test methods.
+        :return: Mapping of test name to its estimated duration (in ms); tests that were never
+            timed are estimated at the median of the snippet's timed tests.
+        """
+        with self._lock:
+            durations = dict(self._durations.get(snippet_id, {}))
+        default = (
+            statistics.median(durations.values()) if durations else DEFAULT_TEST_MS
+        )
+        return {name: durations.get(name, default) for name in names}
+
+
+def list_test_methods(test_code: CodeType, test_class: str) -> List[str]:
+    """
+    List the test methods of a test class, without running (or importing) the test module.
+    :param test_code: The compiled test module.
+    :param test_class: The name of the test class within the module.
+    :return: The names of the methods defined in the class body whose name starts with
+        "test", sorted like `unittest` runs them (empty if the class is not found).
+    """
+    for const in test_code.co_consts:
+        if isinstance(const, CodeType) and const.co_name == test_class:
+            return sorted(
+                {
+                    method.co_name
+                    for method in const.co_consts
+                    if isinstance(method, CodeType)
+                    and method.co_name.startswith("test")
+                }
+            )
+    return []
+
+
+def plan_shards(estimates: Dict[str, float], shards: int) -> List[List[str]]:
+    """
+    Split tests into shards of about the same total duration (longest tests first, each to
+    the shard with the least work so far).
+    :param estimates: Mapping of test name to its estimated duration.
+    :param shards: The maximum number of shards.
+    :return: The names of the tests of each shard, sorted; a single shard if the suite is
+        estimated to be too fast to be worth splitting.
+    """
+    names = sorted(estimates)
+    if shards < 2 or len(names) < 2 or sum(estimates.values()) < MIN_SHARDED_SUITE_MS:
+        return [names]
+    plan = [[] for _ in range(min(shards, len(names)))]
+    loads = [0.0] * len(plan)
+    for name in sorted(names, key=lambda n: (-estimates[n], n)):
+        shard = loads.index(min(loads))
+        plan[shard].append(name)
+        loads[shard] += estimates[name]
+    return [sorted(shard) for shard in plan]
+
+
+def merge_shard_results(results: List[tuple]) -> tuple:
+    """
+    Merge the results of running the shards of a test class into the result of a single run.
+    :param results: The status tuple of each shard (see `evaluate_code`), in shard order.
+    :return: The first result that did not get to run its tests (e.g., a runtime error or
+        a timeout) if any, else the combined test results in `unittest` order.
+    """
+    for result in results:
+        if result[0] not in ("success", "test_failure"):
+            return result
+    records = {}
+    usage = {column: 0 for column in USAGE_COLUMNS}
+    timings = {}
+    lines = None  # Bitmap of the user's lines run by any shard, if recorded
+    for result in results:
+        details = getattr(result, "details", {})
+        for record in details.get("test_results", []):
+            # Tests that could not be loaded (e.g., the test module failing to import) are
+            # reported the same way by every shard
+            records.setdefault(record["name"], record)
+        for column in USAGE_COLUMNS:
+            if column in details:
+                combine = max if column == "peak_rss_kb" else sum
+                usage[column] = combine((usage[column], details[column]))
+        # Shards run side by side, so a phase took as long as in the slowest shard
+        for phase, duration in (details.get("phase_timings") or {}).items():
+            timings[phase] = max(timings.get(phase, 0.0), duration)
+        # Every shard runs the whole module, and the lines of its own tests
+        if COVERAGE_COLUMN in details:
+            lines = (lines or 0) | int(details[COVERAGE_COLUMN], 16)
+    coverage = {} if lines is None else {COVERAGE_COLUMN: format(lines, "x")}
+    ordered = [records[name] for name in sorted(records)]
+    passed = sum(1 for record in ordered if record["outcome"] in PASSING_OUTCOMES)
+    return DetailedResult(
+        "success" if passed == len(ordered) else "test_failure",
+        "",
+        passed,
+        len(ordered),
+        test_results=ordered,
+        tests_passed_mask=passed_mask(ordered),
+        phase_timings=timings,
+        **usage,
+        **coverage,
+    )
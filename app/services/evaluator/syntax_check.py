@@ -0,0 +1,60 @@
+import ast
+import py_compile
+from types import CodeType
+from typing import NamedTuple, Optional
+
+
+class SyntaxCheckResult(NamedTuple):
+    """
+    Result of parsing and compiling user code once, in-process.
+    The code object can be executed directly by engines that run the code in a (forked)
+    child of this process.
+    """
+
+    tree: Optional[ast.Module]
+    code: Optional[CodeType]
+    error: Optional[str]
+
+
+def check_syntax(
+    source: str, filename: str, tree: Optional[ast.Module] = None
+) -> SyntaxCheckResult:
+    """
+    Parse and compile user code without spawning `python -m py_compile`.
+    Errors are reported in the exact format `py_compile` prints them, since that is the
+    text participants get to see.
+    :param source: The user code to check.
+    :param filename: The path the code is (or will be) stored at, as shown in the error.
+    :param tree: The code, if already parsed (e.g., by the malicious code scan).
+    :return: A SyntaxCheckResult; `tree` is None if the code could not be parsed, and
+        `error` is None if the code compiled successfully.
+    """
+    if tree is None:
+        try:
+            tree = ast.parse(source, filename)
+        except Exception as e:
+            error = format_compile_error(e, source, filename)
+            return SyntaxCheckResult(None, None, error)
+    try:
+        # Compiling catches the errors the parser does not (e.g., 'return' outside function)
+        code = compile(tree, filename, "exec", dont_inherit=True)
+    except Exception as e:
+        return SyntaxCheckResult(tree, None, format_compile_error(e, source, filename))
+    return SyntaxCheckResult(tree, code, None)
+
+
+def format_compile_error(error: Exception, source: str, filename: str) -> str:
+    """
+    Format a compilation error the way `python -m py_compile <filename>` prints it.
+    :param error: The exception raised while parsing or compiling the code.
+    :param source: The code that failed to compile.
+    :param filename: The path of the file the code is stored at.
+    :return: The formatted error message.
+    """
+    if isinstance(error, SyntaxError) and error.text is None and error.lineno:
+        # The interpreter reads the offending line back from the file on disk,
+        # which may not exist (yet) when compiling in-process
+        lines = source.splitlines(keepends=True)
+        if 0 < error.lineno <= len(lines):
+            error.text = lines[error.lineno - 1]
+    return py_compile.PyCompileError(type(error), error, filename).msg
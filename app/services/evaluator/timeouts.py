@@ -0,0 +1,78 @@
+import statistics
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from app.services.evaluator.dispatcher import EvaluationResult
+
+# Number of times each reference solution is run when calibrating (the median run counts)
+CALIBRATION_RUNS = 3
+
+
+class AdaptiveTimeouts:
+    """
+    Per-snippet evaluation timeouts derived from how long the snippet's reference solution
+    takes to run (including its tests) with the same engine.
+
+    A correct submission should take about as long as the reference solution, so a hung
+    submission can be stopped after `multiplier` times that baseline rather than after the
+    fixed worst-case timeout (the `ceiling`). The `floor` keeps the timeout from getting so
+    tight that a busy host would time out correct submissions. Snippets that have not been
+    calibrated (yet) use the ceiling.
+    """
+
+    def __init__(self, multiplier: float, floor: float, ceiling: float):
+        """
+        Initialize the timeouts (all snippets use the ceiling until calibrated).
+        :param multiplier: The factor applied to a snippet's baseline.
+        :param floor: The minimum timeout, in seconds.
+        :param ceiling: The maximum timeout, in seconds, used for uncalibrated snippets.
+        """
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self._baselines: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def calibrate(
+        self,
+        snippet_id: str,
+        run_reference: Callable[[], EvaluationResult],
+        runs: int = CALIBRATION_RUNS,
+    ) -> Optional[float]:
+        """
+        Time the reference solution of a snippet and derive the snippet's timeout from it.
+        :param snippet_id: The ID of the snippet.
+        :param run_reference: Evaluates the reference solution (without using any cache).
+        :param runs: The number of runs to take the median of.
+        :return: The baseline (in seconds), or None if the reference solution did not pass
+            (the snippet then keeps using the ceiling).
+        """
+        durations = []
+        for _ in range(runs):
+            start = time.monotonic()
+            result = run_reference()
+            durations.append(time.monotonic() - start)
+            if result[0] != "success":
+                return None
+        baseline = statistics.median(durations)
+        with self._lock:
+            self._baselines[snippet_id] = baseline
+        return baseline
+
+    def timeout(self, snippet_id: str) -> float:
+        """
+        Return the timeout (in seconds) of a single evaluation of a snippet.
+        :param snippet_id: The ID of the snippet.
+        :return: The baseline times the multiplier, within [floor, ceiling].
+        """
+        with self._lock:
+            baseline = self._baselines.get(snippet_id)
+        if baseline is None:
+            return self.ceiling
+        return round(min(self.ceiling, max(self.floor, baseline * self.multiplier)), 3)
+
+    def baselines(self) -> Dict[str, float]:
+        """Return the baseline (in seconds) of every calibrated snippet."""
+        with self._lock:
+            return dict(self._baselines)
@@ -1,68 +1,330 @@
+"""
+Function-level evaluation runner that checks a submitted snippet against test cases given as
+data, instead of running its unittest class.
+
+Usage: python user_runner.py [--search-path DIR] [--max-memory-mb N] [--max-cpu-seconds N]
+                             [--max-file-size-mb N] [--coverage]
+                             <user_code_path> <cases_json> <result_path>
+
+Like the harness, the user module is first executed as `__main__`, and the cases only run if
+that succeeds. The module is then imported once, and each case runs a list of steps, each
+calling one of its functions (or a dotted attribute, e.g. "ScoreReport.describe") with the
+given arguments, and comparing the return value (or raised exception) with the expected one.
+All cases run in this one process, without unittest's discovery, result objects or report
+formatting. The outcome is written as JSON to <result_path> in the harness' format, with a
+record (name, outcome, duration, and error if any) per case; tracebacks only show the frames
+of the user's module. With --coverage, the outcome also holds the bitmap of the user's lines
+that ran, like the harness'.
+
+Cases format (a JSON object):
+    {"imports": ["name", ...],   names the test module imports from the user module
+     "cases": [{"name": "...", "steps": [step, ...]}, ...]}
+Step format (a case without "steps" is a single step):
+    {"call": "function", "args": [...], "kwargs": {...},   or   "get": "attribute"
+     "key": <subscript, optional>, "as": "<name to store the value under, optional>",
+     "expected": <value>, "places": <int, optional>}   or   ... "raises": "ValueError"}
+A call or get may start with a stored name ("user.top_score"), and {"$ref": "user"} in the
+arguments stands for a stored value.
+
+Cases grade like the unittest class they replace if each runs the same calls, in the same
+order, as a test method, with its assertEqual as "expected" (compared with == like unittest,
+so types are kept: a returned tuple does not equal an expected list) and its assertRaises as
+"raises", and if the cases are listed in the order unittest runs the tests (by name). As with
+unittest, a missing imported name (or the module raising ImportError when imported) is a single
+erroring test, and a case raising any exception (even SystemExit) is an error, or a skip for
+SkipTest.
+
+This file is run as a script, so it must only depend on the standard library (and `child.py`,
+next to it); unlike the harness, it does not even import `unittest`.
+"""
+
+import argparse
 import json
+import math
+import os
 import sys
+import time
 import traceback
+import types
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple
+
+if __package__:
+    from app.services.evaluator.child import (
+        LineCoverage,
+        apply_limits,
+        peak_rss_kb,
+        run_as_main,
+    )
+else:  # Run as a script, the helpers are next to this file
+    from child import LineCoverage, apply_limits, peak_rss_kb, run_as_main
+
+
+def load_user_module(user_code: CodeType, user_code_path: str) -> types.ModuleType:
+    """
+    Import the (compiled) user module under its own name, like the test modules would.
+    :param user_code: The compiled user code.
+    :param user_code_path: The path of the user code file.
+    :return: The imported module.
+    """
+    name = os.path.splitext(os.path.basename(user_code_path))[0]
+    module = types.ModuleType(name)
+    module.__file__ = user_code_path
+    sys.modules[name] = module
+    exec(user_code, module.__dict__)
+    return module
 
-if len(sys.argv) != 5:
-    print(json.dumps({"error": "Invalid arguments"}))
-    sys.exit(1)
-
-user_code_path = sys.argv[1]
-function_name = sys.argv[2]
-test_cases_json = sys.argv[3]
-output_path = sys.argv[4]
-
-try:
-    import importlib.util
-
-    spec = importlib.util.spec_from_file_location("user_module", user_code_path)
-    user_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(user_module)
-    func = getattr(user_module, function_name)
-except Exception as e:
-    with open(output_path, "w") as f:
-        f.write(json.dumps({"error": f"ImportError: {e}"}))
-    sys.exit(0)
-
-try:
-    test_cases = json.loads(test_cases_json)
-except Exception as e:
-    with open(output_path, "w") as f:
-        f.write(json.dumps({"error": f"TestCaseParseError: {e}"}))
-    sys.exit(0)
-
-results = []
-for case in test_cases:
-    inp = case[0]
-    expected = case[1]
+
+def run_cases(
+    module: types.ModuleType,
+    cases: List[dict],
+    imported: Optional[Dict[str, Any]] = None,
+) -> dict:
+    """
+    Run test cases against the user module.
+    :param module: The imported user module.
+    :param cases: The test cases (see module docstring).
+    :param imported: The values of the names imported by the replaced test module, bound
+        once like by its import (other names are looked up in the module at every step).
+    :return: A dictionary with the number of passed and total cases, overall success, and a
+        record of each case in order (see `harness.run_tests`).
+    """
+    user_file = module.__file__
+    records = []
+    for case in cases:
+        started = time.perf_counter()
+        try:
+            outcome, error = _run_case(module, case, imported or {})
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            # Like unittest, which also reports SystemExit raised by a test as an error
+            if _is_instance_of(e, "SkipTest"):
+                outcome, error = "skipped", ""
+            else:
+                outcome, error = "error", format_user_traceback(e, user_file)
+        record = {
+            "name": case["name"],
+            "outcome": outcome,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        if error:
+            record["error"] = error
+        records.append(record)
+    passed = sum(1 for r in records if r["outcome"] in ("passed", "skipped"))
+    return {
+        "passed": passed,
+        "total": len(records),
+        "successful": passed == len(records),
+        "tests": records,
+    }
+
+
+def run_function_submission(
+    user_code: CodeType,
+    user_code_path: str,
+    cases: List[dict],
+    coverage: bool = False,
+    imports: Optional[List[str]] = None,
+) -> Tuple[int, dict]:
+    """
+    Run the user module and, if it exits cleanly, the test cases against it.
+    :param user_code: The compiled user code.
+    :param user_code_path: The path of the user code file.
+    :param cases: The test cases (see module docstring).
+    :param coverage: Whether to record which lines of the user module run (in both phases).
+    :param imports: The names the replaced test module imports from the user module.
+    :return: The exit code for the process, and the outcome of the last phase that ran,
+        including the duration (in ms) of each phase that ran, the peak memory of the process
+        and, with `coverage`, the bitmap of the lines that ran (see `harness.run_submission`).
+    """
+    lines = LineCoverage(user_code_path) if coverage else None
+    if lines is not None:
+        lines.start()
     try:
-        if isinstance(inp, list):
-            result = func(*inp) if isinstance(inp, tuple) else func(inp)
-        else:
-            result = func(inp)
-        passed = result == expected
-        results.append(
-            {"input": inp, "expected": expected, "result": result, "passed": passed}
+        exit_code, outcome = _run_phases(
+            user_code, user_code_path, cases, imports or []
         )
-    except Exception as e:
-        tb = traceback.TracebackException(type(e), e, e.__traceback__)
-        user_frames = []
-        for frame in tb.stack:
-            if user_code_path in frame.filename:
-                user_frames.append(
-                    f'  File "main.py", line {frame.lineno}, in {frame.name}\n    {frame.line}'
+    finally:
+        if lines is not None:
+            lines.stop()
+    if lines is not None:
+        outcome["lines_executed"] = lines.bitmap()
+    outcome["peak_rss_kb"] = peak_rss_kb()
+    return exit_code, outcome
+
+
+def _run_phases(
+    user_code: CodeType, user_code_path: str, cases: List[dict], imports: List[str]
+) -> Tuple[int, dict]:
+    """Run the user module and then the test cases (see `run_function_submission`)."""
+    started = time.perf_counter()
+    exit_code = run_as_main(user_code, user_code_path)
+    timings = {"run_ms": round((time.perf_counter() - started) * 1000, 3)}
+    if exit_code != 0:
+        return exit_code, {"phase": "run", "returncode": exit_code, "timings": timings}
+    started = time.perf_counter()
+    outcome = _run_function_tests(user_code, user_code_path, cases, imports)
+    timings["test_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return 0, {"phase": "test", **outcome, "timings": timings}
+
+
+def _run_function_tests(
+    user_code: CodeType, user_code_path: str, cases: List[dict], imports: List[str]
+) -> dict:
+    """Import the user module and run the test cases against it (see `run_cases`)."""
+    try:
+        # Other exceptions propagate, like from unittest's loader
+        module = load_user_module(user_code, user_code_path)
+        imported = {}
+        for name in imports:
+            if not hasattr(module, name):
+                raise ImportError(
+                    f"cannot import name '{name}' from '{module.__name__}'"
                 )
-        error_message = f"{type(e).__name__}: {e}"
-        if user_frames:
-            tb_filtered = (
-                "Traceback (most recent call last):\n"
-                + "\n".join(user_frames)
-                + f"\n{error_message}"
-            )
-        else:
-            tb_filtered = error_message
-        results.append(
-            {"input": inp, "expected": expected, "error": tb_filtered, "passed": False}
+            imported[name] = getattr(module, name)
+    except ImportError as e:
+        # A single erroring test, like a unittest module that cannot be imported
+        record = {
+            "name": "import",
+            "outcome": "error",
+            "duration_ms": 0.0,
+            "error": format_user_traceback(e, user_code_path),
+        }
+        return {"passed": 0, "total": 1, "successful": False, "tests": [record]}
+    return run_cases(module, cases, imported)
+
+
+def format_user_traceback(error: BaseException, user_file: str) -> str:
+    """
+    Format an exception, keeping only the traceback frames of the user's module.
+    :param error: The exception raised by the user code.
+    :param user_file: The path of the user code file.
+    :return: The formatted traceback (just the exception if no user frame is involved).
+    """
+    tb = traceback.TracebackException(type(error), error, error.__traceback__)
+    frames = [frame for frame in tb.stack if frame.filename == user_file]
+    message = "".join(tb.format_exception_only()).rstrip("\n")
+    if not frames:
+        return message
+    for frame in frames:
+        frame.filename = os.path.basename(user_file)
+    stack = traceback.StackSummary.from_list(frames).format()
+    return "Traceback (most recent call last):\n" + "".join(stack) + message
+
+
+def _run_case(
+    module: types.ModuleType, case: dict, imported: Dict[str, Any]
+) -> Tuple[str, str]:
+    """
+    Run the steps of a single case, letting unexpected exceptions propagate.
+    :return: The outcome ("passed" or "failed") and the failure message (empty if passed).
+    """
+    values = dict(imported)
+    for step in case.get("steps", [case]):
+        outcome, error = _run_step(module, values, step)
+        if outcome != "passed":
+            return outcome, error
+    return "passed", ""
+
+
+def _run_step(
+    module: types.ModuleType, values: Dict[str, Any], step: dict
+) -> Tuple[str, str]:
+    """
+    Run a single step of a case (see module docstring), storing its value if asked to.
+    :param module: The imported user module.
+    :param values: The values stored by the earlier steps of the case, by name.
+    :return: The outcome ("passed" or "failed") and the failure message (empty if passed).
+    """
+    path = (step["call"] if "call" in step else step["get"]).split(".")
+    value: Any = values[path[0]] if path[0] in values else getattr(module, path[0])
+    for attr in path[1:]:
+        value = getattr(value, attr)
+
+    expected_error = step.get("raises")
+    try:
+        if "call" in step:
+            args = _resolve(step.get("args", []), values)
+            value = value(*args, **_resolve(step.get("kwargs", {}), values))
+        if "key" in step:
+            value = value[step["key"]]
+    except Exception as e:
+        if expected_error is not None and _is_instance_of(e, expected_error):
+            return "passed", ""
+        raise
+    if expected_error is not None:
+        return "failed", f"{expected_error} not raised (returned {value!r})"
+    if "as" in step:
+        values[step["as"]] = value
+    if "expected" not in step:
+        return "passed", ""
+
+    expected = step["expected"]
+    places = step.get("places")
+    if places is not None:
+        equal = (
+            isinstance(value, (int, float))
+            and not isinstance(value, bool)
+            and math.isclose(round(abs(value - expected), places), 0)
         )
+    else:
+        # Like assertEqual: the actual value on the left, so that its __eq__ decides
+        equal = value == expected
+    if equal:
+        return "passed", ""
+    return "failed", f"Expected {expected!r}, got {value!r}"
+
+
+def _resolve(value: Any, values: Dict[str, Any]) -> Any:
+    """Replace the {"$ref": name} placeholders in arguments (recursively) by stored values."""
+    if isinstance(value, list):
+        return [_resolve(v, values) for v in value]
+    if isinstance(value, dict):
+        if set(value) == {"$ref"}:
+            return values[value["$ref"]]
+        return {k: _resolve(v, values) for k, v in value.items()}
+    return value
+
+
+def _is_instance_of(error: BaseException, class_name: str) -> bool:
+    """Whether an exception is an instance of a class (or of a subclass of a class) named so."""
+    return any(cls.__name__ == class_name for cls in type(error).__mro__)
+
+
+def main() -> int:
+    """Run the runner from the command line (see module docstring)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--search-path")
+    parser.add_argument("--max-memory-mb", type=int, default=0)
+    parser.add_argument("--max-cpu-seconds", type=int, default=0)
+    parser.add_argument("--max-file-size-mb", type=int, default=0)
+    parser.add_argument(
+        "--coverage", action="store_true", help="record the user's lines that ran"
+    )
+    for name in ("user_code_path", "cases_json", "result_path"):
+        parser.add_argument(name)
+    args = parser.parse_args()
+    # Behave like a script living next to the user's module, not next to the runner
+    sys.path[0] = os.path.dirname(os.path.abspath(args.user_code_path))
+    if args.search_path:
+        sys.path.insert(1, args.search_path)
+
+    spec = json.loads(args.cases_json)
+    with open(args.user_code_path, "rb") as f:
+        user_code = compile(f.read(), args.user_code_path, "exec", dont_inherit=True)
+    apply_limits(args.max_memory_mb, args.max_cpu_seconds, args.max_file_size_mb)
+    exit_code, outcome = run_function_submission(
+        user_code,
+        args.user_code_path,
+        spec["cases"],
+        args.coverage,
+        spec.get("imports", []),
+    )
+    with open(args.result_path, "w") as f:
+        f.write(json.dumps(outcome))
+    return exit_code
+
 
-with open(output_path, "w") as f:
-    f.write(json.dumps({"results": results}))
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+"""
+Evaluation work queue, drained by dedicated evaluator workers (on any number of hosts).
+
+Usage: python -m app.services.evaluator.work_queue [--concurrency 4] [--worker-id host-1]
+
+With `EVALUATION_QUEUE=true`, submissions made in job mode are not evaluated by the API
+process: their job is added to the `evaluation_queue` table, in the same transaction as the
+pending CodeSubmission. Workers claim jobs with `SELECT ... FOR UPDATE SKIP LOCKED` (on
+Postgres), so that concurrent workers never claim the same job nor wait on each other, and
+evaluate them with `evaluate_code`, like the API would. A claimed job is leased for
+`EVALUATION_QUEUE_LEASE_SECONDS`, and the lease is renewed while the evaluation runs; if the
+worker crashes, the lease expires and another worker claims the job again, up to
+`EVALUATION_QUEUE_MAX_ATTEMPTS` times. Like the dispatcher of the API, workers take turns
+between participants (first attempts before retries), and submissions are rejected once
+`EVALUATION_QUEUE_MAX_WAITING` jobs are waiting. Results are only recorded by the worker still
+holding the lease, and clients see them through the usual `/api/code/submit/{job_id}`.
+"""
+
+import argparse
+import logging
+import math
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.config import (
+    EVALUATION_QUEUE_LEASE_SECONDS,
+    EVALUATION_QUEUE_MAX_ATTEMPTS,
+    EVALUATION_QUEUE_MAX_WAITING,
+    EVALUATOR_MAX_CONCURRENCY,
+)
+from app.db import models
+from app.db.base import Base
+from app.db.session import SessionLocal, engine
+from app.services.evaluator import evaluator
+from app.services.evaluator.dispatcher import (
+    DEFAULT_EVALUATION_SECONDS,
+    EVALUATIONS_REJECTED,
+    EvaluationQueueFull,
+    EvaluationResult,
+)
+from app.services.evaluator.jobs import (
+    PENDING_STATUS,
+    find_orphaned_jobs,
+    record_result,
+)
+
+logger = logging.getLogger(__name__)
+
+# Interval (in seconds) at which an idle worker polls the queue for new jobs
+POLL_INTERVAL = 0.5
+
+# Delay (in seconds) before a failed job is retried, doubled after every failed attempt
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Number of available jobs looked at per job to claim, to take turns between participants
+# (a participant has at most 3 attempts, hence jobs, per snippet)
+CLAIM_WINDOW = 4
+
+
+def check_queue_room(
+    db: Session, max_waiting: int = EVALUATION_QUEUE_MAX_WAITING
+) -> None:
+    """
+    Admission control for the queue, before adding a job: like the dispatcher of the API,
+    reject new jobs while the workers are too far behind, rather than letting them wait.
+    :param db: The database session.
+    :param max_waiting: The maximum number of jobs waiting for a worker.
+    :raises EvaluationQueueFull: If `max_waiting` jobs are already waiting for a worker.
+    """
+    entry = models.EvaluationQueueEntry
+    waiting = db.query(entry).filter(entry.leased_by.is_(None)).count()
+    if waiting < max_waiting:
+        return
+    # The jobs being evaluated give a lower bound of the number of worker slots
+    running = db.query(entry).filter(entry.leased_by.isnot(None)).count()
+    EVALUATIONS_REJECTED.inc()
+    raise EvaluationQueueFull(
+        max(1, math.ceil((waiting + 1) * DEFAULT_EVALUATION_SECONDS / max(1, running)))
+    )
+
+
+def enqueue_job(db: Session, job_id: str) -> None:
+    """
+    Add the job of a pending submission to the queue (committed with the submission).
+    :param db: The database session holding the new CodeSubmission.
+    :param job_id: The job ID of the submission.
+    """
+    db.add(models.EvaluationQueueEntry(job_id=job_id, available_at=time.time()))
+
+
+def requeue_orphaned_jobs(session_factory: sessionmaker) -> int:
+    """
+    Add the jobs left pending by a stopped API process (see `jobs.find_orphaned_jobs`) to the
+    queue, on startup, so that the evaluator workers complete them.
+    :param session_factory: Factory for sessions on the database holding the queue.
+    :return: The number of jobs added to the queue (0 if another process just added them).
+    """
+    with session_factory() as db:
+        orphans = find_orphaned_jobs(db)
+        for sub in orphans:
+            enqueue_job(db, sub.job_id)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another API process starting at the same time queued them first
+            db.rollback()
+            return 0
+    if orphans:
+        logger.warning("Queued %d jobs left pending by a restart", len(orphans))
+    return len(orphans)
+
+
+class EvaluationWorker:
+    """
+    Claims jobs from the evaluation queue and evaluates them, a bounded number at a time.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        evaluate: Callable[[str, str], EvaluationResult],
+        worker_id: str,
+        concurrency: int = EVALUATOR_MAX_CONCURRENCY,
+        lease_seconds: float = EVALUATION_QUEUE_LEASE_SECONDS,
+        max_attempts: int = EVALUATION_QUEUE_MAX_ATTEMPTS,
+    ):
+        """
+        Initialize the worker.
+        :param session_factory: Factory for sessions on the database holding the queue.
+        :param evaluate: The (blocking) evaluation function, usually `evaluate_code`.
+        :param worker_id: The ID of this worker, unique across hosts.
+        :param concurrency: The maximum number of jobs evaluated at the same time.
+        :param lease_seconds: How long a claimed job is reserved for this worker, unless renewed.
+        :param max_attempts: The number of times a job is claimed before giving up on it.
+        """
+        self.session_factory = session_factory
+        self.evaluate = evaluate
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def claim(self, limit: int) -> List[str]:
+        """
+        Lease up to `limit` available jobs (new, due for a retry, or with an expired lease).
+        Like the dispatcher's `FairQueue`, first attempts are claimed before retries, and
+        participants take turns, oldest job first, so that one participant's jobs do not hold
+        back everyone else's. Jobs that were already claimed `max_attempts` times are given up
+        on instead.
+        :param limit: The maximum number of jobs to claim.
+        :return: The IDs of the claimed jobs, in the order they should be evaluated.
+        """
+        entry = models.EvaluationQueueEntry
+        sub = models.CodeSubmission
+        now = time.time()
+        claimed = []
+        with self.session_factory() as db:
+            rows = (
+                db.query(entry, sub.participant_id, sub.attempt_number)
+                .outerjoin(sub, sub.job_id == entry.job_id)
+                .filter(entry.available_at <= now)
+                .order_by(entry.id)
+                .limit(limit * CLAIM_WINDOW)
+                .with_for_update(of=entry, skip_locked=True)
+                .all()
+            )
+            turns: Dict[Optional[str], int] = {}
+            candidates = []
+            for row, participant_id, attempt_number in rows:
+                turn = turns.get(participant_id, 0)
+                turns[participant_id] = turn + 1
+                retry = (attempt_number or 1) > 1
+                candidates.append(((retry, turn, row.id), row))
+            candidates.sort(key=lambda candidate: candidate[0])
+            for _, row in candidates:
+                if len(claimed) >= limit:
+                    break
+                if row.attempts >= self.max_attempts:
+                    error = row.last_error or "evaluator worker stopped responding"
+                    self._give_up(db, row, error)
+                    continue
+                row.attempts += 1
+                row.leased_by = self.worker_id
+                row.available_at = now + self.lease_seconds
+                claimed.append(row.job_id)
+            db.commit()
+        return claimed
+
+    def renew(self, job_ids: List[str]) -> None:
+        """
+        Extend the lease of jobs still being evaluated by this worker.
+        :param job_ids: The IDs of the jobs.
+        """
+        if not job_ids:
+            return
+        entry = models.EvaluationQueueEntry
+        with self.session_factory() as db:
+            db.query(entry).filter(
+                entry.job_id.in_(job_ids), entry.leased_by == self.worker_id
+            ).update(
+                {entry.available_at: time.time() + self.lease_seconds},
+                synchronize_session=False,
+            )
+            db.commit()
+
+    def process(self, job_id: str) -> None:
+        """
+        Evaluate a claimed job and record its outcome, or schedule a retry if it failed.
+        :param job_id: The ID of the job.
+        """
+        with self.session_factory() as db:
+            sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one_or_none()
+            code, snippet_id = (sub.code, sub.snippet_id) if sub else (None, None)
+        try:
+            if code is None:
+                raise LookupError(f"No submission for job {job_id}")
+            result = self.evaluate(code, snippet_id)
+        except Exception as e:
+            logger.warning("Evaluating job %s failed", job_id, exc_info=True)
+            self._fail(job_id, str(e))
+            return
+        self._complete(job_id, result)
+
+    def run(self, stop: threading.Event) -> None:
+        """
+        Claim and evaluate jobs until `stop` is set, then finish the jobs in flight.
+        :param stop: Event set to stop the worker (e.g., on SIGTERM).
+        """
+        in_flight: Dict[Future, str] = {}
+        last_renewal = time.monotonic()
+        with ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="evaluation-worker"
+        ) as executor:
+            while not stop.is_set():
+                for future in [f for f in in_flight if f.done()]:
+                    in_flight.pop(future)
+                if time.monotonic() - last_renewal >= self.lease_seconds / 3:
+                    self.renew(list(in_flight.values()))
+                    last_renewal = time.monotonic()
+                free = self.concurrency - len(in_flight)
+                claimed = self.claim(free) if free else []
+                for job_id in claimed:
+                    in_flight[executor.submit(self.process, job_id)] = job_id
+                if in_flight and not claimed:
+                    wait(in_flight, POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                elif not in_flight:
+                    stop.wait(POLL_INTERVAL)
+            # Keep the leases of the jobs in flight until they are done
+            while in_flight:
+                done, _ = wait(in_flight, self.lease_seconds / 3)
+                for future in done:
+                    in_flight.pop(future)
+                self.renew(list(in_flight.values()))
+
+    def _complete(self, job_id: str, result: EvaluationResult) -> None:
+        """Record the result of a job and remove it from the queue, if still leased by us."""
+        with self.session_factory() as db:
+            row = self._leased(db, job_id)
+            if row is None:
+                # The lease expired and the job is someone else's now
+                logger.warning("Lease of job %s lost, discarding its result", job_id)
+                return
+            sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one_or_none()
+            if sub is not None and sub.status == PENDING_STATUS:
+                record_result(sub, result)
+            db.delete(row)
+            db.commit()
+
+    def _fail(self, job_id: str, error: str) -> None:
+        """Release a job whose evaluation failed, to be retried later (or given up on)."""
+        with self.session_factory() as db:
+            row = self._leased(db, job_id)
+            if row is None:
+                return
+            if row.attempts >= self.max_attempts:
+                self._give_up(db, row, error)
+            else:
+                backoff = RETRY_BACKOFF_SECONDS * 2 ** (row.attempts - 1)
+                row.leased_by = None
+                row.available_at = time.time() + backoff
+                row.last_error = error
+            db.commit()
+
+    def _leased(
+        self, db: Session, job_id: str
+    ) -> Optional[models.EvaluationQueueEntry]:
+        """Return the queue entry of a job if this worker holds its lease, else None."""
+        return (
+            db.query(models.EvaluationQueueEntry)
+            .filter_by(job_id=job_id, leased_by=self.worker_id)
+            .with_for_update()
+            .one_or_none()
+        )
+
+    @staticmethod
+    def _give_up(db: Session, row: models.EvaluationQueueEntry, error: str) -> None:
+        """Record a job that failed on every attempt as a runtime error, and drop it."""
+        sub = db.query(models.CodeSubmission).filter_by(job_id=row.job_id).one_or_none()
+        if sub is not None and sub.status == PENDING_STATUS:
+            record_result(
+                sub, ("runtime_error", f"Evaluation failed: {error}", None, None)
+            )
+        db.delete(row)
+
+
+def main() -> int:
+    """Run an evaluator worker from the command line (see module docstring)."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, default=EVALUATOR_MAX_CONCURRENCY)
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}:{os.getpid()}")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    Base.metadata.create_all(bind=engine)
+    evaluator.start_evaluator()
+    try:
+        logger.info("Evaluator worker %s started", args.worker_id)
+        worker = EvaluationWorker(
+            SessionLocal, evaluator.evaluate_code, args.worker_id, args.concurrency
+        )
+        worker.run(stop)
+    finally:
+        evaluator.stop_evaluator()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
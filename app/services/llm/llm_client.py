@@ -1,10 +1,21 @@
-from typing import Any, Dict, Iterator
+import contextlib
+import json
+import socket
+from typing import Any, Dict, Iterator, List
 
 import httpx
 from openai import OpenAI
 
 from app.core.config import OLLAMA_URL, OPENAI_API_KEY
+from app.utils import cancellation
 from app.utils.enums import ModelType
+from app.utils.metrics import Counter
+
+LLM_GENERATIONS_CANCELLED = Counter(
+    "llm_generations_cancelled_total",
+    "LLM generations aborted before completing because the client disconnected.",
+    ("model",),
+)
 
 # Constants for model types
 SUPPORTED_MODELS = {
@@ -81,7 +92,11 @@ class OllamaClient(BaseModelClient):
         self.model = model
         self.temperature = temperature
         self.base_url = OLLAMA_URL
-        self._client = httpx.Client(timeout=120)
+        # A new connection per generation, whose socket a cancellation can shut down (see
+        # `_stream`); reusing one would not report its socket
+        self._client = httpx.Client(
+            timeout=120, limits=httpx.Limits(max_keepalive_connections=0)
+        )
 
     def complete(self, prompt: str, system_prompt: str = None) -> str:
         """
@@ -94,24 +109,59 @@ class OllamaClient(BaseModelClient):
             "model": self.model,
             "temperature": self.temperature,
             "prompt": prompt,
-            "stream": False,
+            # Streamed, so that the generation can be aborted between tokens
+            "stream": True,
         }
         # Include system prompt if provided
         if system_prompt:
             payload["system"] = system_prompt
 
         url = f"{self.base_url}/api/generate"
-        response = self._client.post(url, json=payload)
-        response.raise_for_status()
-        return response.json()["response"]
+        parts = []
+        try:
+            for part in self._stream(url, payload):
+                cancellation.raise_if_cancelled()
+                parts.append(part)
+        except (cancellation.Cancelled, httpx.HTTPError):
+            scope = cancellation.current_scope()
+            if scope is None or not scope.cancelled:
+                raise
+            # The connection was shut down (or closed when leaving the stream), which stops
+            # the generation
+            LLM_GENERATIONS_CANCELLED.inc(model=self.model)
+            raise cancellation.Cancelled()
+        return "".join(parts)
 
     def _stream(self, url: str, payload: dict) -> Iterator[str]:
-        """Stream responses from the Ollama API."""
-        with self._client.stream("POST", url, json=payload) as r:
-            for chunk in r.iter_lines():
-                if not chunk:
-                    continue
-                yield httpx.decode_json(chunk)["response"]
+        """
+        Stream responses from the Ollama API. If the active scope is cancelled, the connection
+        is shut down right away, even while waiting for the response or its first chunk.
+        """
+        sockets: List[socket.socket] = []
+
+        def shutdown() -> None:
+            # Closing a socket does not wake a thread blocked reading it, shutting it down does
+            for sock in sockets:
+                with contextlib.suppress(OSError):
+                    sock.shutdown(socket.SHUT_RDWR)
+
+        def trace(event: str, info: dict) -> None:
+            if event == "connection.connect_tcp.complete":
+                sockets.append(info["return_value"].get_extra_info("socket"))
+                scope = cancellation.current_scope()
+                if scope is not None and scope.cancelled:
+                    shutdown()
+
+        extensions = {"trace": trace}
+        with cancellation.on_cancel(shutdown):
+            with self._client.stream(
+                "POST", url, json=payload, extensions=extensions
+            ) as r:
+                r.raise_for_status()
+                for chunk in r.iter_lines():
+                    if not chunk:
+                        continue
+                    yield json.loads(chunk)["response"]
 
 
 class ModelFactory:
@@ -0,0 +1,105 @@
+"""
+Cancellation of blocking work running on worker threads (e.g., evaluations and LLM calls),
+for requests whose client went away. The work runs inside a `CancelScope`, activated on its
+thread; the code starting child processes or network calls registers how to stop them with
+`on_cancel`, and checks `raise_if_cancelled` once they were stopped.
+"""
+
+import contextlib
+import threading
+from typing import Callable, Iterator, List, Optional
+
+_local = threading.local()
+
+
+class Cancelled(BaseException):
+    """
+    Raised by work that stopped early because its scope was cancelled. Like
+    `asyncio.CancelledError`, it is not an `Exception`, so that the handlers turning errors
+    into evaluation outcomes let it through.
+    """
+
+
+class CancelScope:
+    """A cancellation flag, with the callbacks stopping the work running in the scope."""
+
+    def __init__(self):
+        self._cancelled = False
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """Whether the scope was cancelled."""
+        return self._cancelled
+
+    def cancel(self) -> None:
+        """Cancel the scope, stopping the work that registered a callback (once)."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _register(self, callback: Callable[[], None]) -> bool:
+        """Register a callback, unless already cancelled (then it is not registered)."""
+        with self._lock:
+            if self._cancelled:
+                return False
+            self._callbacks.append(callback)
+            return True
+
+    def _unregister(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def current_scope() -> Optional[CancelScope]:
+    """Return the scope active on this thread, if any."""
+    return getattr(_local, "scope", None)
+
+
+@contextlib.contextmanager
+def activate(scope: Optional[CancelScope]) -> Iterator[None]:
+    """
+    Make a scope the active one on this thread (e.g., on a thread started for a request).
+    :param scope: The scope (None for none).
+    """
+    previous = current_scope()
+    _local.scope = scope
+    try:
+        yield
+    finally:
+        _local.scope = previous
+
+
+@contextlib.contextmanager
+def on_cancel(callback: Callable[[], None]) -> Iterator[None]:
+    """
+    Call `callback` (from another thread) if the active scope is cancelled while in the
+    block, or right away if it already was. Does nothing if no scope is active.
+    :param callback: Stops the work done in the block (e.g., kills a process).
+    """
+    scope = current_scope()
+    if scope is None:
+        yield
+        return
+    if not scope._register(callback):
+        callback()
+    try:
+        yield
+    finally:
+        scope._unregister(callback)
+
+
+def raise_if_cancelled() -> None:
+    """
+    Stop the work of a cancelled scope.
+    :raises Cancelled: If the active scope was cancelled.
+    """
+    scope = current_scope()
+    if scope is not None and scope.cancelled:
+        raise Cancelled()
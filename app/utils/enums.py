@@ -34,3 +34,18 @@ class ModelType(Enum):
     OLLAMA_DEEPSEEK_CODER_6_7_B = "deepseek-coder:6.7b"
     OLLAMA_QWEN2_5_7_B = "qwen2.5:7b"
     OLLAMA_GRANITE3_3_8B = "granite3.3:8b"
+
+
+class EvaluatorEngine(Enum):
+    """Enum for the engines that can execute submitted code."""
+
+    SUBPROCESS = "subprocess"
+    POOL = "pool"
+    FUNCTION = "function"  # Test cases as data where available, else like SUBPROCESS
+
+
+class SubmissionMode(Enum):
+    """Enum for the ways a code submission can be evaluated."""
+
+    SYNC = "sync"  # Evaluate before responding
+    JOB = "job"  # Respond with a job ID right away, evaluate in the background
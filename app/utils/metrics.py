@@ -0,0 +1,168 @@
+import bisect
+import threading
+from typing import Dict, List, Sequence, Tuple, Union
+
+# All metrics created in the process, in creation order
+REGISTRY: List[Union["Counter", "Histogram"]] = []
+
+# Default histogram buckets (in seconds), from sub-millisecond steps to whole evaluations
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Counter:
+    """
+    Monotonically increasing counter, optionally split by label values.
+    Rendered in the Prometheus text exposition format by `render_metrics`.
+    """
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        """
+        Create and register a counter.
+        :param name: The metric name (e.g., "evaluation_cache_hits_total").
+        :param description: A short description of what is counted.
+        :param labels: The names of the labels the counter is split by.
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Increment the counter.
+        :param amount: The amount to increment by.
+        :param labels: The label values, one for each of the counter's labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        """Return the current value of the counter for the given label values."""
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> List[str]:
+        """Return the lines describing this counter in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values (e.g., durations in seconds) over fixed buckets,
+    optionally split by label values. Rendered in the Prometheus text exposition format
+    (cumulative `_bucket` series, `_sum` and `_count`) by `render_metrics`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: Tuple[str, ...] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """
+        Create and register a histogram.
+        :param name: The metric name (e.g., "evaluation_phase_seconds").
+        :param description: A short description of what is observed.
+        :param labels: The names of the labels the histogram is split by.
+        :param buckets: The (increasing) upper bounds of the buckets; values above the last
+            one are only counted by the implicit "+Inf" bucket.
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> (count per bucket, with +Inf last; sum of the observed values)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record an observed value.
+        :param value: The value to record.
+        :param labels: The label values, one for each of the histogram's labels.
+        """
+        key = tuple(str(labels[name]) for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels: str) -> int:
+        """Return the number of values observed for the given label values."""
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            counts, _ = self._values.get(key, ([], 0.0))
+            return sum(counts)
+
+    def render(self) -> List[str]:
+        """Return the lines describing this histogram in the Prometheus text format."""
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            values = sorted((key, (list(c), s)) for key, (c, s) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                labels = _format_labels(self.labels + ("le",), key + (le,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render_metrics() -> str:
+    """Render every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    """Format label names and values as a Prometheus label set (empty if unlabelled)."""
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format."""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
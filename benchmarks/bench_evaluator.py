@@ -0,0 +1,147 @@
+"""
+Benchmark: throughput, latency and memory of `evaluate_code` on a corpus of submissions.
+
+Replays a corpus of realistic submissions for every snippet (A-D): the reference solution,
+the original (broken) snippet, a syntax error, a runtime error, an infinite loop and a
+submission printing far more than the output budget. The corpus is replayed a number of
+times, shuffled, through `evaluate_code` with the given engine, from a number of threads
+(like the API's evaluation dispatcher), and every submission is evaluated (the evaluation
+cache is disabled). Timeouts are calibrated first, like at application startup.
+
+The summary reports the p50/p95/p99 latency overall and per kind of submission, the
+submissions per second, and the peak memory of this process and of the evaluations (as
+reported by their child processes), so that engine changes can be compared by diffing the
+JSON of two runs.
+
+Usage: PYTHONPATH=. python benchmarks/bench_evaluator.py [--engine subprocess] [--concurrency 4]
+                                                         [--rounds 2] [--seed 0]
+Prints a JSON summary to stdout.
+"""
+
+import argparse
+import json
+import math
+import random
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from app.data.snippets import SNIPPETS
+from app.services.evaluator import evaluator
+from app.services.evaluator.cache import EvaluationCache
+from app.utils.enums import EvaluatorEngine
+
+# Submissions that are the same for every snippet, by kind
+INFINITE_LOOP = "while True:\n    pass\n"
+LARGE_OUTPUT = "for i in range(10**6):\n    print('x' * 100, i)\n"
+
+
+def build_corpus() -> List[Tuple[str, str, str]]:
+    """
+    Build the corpus of submissions.
+    :return: A list of (snippet ID, kind of submission, code), for every snippet and kind.
+    """
+    corpus = []
+    for snippet_id, snippet in sorted(SNIPPETS.items()):
+        solution = snippet.solution or snippet.code
+        submissions = {
+            "correct_fix": solution,
+            "original": snippet.code,
+            "syntax_error": solution + "\ndef broken(:\n    pass\n",
+            "runtime_error": solution + "\nraise ValueError('unexpected input')\n",
+            "infinite_loop": INFINITE_LOOP,
+            "large_output": LARGE_OUTPUT,
+        }
+        corpus.extend((snippet_id, kind, code) for kind, code in submissions.items())
+    return corpus
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Return the q-th percentile of some values (nearest rank)."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Return the p50/p95/p99 and maximum of some latencies (in ms)."""
+    summary = {f"p{q}_ms": round(percentile(latencies, q), 1) for q in (50, 95, 99)}
+    summary["max_ms"] = round(max(latencies), 1)
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--engine",
+        choices=[engine.value for engine in EvaluatorEngine],
+        default=EvaluatorEngine.SUBPROCESS.value,
+    )
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--rounds", type=int, default=2, help="number of times the corpus is replayed"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    evaluator.EVALUATOR_ENGINE = args.engine
+    # Every call must run, not return a cached result
+    evaluator.evaluation_cache = EvaluationCache(0)
+    timeouts = evaluator.calibrate_timeouts()
+
+    submissions = build_corpus() * args.rounds
+    random.Random(args.seed).shuffle(submissions)
+
+    def timed(submission: Tuple[str, str, str]) -> Tuple[str, str, float, int]:
+        snippet_id, kind, code = submission
+        start = time.perf_counter()
+        result = evaluator.evaluate_code(code, snippet_id)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        peak_rss_kb = getattr(result, "details", {}).get("peak_rss_kb") or 0
+        return kind, result[0], elapsed_ms, peak_rss_kb
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(timed, submissions))
+        elapsed = time.perf_counter() - start
+    finally:
+        evaluator.shutdown_evaluator_pool()
+        evaluator.sandbox_templates.cleanup()
+
+    latencies = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for kind, status, elapsed_ms, _ in results:
+        latencies[kind].append(elapsed_ms)
+        statuses[kind][status] += 1
+    peaks = [r[3] for r in results if r[3]] or [0]
+    summary = {
+        "python": ".".join(map(str, sys.version_info[:3])),
+        "engine": args.engine,
+        "concurrency": args.concurrency,
+        "submissions": len(submissions),
+        "timeouts_seconds": timeouts,
+        "elapsed_seconds": round(elapsed, 2),
+        "submissions_per_second": round(len(submissions) / elapsed, 2),
+        "latency": latency_summary([r[2] for r in results]),
+        "by_kind": {
+            kind: {**latency_summary(latencies[kind]), "statuses": dict(statuses[kind])}
+            for kind in sorted(latencies)
+        },
+        # In KiB. Evaluations report their own peak (the ru_maxrss of a child is at least
+        # the size of this process), and none if killed before reporting it
+        "peak_rss_kb": {
+            "benchmark_process": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "evaluation_p50": round(percentile(peaks, 50)),
+            "evaluation_max": max(peaks),
+        },
+    }
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
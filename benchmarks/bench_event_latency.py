@@ -0,0 +1,161 @@
+"""
+Benchmark: latency of /api/events/event while code evaluations are running.
+
+Fires a number of /api/code/submit requests for slow submissions and, at the same time, logs
+events at a fixed interval, recording how long each event request takes. With `--inline` the
+evaluation runs directly on the event loop (the behaviour before evaluations were dispatched
+to a thread pool), which shows how much a single slow submission stalls the worker.
+
+Usage: PYTHONPATH=. python benchmarks/bench_event_latency.py [--submissions 4] [--inline]
+Prints a JSON summary of the event latencies (in milliseconds) to stdout.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+# The benchmark uses its own throwaway SQLite database
+_db_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'bench.db')}"
+
+import httpx  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from app.api import code, events  # noqa: E402
+from app.db import models  # noqa: E402
+from app.db.base import Base  # noqa: E402
+from app.main import app  # noqa: E402
+
+# Top-level code that keeps the evaluator busy for a while (it runs for the script and tests)
+SLOW_SUBMISSION = "import time\ntime.sleep(1)\n"
+
+engine = create_engine(
+    os.environ["DATABASE_URL"], connect_args={"check_same_thread": False}
+)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def override_get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class _InlineDispatcher:
+    """Runs evaluations directly on the event loop, like the endpoint used to."""
+
+    def admit(self):
+        return None
+
+    async def run(self, evaluate, code_str, snippet_id, admission=None):
+        return evaluate(code_str, snippet_id)
+
+
+def setup_participants(count: int) -> None:
+    """Create consenting participants that are all assigned snippet B."""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        for i in range(count + 1):
+            db.add(
+                models.Participant(
+                    participant_id=f"bench{i}",
+                    consent=True,
+                    intervention_type="standard",
+                    snippet_id="B",
+                )
+            )
+        db.commit()
+
+
+async def log_events(client: httpx.AsyncClient, stop: asyncio.Event) -> list:
+    """Log events every 50ms until asked to stop, returning each request's latency in ms."""
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.post(
+            "/api/events/event",
+            json={"participant_id": "bench0", "event_type": "tab_switch"},
+        )
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+    return latencies
+
+
+async def submit(client: httpx.AsyncClient, participant_id: str) -> None:
+    """Submit the slow code for a participant."""
+    response = await client.post(
+        "/api/code/submit",
+        json={
+            "participant_id": participant_id,
+            "snippet_id": "B",
+            "code": SLOW_SUBMISSION,
+            "time_taken_ms": 1000,
+        },
+        timeout=120,
+    )
+    response.raise_for_status()
+
+
+async def run(submissions: int) -> dict:
+    """Run the benchmark and summarize the event latencies."""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        stop = asyncio.Event()
+        logger = asyncio.create_task(log_events(client, stop))
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(submit(client, f"bench{i + 1}") for i in range(submissions))
+        )
+        elapsed = time.perf_counter() - start
+        stop.set()
+        latencies = await logger
+
+    latencies.sort()
+    return {
+        "submissions": submissions,
+        "submissions_wall_time_s": round(elapsed, 3),
+        "events_logged": len(latencies),
+        "event_latency_ms": {
+            "p50": round(statistics.median(latencies), 2),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2),
+            "max": round(latencies[-1], 2),
+        },
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--submissions", type=int, default=4)
+    parser.add_argument(
+        "--inline",
+        action="store_true",
+        help="evaluate on the event loop instead of the evaluation thread pool",
+    )
+    args = parser.parse_args()
+
+    app.dependency_overrides[code.get_db] = override_get_db
+    app.dependency_overrides[events.get_db] = override_get_db
+    if args.inline:
+        code.dispatcher = _InlineDispatcher()
+    setup_participants(args.submissions)
+
+    summary = asyncio.run(run(args.submissions))
+    summary["mode"] = "inline" if args.inline else "dispatched"
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
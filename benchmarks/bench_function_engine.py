@@ -0,0 +1,98 @@
+"""
+Benchmark: the function-level engine (test cases as data) against the unittest path.
+
+Evaluates a correct fix of snippet B, whose manifest entry lists test cases grading exactly
+like its unittest class, and times, per call:
+- `evaluate_code` with the `subprocess` engine (harness running the unittest class),
+- `evaluate_code` with the `function` engine (runner checking the test cases),
+- the test phase alone, in-process: loading and running the unittest class,
+- the test phase alone, in-process: running the test cases against the imported module.
+
+Usage: PYTHONPATH=. python benchmarks/bench_function_engine.py [--repeat 20]
+Prints a JSON summary of the median per-call time (in milliseconds) to stdout.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from app.data.snippets import SNIPPETS
+from app.services.evaluator import evaluator
+from app.services.evaluator.cache import EvaluationCache
+from app.services.evaluator.harness import load_test_class, run_tests
+from app.services.evaluator.user_runner import load_user_module, run_cases
+
+SNIPPET_ID = "B"
+FIX = ("maximum(", "max(")
+
+
+def median_ms(func, repeat: int) -> float:
+    """Return the median time of a call to func, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def evaluate_with(engine: str, code: str, snippet_id: str):
+    """Evaluate code with the given engine, checking that the fix passes."""
+    evaluator.EVALUATOR_ENGINE = engine
+    result = evaluator.evaluate_code(code, snippet_id)
+    assert result[0] == "success", result
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    snippet = SNIPPETS[SNIPPET_ID]
+    cases = snippet.cases["cases"]
+    code = snippet.code.replace(*FIX)
+    # Every call must run, not return a cached result
+    evaluator.evaluation_cache = EvaluationCache(0)
+
+    # In-process test phases: the user module is imported once, under its own name
+    user_path = os.path.join(tempfile.mkdtemp(), os.path.basename(snippet.source_file))
+    module = load_user_module(compile(code, user_path, "exec"), user_path)
+    test_module = os.path.splitext(os.path.basename(snippet.test_file))[0]
+
+    def unittest_phase() -> dict:
+        suite = load_test_class(test_module, snippet.test_class, snippet.test_code)
+        return run_tests(suite)
+
+    def cases_phase() -> dict:
+        imported = {name: getattr(module, name) for name in snippet.cases["imports"]}
+        return run_cases(module, cases, imported)
+
+    assert unittest_phase()["successful"] and cases_phase()["successful"]
+    summary = {
+        "snippet": SNIPPET_ID,
+        "unittest_tests": unittest_phase()["total"],
+        "cases": len(cases),
+        "median_ms": {
+            "evaluate_subprocess": median_ms(
+                lambda: evaluate_with("subprocess", code, SNIPPET_ID), args.repeat
+            ),
+            "evaluate_function": median_ms(
+                lambda: evaluate_with("function", code, SNIPPET_ID), args.repeat
+            ),
+            "test_phase_unittest": median_ms(unittest_phase, args.repeat),
+            "test_phase_cases": median_ms(cases_phase, args.repeat),
+        },
+    }
+    evaluator.sandbox_templates.cleanup()
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
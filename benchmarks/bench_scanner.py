@@ -0,0 +1,139 @@
+"""
+Benchmark: per-call cost of the malicious code scan on large submissions.
+
+Generates a harmless submission of the given number of lines (e.g., a 5,000-line paste) and
+times, per call:
+- the scan of an already parsed tree with the previous `ast.walk`-based scanner (baseline),
+- the scan of an already parsed tree with the single-pass `RiskScanner`,
+- `detect_malicious_code` on new code (parse + scan),
+- `detect_malicious_code` on code it has seen before (remembered verdict).
+
+Usage: PYTHONPATH=. python benchmarks/bench_scanner.py [--lines 5000] [--repeat 20]
+Prints a JSON summary of the median per-call time (in milliseconds) to stdout.
+"""
+
+import argparse
+import ast
+import json
+import statistics
+import sys
+import time
+
+from app.services.evaluator.scanner import detect_malicious_code, is_high_risk_tree
+
+# A block of typical snippet code (9 lines), repeated to reach the requested size
+BLOCK = '''
+def summarize_{i}(records, threshold={i}):
+    """Summarize the records above the threshold."""
+    values = [r["score"] for r in records if r.get("score", 0) > threshold]
+    if os.path.exists("scores_{i}.log"):
+        values.append(math.sqrt(sum(v * v for v in values)))
+    report = {{"max": max(values, default=0), "count": len(values)}}
+    print(f"Summary {i}: {{report['max']:.2f}} over {{report['count']}} records")
+    return sorted(values, key=lambda v: -v)[:{i} % 5 + 1]
+'''
+
+
+def legacy_is_high_risk_tree(tree: ast.AST) -> bool:
+    """The scanner as it was before (rebuilding its name set, `ast.walk` + isinstance)."""
+    risky_names = {
+        "sys",
+        "subprocess",
+        "shutil",
+        "socket",
+        "threading",
+        "multiprocessing",
+        "ctypes",
+        "pickle",
+        "eval",
+        "exec",
+        "compile",
+        "__import__",
+    }
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                modname = alias.name.split(".")[0]
+                if modname != "os" and modname in risky_names:
+                    return True
+        if isinstance(node, ast.ImportFrom):
+            if node.module:
+                modname = node.module.split(".")[0]
+                if modname != "os" and modname in risky_names:
+                    return True
+        if isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Attribute):
+                if (
+                    isinstance(node.func.value, ast.Attribute)
+                    and isinstance(node.func.value.value, ast.Name)
+                    and node.func.value.value.id == "os"
+                    and node.func.value.attr == "path"
+                    and node.func.attr == "exists"
+                ):
+                    continue
+                if isinstance(node.func.value, ast.Name) and node.func.value.id == "os":
+                    if node.func.attr == "system":
+                        return True
+                full_name = f"{getattr(node.func.value, 'id', '')}.{node.func.attr}"
+                if node.func.attr in risky_names or full_name in risky_names:
+                    return True
+            if isinstance(node.func, ast.Name) and node.func.id in risky_names:
+                return True
+    return False
+
+
+def make_submission(lines: int) -> str:
+    """Generate a harmless submission of (about) the given number of lines."""
+    blocks = ["import math\nimport os\n"]
+    for i in range(max(1, lines // BLOCK.count("\n"))):
+        blocks.append(BLOCK.format(i=i))
+    return "".join(blocks)
+
+
+def median_ms(func, repeat: int) -> float:
+    """Return the median time of a call to func, in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    code = make_submission(args.lines)
+    tree = ast.parse(code)
+    assert not legacy_is_high_risk_tree(tree) and not is_high_risk_tree(tree)
+
+    variants = iter(range(sys.maxsize))
+    summary = {
+        "lines": code.count("\n"),
+        "ast_nodes": sum(1 for _ in ast.walk(tree)),
+        "median_ms": {
+            "legacy_scan": median_ms(
+                lambda: legacy_is_high_risk_tree(tree), args.repeat
+            ),
+            "scan": median_ms(lambda: is_high_risk_tree(tree), args.repeat),
+            "parse": median_ms(lambda: ast.parse(code), args.repeat),
+            # Every call gets new code (a changed trailing comment), so nothing is remembered
+            "detect_new_code": median_ms(
+                lambda: detect_malicious_code(f"{code}# {next(variants)}\n"),
+                args.repeat,
+            ),
+            "detect_seen_code": median_ms(
+                lambda: detect_malicious_code(code), args.repeat
+            ),
+        },
+    }
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
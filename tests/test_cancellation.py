@@ -0,0 +1,205 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.api.code import until_disconnected
+from app.services.evaluator import evaluator
+from app.services.evaluator.cache import EvaluationCache
+from app.services.evaluator.dispatcher import (
+    EVALUATIONS_CANCELLED,
+    EvaluationDispatcher,
+)
+from app.services.evaluator.evaluator import (
+    EVALUATION_PROCESSES_CANCELLED,
+    evaluate_code,
+)
+from app.services.evaluator.pool import EvaluatorPool
+from app.services.llm.llm_client import LLM_GENERATIONS_CANCELLED, OllamaClient
+from app.utils import cancellation
+
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    """Evaluate every submission."""
+    monkeypatch.setattr(evaluator, "evaluation_cache", EvaluationCache(0))
+
+
+class _DisconnectedRequest:
+    """Stands in for the request of a client that went away."""
+
+    async def is_disconnected(self) -> bool:
+        return True
+
+
+async def _run_then_cancel(dispatcher, evaluate, code, delay):
+    """Start an evaluation, and cancel it (like a disconnect would) after a delay."""
+    task = asyncio.ensure_future(dispatcher.run(evaluate, code, "B"))
+    await asyncio.sleep(delay)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+class TestCancellation:
+    """Test suite for cancelling the work of requests whose client disconnected."""
+
+    @pytest.mark.parametrize("engine", ["subprocess", "pool"])
+    def test_running_evaluation_killed(self, no_cache, monkeypatch, engine):
+        """Test that cancelling a running evaluation kills its child process right away."""
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", engine)
+        if engine == "pool":
+            pool = EvaluatorPool(
+                size=1,
+                max_jobs=10,
+                code_dir=evaluator.CODE_DIR,
+                snippet_tests=evaluator.SNIPPET_TESTS,
+                test_code={sid: s.test_code for sid, s in evaluator.SNIPPETS.items()},
+                timeout=5,
+            )
+            pool.start()
+            monkeypatch.setattr(evaluator, "get_evaluator_pool", lambda: pool)
+        dispatcher = EvaluationDispatcher(max_workers=1)
+        cancelled = EVALUATIONS_CANCELLED.value(stage="running")
+        start = time.monotonic()
+        asyncio.run(
+            _run_then_cancel(dispatcher, evaluate_code, "while True:\n    pass\n", 0.5)
+        )
+        while dispatcher._running:
+            time.sleep(0.01)
+        assert time.monotonic() - start < 1.5
+        assert EVALUATIONS_CANCELLED.value(stage="running") == cancelled + 1
+        if engine == "pool":
+            # The pool replaced the killed worker, and still evaluates submissions
+            assert pool.evaluate("x = 1\n", "B")[0] == "test_failure"
+            pool.shutdown()
+
+    def test_subprocess_cancel_counted(self, no_cache):
+        """Test that the killed evaluator processes are counted, and nothing is returned."""
+        killed = EVALUATION_PROCESSES_CANCELLED.value()
+        scope = cancellation.CancelScope()
+        threading.Timer(0.3, scope.cancel).start()
+        with cancellation.activate(scope):
+            with pytest.raises(cancellation.Cancelled):
+                evaluate_code("while True:\n    pass\n", "B")
+        assert EVALUATION_PROCESSES_CANCELLED.value() == killed + 1
+
+    def test_waiting_evaluation_not_run(self):
+        """Test that an evaluation cancelled while waiting for a worker never runs."""
+        dispatcher = EvaluationDispatcher(max_workers=1, max_queue=1)
+        release = threading.Event()
+        ran = []
+
+        def evaluate(code, snippet_id):
+            ran.append(code)
+            if code == "busy":
+                release.wait(5)
+            return "success", "", 1, 1
+
+        async def scenario():
+            busy = asyncio.ensure_future(dispatcher.run(evaluate, "busy", "B"))
+            await asyncio.sleep(0.05)
+            await _run_then_cancel(dispatcher, evaluate, "waiting", 0.05)
+            release.set()
+            await busy
+
+        waiting = EVALUATIONS_CANCELLED.value(stage="waiting")
+        asyncio.run(scenario())
+        assert ran == ["busy"]
+        assert EVALUATIONS_CANCELLED.value(stage="waiting") == waiting + 1
+
+    def test_until_disconnected(self):
+        """Test that a client disconnecting cancels the work done for its request."""
+        scope = cancellation.CancelScope()
+
+        async def scenario():
+            work = asyncio.ensure_future(asyncio.sleep(10))
+            with pytest.raises(HTTPException) as e:
+                await until_disconnected(_DisconnectedRequest(), work, scope)
+            assert e.value.status_code == 499
+            await asyncio.sleep(0)
+            assert work.cancelled()
+
+        asyncio.run(scenario())
+        assert scope.cancelled
+
+    def test_ollama_generation_aborted(self):
+        """Test that a cancelled generation stops reading (and closes) the Ollama stream."""
+        closed = []
+
+        class Stream(httpx.SyncByteStream):
+            def __iter__(self):
+                for token in ("Your ", "code ", "fails"):
+                    yield (json.dumps({"response": token}) + "\n").encode()
+
+            def close(self):
+                closed.append(True)
+
+        client = OllamaClient(model="llama3.1:8b")
+        client.base_url = "http://ollama"
+        client._client = httpx.Client(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(200, stream=Stream())
+            )
+        )
+        assert client.complete("prompt") == "Your code fails"
+
+        aborted = LLM_GENERATIONS_CANCELLED.value(model="llama3.1:8b")
+        scope = cancellation.CancelScope()
+        scope.cancel()
+        with cancellation.activate(scope):
+            with pytest.raises(cancellation.Cancelled):
+                client.complete("prompt")
+        assert closed == [True, True]
+        assert LLM_GENERATIONS_CANCELLED.value(model="llama3.1:8b") == aborted + 1
+
+    @pytest.mark.parametrize("send_headers", [False, True])
+    def test_ollama_generation_aborted_before_first_chunk(self, send_headers):
+        """Test that a generation is aborted while the stream blocks before its first chunk."""
+        server = socket.create_server(("127.0.0.1", 0))
+        received, done = threading.Event(), threading.Event()
+
+        def serve():
+            conn, _ = server.accept()
+            with conn:
+                conn.recv(65536)
+                if send_headers:
+                    conn.sendall(
+                        b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                    )
+                received.set()
+                done.wait(10)
+
+        threading.Thread(target=serve, daemon=True).start()
+        client = OllamaClient(model="llama3.1:8b")
+        client.base_url = f"http://127.0.0.1:{server.getsockname()[1]}"
+        aborted = LLM_GENERATIONS_CANCELLED.value(model="llama3.1:8b")
+        scope = cancellation.CancelScope()
+        errors = []
+
+        def generate():
+            with cancellation.activate(scope):
+                try:
+                    client.complete("prompt")
+                except BaseException as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=generate)
+        thread.start()
+        try:
+            assert received.wait(5)
+            started = time.monotonic()
+            scope.cancel()
+            thread.join(5)
+            assert not thread.is_alive()
+            assert time.monotonic() - started < 1
+        finally:
+            done.set()
+            server.close()
+        assert [type(e) for e in errors] == [cancellation.Cancelled]
+        assert LLM_GENERATIONS_CANCELLED.value(model="llama3.1:8b") == aborted + 1
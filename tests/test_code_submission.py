@@ -1,4 +1,13 @@
+import asyncio
+
 import pytest
+from sqlalchemy.orm import Session
+
+from app.db import models
+from app.services.evaluator.dispatcher import EvaluationDispatcher
+from app.services.evaluator.harness import DetailedResult
+from app.services.evaluator.jobs import resume_orphaned_jobs
+from tests.conftest import TestingSessionLocal
 
 
 @pytest.mark.usefixtures("client")
@@ -252,6 +261,30 @@ class TestCodeSubmission:
         assert "error" in data
         assert "markdown" in data
 
+    def test_get_code_snippet_db_off_event_loop(self, client, monkeypatch):
+        """Test that fetching a snippet never blocks the event loop on the database."""
+        self.setup_participant(client, monkeypatch, "snippetloopuser")
+        on_event_loop = []
+
+        def spy(method):
+            def wrapper(*args, **kwargs):
+                try:
+                    asyncio.get_running_loop()
+                    on_event_loop.append(True)
+                except RuntimeError:
+                    on_event_loop.append(False)
+                return method(*args, **kwargs)
+
+            return wrapper
+
+        monkeypatch.setattr(Session, "get", spy(Session.get))
+        monkeypatch.setattr(Session, "commit", spy(Session.commit))
+        response = client.get(
+            "/api/code/snippet", params={"participant_id": "snippetloopuser"}
+        )
+        assert response.status_code == 200
+        assert on_event_loop and not any(on_event_loop)
+
     def test_get_code_snippet_no_participant(self, client):
         """Test that getting a code snippet fails if participant does not exist."""
         response = client.get(
@@ -334,3 +367,245 @@ class TestCodeSubmission:
             response.json()["detail"]
             == "Intervention type not assigned for participant."
         )
+
+    @staticmethod
+    def setup_participant(client, monkeypatch, participant_id) -> str:
+        """
+        Helper method to set up a participant with consent, experience, MCQ answers, and a snippet.
+        :param client: the test client to use for API requests.
+        :param monkeypatch: the monkeypatch fixture, used to stub out the LLM.
+        :param participant_id: the ID of the participant to set up.
+        :return: The snippet ID assigned to the participant.
+        """
+        client.post(
+            "/api/participants/consent",
+            json={"participant_id": participant_id, "consent": True},
+        )
+        client.post(
+            "/api/participants/experience",
+            json={"participant_id": participant_id, "python_yoe": 2},
+        )
+        questions = client.get(
+            "/api/participants/questions", params={"participant_id": participant_id}
+        ).json()
+        for q in questions:
+            qid = q["id"] if "id" in q else list(q.keys())[0]
+            client.post(
+                "/api/participants/question",
+                json={
+                    "participant_id": participant_id,
+                    "question_id": qid,
+                    "answer": "0",
+                    "time_taken_ms": 1000,
+                },
+            )
+        monkeypatch.setattr(
+            "app.api.code.get_rephrased_error_message",
+            lambda code_snippet, error_msg, intervention_type: "Rephrased error message",
+        )
+        response = client.get(
+            "/api/code/snippet", params={"participant_id": participant_id}
+        )
+        return response.json()["id"]
+
+    def test_submit_code_job_mode(self, client, monkeypatch):
+        """Test that a job mode submission is accepted right away and can be polled for its result."""
+        snippet_id = self.setup_participant(client, monkeypatch, "jobuser1")
+        monkeypatch.setattr(
+            "app.api.code.evaluate_code",
+            lambda code, code_snippet_id: ("test_failure", "", 3, 5),
+        )
+
+        response = client.post(
+            "/api/code/submit",
+            params={"mode": "job"},
+            json={
+                "participant_id": "jobuser1",
+                "snippet_id": snippet_id,
+                "code": "print('hello')",
+                "time_taken_ms": 1234,
+            },
+        )
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        assert response.json()["status"] == "pending"
+
+        response = client.get(f"/api/code/submit/{job_id}", params={"wait": 5})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "test_failure"
+        assert data["attempt_number"] == 1
+        assert (data["tests_passed"], data["tests_total"]) == (3, 5)
+
+    def test_pending_jobs_resumed_after_restart(self, client):
+        """Test that jobs left pending by a stopped process are evaluated again on startup."""
+        with TestingSessionLocal() as db:
+            for attempt, job_id, status in (
+                (1, "done", "success"),
+                (2, "orphan", "pending"),
+                (3, "queued", "pending"),
+            ):
+                db.add(
+                    models.CodeSubmission(
+                        participant_id="restartuser",
+                        snippet_id="B",
+                        attempt_number=attempt,
+                        code=f"# {job_id}",
+                        status=status,
+                        job_id=job_id,
+                    )
+                )
+            db.add(models.EvaluationQueueEntry(job_id="queued", available_at=0))
+            db.commit()
+        evaluated = []
+
+        def evaluate(code, snippet_id):
+            evaluated.append((code, snippet_id))
+            return "test_failure", "", 3, 5
+
+        resumed = asyncio.run(resume_orphaned_jobs(TestingSessionLocal, evaluate))
+        assert resumed == 1
+        assert evaluated == [("# orphan", "B")]
+        data = client.get("/api/code/submit/orphan").json()
+        assert (data["status"], data["tests_passed"], data["tests_total"]) == (
+            "test_failure",
+            3,
+            5,
+        )
+        assert client.get("/api/code/submit/queued").json()["status"] == "pending"
+        assert asyncio.run(resume_orphaned_jobs(TestingSessionLocal, evaluate)) == 0
+
+    def test_submit_code_stores_per_test_results(self, client, monkeypatch):
+        """Test that the per-test records and passed-test bitmask are stored with the attempt."""
+        snippet_id = self.setup_participant(client, monkeypatch, "testrecords")
+        records = [
+            {"name": "test_a", "outcome": "passed", "duration_ms": 0.5},
+            {"name": "test_b", "outcome": "failed", "duration_ms": 1.5},
+        ]
+        monkeypatch.setattr(
+            "app.api.code.evaluate_code",
+            lambda code, code_snippet_id: DetailedResult(
+                "test_failure",
+                "",
+                1,
+                2,
+                test_results=records,
+                tests_passed_mask=0b01,
+            ),
+        )
+
+        response = client.post(
+            "/api/code/submit",
+            json={
+                "participant_id": "testrecords",
+                "snippet_id": snippet_id,
+                "code": "print('hello')",
+                "time_taken_ms": 1234,
+            },
+        )
+        assert response.status_code == 200
+        with TestingSessionLocal() as db:
+            sub = (
+                db.query(models.CodeSubmission)
+                .filter_by(participant_id="testrecords")
+                .one()
+            )
+            assert (sub.status, sub.tests_passed, sub.tests_total) == (
+                "test_failure",
+                1,
+                2,
+            )
+            assert sub.test_results == records
+            assert sub.tests_passed_mask == 0b01
+
+    def test_submit_code_job_mode_attempt_limit_while_pending(
+        self, client, monkeypatch
+    ):
+        """Test that queued job mode submissions count towards the maximum number of attempts."""
+        snippet_id = self.setup_participant(client, monkeypatch, "jobuser2")
+
+        async def never_run(
+            session_factory, job_id, evaluate, code, sid, admission, *_
+        ):
+            # Free the dispatcher slot the job was admitted with
+            admission.release()
+
+        # Keep every job pending, as if the evaluator was still busy
+        monkeypatch.setattr("app.api.code.run_evaluation_job", never_run)
+        job_ids = []
+        for _ in range(3):
+            response = client.post(
+                "/api/code/submit",
+                params={"mode": "job"},
+                json={
+                    "participant_id": "jobuser2",
+                    "snippet_id": snippet_id,
+                    "code": "print('hello')",
+                    "time_taken_ms": 1234,
+                },
+            )
+            assert response.status_code == 202
+            job_ids.append(response.json()["job_id"])
+
+        response = client.get(f"/api/code/submit/{job_ids[-1]}")
+        assert response.json()["status"] == "pending"
+        assert response.json()["attempt_number"] == 3
+
+        response = client.post(
+            "/api/code/submit",
+            params={"mode": "job"},
+            json={
+                "participant_id": "jobuser2",
+                "snippet_id": snippet_id,
+                "code": "print('hello')",
+                "time_taken_ms": 1234,
+            },
+        )
+        assert response.status_code == 403
+        assert (
+            response.json()["detail"]
+            == "Maximum number of attempts (3) reached for this snippet."
+        )
+
+    @pytest.mark.parametrize("mode", ["sync", "job"])
+    def test_submit_code_queue_full(self, client, monkeypatch, mode):
+        """Test that a submission is rejected with 429 when the evaluation queue is full, without using up an attempt."""
+        snippet_id = self.setup_participant(client, monkeypatch, f"busy{mode}")
+        busy = EvaluationDispatcher(max_workers=1, max_queue=0)
+        monkeypatch.setattr("app.api.code.dispatcher", busy)
+        monkeypatch.setattr("app.services.evaluator.jobs.dispatcher", busy)
+        monkeypatch.setattr(
+            "app.api.code.evaluate_code",
+            lambda code, code_snippet_id: ("success", "", 1, 1),
+        )
+        submission = {
+            "participant_id": f"busy{mode}",
+            "snippet_id": snippet_id,
+            "code": "print('hello')",
+            "time_taken_ms": 1234,
+        }
+
+        # Another evaluation occupies the only worker
+        admission = busy.admit()
+        response = client.post(
+            "/api/code/submit", params={"mode": mode}, json=submission
+        )
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        with TestingSessionLocal() as db:
+            assert db.query(models.CodeSubmission).count() == 0
+
+        admission.release()
+        response = client.post(
+            "/api/code/submit", params={"mode": mode}, json=submission
+        )
+        assert response.status_code in (200, 202)
+        with TestingSessionLocal() as db:
+            sub = db.query(models.CodeSubmission).one()
+            assert sub.attempt_number == 1
+
+    def test_get_submission_status_not_found(self, client):
+        """Test that querying an unknown job ID fails."""
+        response = client.get("/api/code/submit/unknown")
+        assert response.status_code == 404
+        assert response.json()["detail"] == "Submission job not found"
@@ -0,0 +1,1304 @@
+import ast
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.data.snippets import SNIPPETS, refresh_tests
+from app.db import models
+from app.db.base import Base
+from app.services.evaluator import evaluator, sandbox
+from app.services.evaluator.cache import (
+    CACHE_HITS,
+    CACHE_MISSES,
+    EvaluationCache,
+    SuiteVersions,
+    normalize_code,
+)
+from app.services.evaluator.capture import HeadTailBuffer, truncation_marker
+from app.services.evaluator.child import LineCoverage
+from app.services.evaluator.dispatcher import (
+    QUEUE_WAIT_SECONDS,
+    EvaluationDispatcher,
+    EvaluationQueueFull,
+    FairQueue,
+)
+from app.services.evaluator.evaluator import CODE_DIR, SNIPPET_TESTS, evaluate_code
+from app.services.evaluator.harness import (
+    CPU_LIMIT_MESSAGE,
+    DetailedResult,
+    timeout_message,
+)
+from app.services.evaluator.phases import EVALUATION_PHASE_SECONDS
+from app.services.evaluator.pool import EvaluatorPool
+from app.services.evaluator.reference import ReferenceOutcomes
+from app.services.evaluator.sandbox import SandboxTemplates
+from app.services.evaluator.scanner import detect_malicious_code, is_high_risk_tree
+from app.services.evaluator.sharding import (
+    DurationHistory,
+    list_test_methods,
+    plan_shards,
+)
+from app.services.evaluator.syntax_check import check_syntax
+from app.services.evaluator.timeouts import AdaptiveTimeouts
+from app.services.evaluator.user_runner import load_user_module, run_cases
+from app.utils import metrics
+from app.utils.metrics import Histogram
+
+
+def read_original(snippet_id: str) -> str:
+    """Return the original (broken) code of a snippet."""
+    return SNIPPETS[snippet_id].code
+
+
+def lines_run(bitmap: str) -> set:
+    """Decode the bitmap of the lines that ran (bit i: line i + 1) into line numbers."""
+    mask = int(bitmap, 16)
+    return {i + 1 for i in range(mask.bit_length()) if mask >> i & 1}
+
+
+def strip_paths(message: str) -> str:
+    """Remove temp dir paths from an error message, so that messages can be compared."""
+    return "\n".join(
+        line.split(", line")[-1] if line.strip().startswith("File ") else line
+        for line in message.splitlines()
+    )
+
+
+FIXED_B = read_original("B").replace("maximum(", "max(")
+FIXED_D = read_original("D").replace("vs.__getitem__[i]", "vs[i]")
+
+# Test cases of snippet D, covering part of its tests, for testing the `function` engine
+CASES_D = {
+    "imports": ["cosine", "most_similar_pair"],
+    "cases": [
+        {
+            "name": "cosine_identical",
+            "call": "cosine",
+            "args": [[1, 2], [1, 2]],
+            "expected": 1.0,
+            "places": 5,
+        },
+        {
+            "name": "cosine_zero_vector",
+            "call": "cosine",
+            "args": [[0, 0, 0], [1, 2, 3]],
+            "expected": 0.0,
+        },
+        {
+            "name": "cosine_different_lengths",
+            "call": "cosine",
+            "args": [[1, 2], [1, 2, 3]],
+            "raises": "ValueError",
+        },
+        {
+            "name": "most_similar_pair",
+            "steps": [
+                {
+                    "call": "most_similar_pair",
+                    "args": [[[1, 0], [0, 1], [1, 0]]],
+                    "as": "pair",
+                },
+                {"get": "pair", "key": 0, "expected": 0},
+                {"get": "pair", "key": 1, "expected": 2},
+            ],
+        },
+    ],
+}
+
+# A test method appended to a snippet's test class, failing for every submission
+NEW_TEST_METHOD = "\n    def test_zz_added(self):\n        self.fail('added')\n"
+
+# Submissions failing some tests of each snippet, whatever the engine
+BAD_FIXES = {
+    "A": ("Books logged: ", "Books: "),
+    "B": ("max(self.scores)", "min(self.scores)"),
+    "C": ("Average: ", "Mean: "),
+    "D": ("    return pair", "    return list(pair)"),
+}
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    """Evaluate every submission, unless a test opts into a cache of its own."""
+    monkeypatch.setattr(evaluator, "evaluation_cache", EvaluationCache(0))
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = EvaluatorPool(
+        size=1,
+        max_jobs=3,
+        code_dir=CODE_DIR,
+        snippet_tests=SNIPPET_TESTS,
+        test_code={sid: s.test_code for sid, s in SNIPPETS.items()},
+        timeout=2,
+        limits=evaluator.RESOURCE_LIMITS,
+        max_output_bytes=evaluator.MAX_OUTPUT_BYTES,
+    )
+    pool.start()
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture(params=["subprocess", "pool", "function"])
+def engine(request, monkeypatch, pool):
+    """Run a test against every evaluator engine."""
+    monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", request.param)
+    monkeypatch.setattr(evaluator, "get_evaluator_pool", lambda: pool)
+    return request.param
+
+
+class TestEvaluator:
+    """Test suite for the code evaluator service, run against every evaluator engine."""
+
+    def test_unknown_snippet(self, engine):
+        """Test that an unknown snippet ID is reported as not found."""
+        status, error, passed, total = evaluate_code("print('hi')", "Z")
+        assert status == "not_found"
+        assert (passed, total) == (None, None)
+
+    def test_high_risk_code(self, engine):
+        """Test that high-risk code is rejected before being executed."""
+        status, _, _, _ = evaluate_code("import subprocess\n", "B")
+        assert status == "high_risk_code"
+
+    def test_syntax_error(self, engine):
+        """Test that the original snippet A is reported as a syntax error."""
+        status, error, passed, total = evaluate_code(read_original("A"), "A")
+        assert status == "syntax_error"
+        assert "SyntaxError: unterminated triple-quoted string literal" in error
+        assert (passed, total) == (None, None)
+
+    def test_runtime_error(self, engine):
+        """Test that the original snippet B is reported as a runtime error with a traceback."""
+        status, error, _, _ = evaluate_code(read_original("B"), "B")
+        assert status == "runtime_error"
+        assert error.startswith("Traceback (most recent call last):")
+        assert error.rstrip().endswith("NameError: name 'maximum' is not defined")
+
+    def test_success(self, engine):
+        """Test that a correct fix passes the whole test suite."""
+        assert evaluate_code(FIXED_B, "B") == ("success", "", 15, 15)
+
+    def test_test_failure(self, engine):
+        """Test that a fix which runs but is incorrect is reported as a test failure."""
+        code = FIXED_B.replace("max(self.scores)", "min(self.scores)")
+        status, error, passed, total = evaluate_code(code, "B")
+        assert status == "test_failure"
+        assert total == 15
+        assert 0 < passed < total
+
+    def test_per_test_records(self, engine):
+        """Test that the outcome and duration of every test are reported, in the order run."""
+        code = FIXED_B.replace("max(self.scores)", "min(self.scores)")
+        _, _, passed, total = result = evaluate_code(code, "B")
+        records = result.details["test_results"]
+        assert len(records) == total
+        assert all(r["name"].startswith("test_") for r in records)
+        assert all(r["duration_ms"] >= 0 for r in records)
+        assert [r["name"] for r in records] == sorted(r["name"] for r in records)
+        mask = result.details["tests_passed_mask"]
+        assert bin(mask).count("1") == passed
+        for i, record in enumerate(records):
+            assert bool(mask & (1 << i)) == (record["outcome"] == "passed")
+
+    def test_resource_usage(self, engine):
+        """Test that the CPU time and peak memory of the evaluation are reported."""
+        result = evaluate_code(FIXED_B, "B")
+        assert result.details["cpu_user_ms"] + result.details["cpu_system_ms"] > 0
+        assert result.details["peak_rss_kb"] > 0
+
+    def test_peak_memory_of_submission_only(self, engine):
+        """Test that the peak memory is the submission's, whatever the size of this process."""
+        baseline = evaluate_code(FIXED_B, "B").details["peak_rss_kb"]
+        ballast = bytearray(400 * 1024 * 1024)
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1  # Make the ballast resident
+        peak = evaluate_code(FIXED_B, "B").details["peak_rss_kb"]
+        del ballast
+        assert peak < baseline + 50 * 1024
+        code = FIXED_B + '\nballast = b"x" * (100 * 1024 * 1024)\n'
+        assert evaluate_code(code, "B").details["peak_rss_kb"] > baseline + 90 * 1024
+
+    def test_timeout_recorded(self, engine):
+        """Test that the effective timeout of a run, and whether it was hit, are reported."""
+        result = evaluate_code(FIXED_B, "B")
+        assert result.details["timeout_seconds"] == evaluator.adaptive_timeouts.timeout(
+            "B"
+        )
+        assert result.details["timed_out"] is False
+
+    def test_phase_timings(self, engine):
+        """Test that the duration of every phase is reported, and exported as a histogram."""
+        runs = EVALUATION_PHASE_SECONDS.count(phase="run")
+        result = evaluate_code(FIXED_B, "B")
+        timings = result.details["phase_timings"]
+        assert {"scan_ms", "execute_ms", "run_ms", "test_ms"} <= set(timings)
+        if engine == "subprocess":
+            assert {"setup_ms", "compile_ms"} <= set(timings)
+        assert all(duration >= 0 for duration in timings.values())
+        assert timings["run_ms"] + timings["test_ms"] <= timings["execute_ms"]
+        assert EVALUATION_PHASE_SECONDS.count(phase="run") == runs + 1
+
+    def test_memory_limit(self, engine):
+        """Test that allocating more memory than allowed fails inside the user's code."""
+        status, error, _, _ = evaluate_code("data = bytearray(2 * 1024**3)\n", "B")
+        assert status == "runtime_error"
+        assert error.rstrip().endswith("MemoryError")
+
+    def test_cpu_and_file_size_limits(self, monkeypatch):
+        """Test that the CPU time and file size limits are applied to the child process."""
+        limits = dict(evaluator.RESOURCE_LIMITS, max_cpu_seconds=1, max_file_size_mb=1)
+        monkeypatch.setattr(evaluator, "RESOURCE_LIMITS", limits)
+        status, error, _, _ = evaluate_code("while True:\n    pass\n", "B")
+        assert (status, error) == ("runtime_error", CPU_LIMIT_MESSAGE)
+
+        code = "with open('big.txt', 'wb') as f:\n    f.write(bytes(2 * 1024**2))\n"
+        status, error, _, _ = evaluate_code(code, "B")
+        assert status == "runtime_error"
+        assert "File too large" in error
+
+    def test_output_limit(self, engine):
+        """Test that a submission printing too much is stopped, keeping its head and tail."""
+        status, error, _, _ = evaluate_code("while True:\n    print('x' * 999)\n", "B")
+        assert status == "runtime_error"
+        assert error.startswith("x" * 999)
+        assert "bytes of output truncated ...]" in error
+        assert error.endswith(
+            f"producing more than {evaluator.MAX_OUTPUT_BYTES} bytes of output"
+        )
+        assert len(error) < 25 * 1024
+
+    def test_long_error_truncated(self, engine):
+        """Test that only the head and tail of a long (but allowed) error are stored."""
+        code = "raise ValueError('x' * 100000 + 'end')\n"
+        status, error, _, _ = evaluate_code(code, "B")
+        assert status == "runtime_error"
+        assert error.startswith("Traceback")
+        assert error.rstrip().endswith("xend")
+        assert "bytes of output truncated ...]" in error
+        assert len(error) < 25 * 1024
+
+    def test_tests_cannot_import_module(self, engine):
+        """Test that a fix missing names used by the tests counts as a single failing test."""
+        code = FIXED_B.replace("def summarize_scores(", "def summarise_scores(")
+        code = code.replace("= summarize_scores(", "= summarise_scores(")
+        assert evaluate_code(code, "B") == ("test_failure", "", 0, 1)
+
+    def test_exit_code(self, engine):
+        """Test that a module exiting with a non-zero code is reported as a runtime error."""
+        status, error, _, _ = evaluate_code("raise SystemExit('bye')\n", "B")
+        assert (status, error) == ("runtime_error", "bye\n")
+
+    def test_high_file_descriptors(self, engine):
+        """Test that evaluations work while the process has over 1024 files open."""
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            pytest.skip("Cannot open enough files")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1200), hard))
+        fds = [os.open(os.devnull, os.O_RDONLY) for _ in range(1100)]
+        try:
+            assert evaluate_code(FIXED_B, "B") == ("success", "", 15, 15)
+        finally:
+            for fd in fds:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    def test_child_killed_when_reading_fails(self, monkeypatch):
+        """Test that the child is killed and reaped if reading its output fails."""
+        started = []
+
+        class RecordingPopen(subprocess.Popen):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                started.append(self)
+
+        def broken_drain(*args):
+            raise OSError("boom")
+
+        monkeypatch.setattr(evaluator.subprocess, "Popen", RecordingPopen)
+        monkeypatch.setattr(evaluator, "drain", broken_drain)
+        code = "import time\ntime.sleep(30)\n"
+        assert evaluate_code(code, "B") == ("runtime_error", "boom", None, None)
+        assert started[0].returncode == -9
+        with pytest.raises(ProcessLookupError):
+            os.kill(started[0].pid, 0)
+
+    def test_unknown_engine_rejected(self, monkeypatch):
+        """Test that an unsupported engine is refused on startup instead of ignored."""
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", "subinterpreter")
+        with pytest.raises(ValueError, match="Unsupported evaluator engine"):
+            evaluator.start_evaluator()
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", "pool")
+        evaluator.check_engine()
+
+
+class TestEvaluatorPool:
+    """Test suite for the pre-warmed evaluator worker pool."""
+
+    def test_same_errors_as_subprocess(self, pool, monkeypatch):
+        """Test that the pool reports runtime errors exactly like a fresh interpreter."""
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", "subprocess")
+        expected = evaluate_code(read_original("B"), "B")
+        actual = pool.evaluate(read_original("B"), "B")
+        assert strip_paths(actual[1]) == strip_paths(expected[1])
+        assert actual[0] == expected[0]
+
+    def test_timeout(self, pool):
+        """Test that a job running past the timeout is stopped and reported."""
+        status, error, _, _ = pool.evaluate("while True:\n    pass\n", "B")
+        assert status == "runtime_error"
+        assert "timed out" in error
+
+    def test_worker_recycled_after_max_jobs(self, pool):
+        """Test that a worker is replaced once it has served max_jobs jobs."""
+        pids = set()
+        for _ in range(pool.max_jobs + 1):
+            pids.update(w.process.pid for w in pool._workers)
+            pool.evaluate("x = 1\n", "B")
+        pids.update(w.process.pid for w in pool._workers)
+        assert len(pids) >= 2
+
+    def test_updated_tests(self, pool):
+        """Test that workers are replaced to run a test module updated after they started."""
+        snippet = SNIPPETS["B"]
+        with open(os.path.join(CODE_DIR, snippet.test_file)) as f:
+            source = f.read() + NEW_TEST_METHOD
+        pool.update_tests("B", compile(source, snippet.test_file, "exec"))
+        try:
+            pids = {w.process.pid for w in pool._workers}
+            assert pool.evaluate(FIXED_B, "B") == ("test_failure", "", 15, 16)
+            assert not pids & {w.process.pid for w in pool._workers}
+        finally:
+            pool.update_tests("B", snippet.test_code)
+        assert pool.evaluate(FIXED_B, "B") == ("success", "", 15, 15)
+
+
+class TestFunctionEngine:
+    """Test suite for the function-level engine, checking test cases given as data."""
+
+    @pytest.fixture(autouse=True)
+    def function_engine(self, monkeypatch):
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", "function")
+        monkeypatch.setitem(SNIPPETS, "D", SNIPPETS["D"]._replace(cases=CASES_D))
+
+    def test_success(self):
+        """Test that a correct fix passes every test case of the snippet."""
+        result = evaluate_code(FIXED_D, "D")
+        cases = CASES_D["cases"]
+        assert result == ("success", "", len(cases), len(cases))
+        records = result.details["test_results"]
+        assert [r["name"] for r in records] == [c["name"] for c in cases]
+        assert result.details["tests_passed_mask"] == 2 ** len(cases) - 1
+
+    def test_runtime_error_like_subprocess(self, monkeypatch):
+        """Test that running the module itself fails exactly like with the unittest path."""
+        status, error, _, _ = evaluate_code(read_original("D"), "D")
+        monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", "subprocess")
+        expected_status, expected_error, _, _ = evaluate_code(read_original("D"), "D")
+        assert status == expected_status == "runtime_error"
+        assert strip_paths(error) == strip_paths(expected_error)
+
+    def test_per_case_errors_show_user_frames_only(self):
+        """Test that failing cases are reported with a traceback of the user's frames."""
+        code = FIXED_D.replace(
+            "    if len(a) != len(b): raise ValueError",
+            "    if a == [0, 0, 0]: {}['boom']\n    if len(a) != len(b): raise TypeError",
+        )
+        result = evaluate_code(code, "D")
+        assert result[0] == "test_failure"
+        records = {r["name"]: r for r in result.details["test_results"]}
+        assert records["cosine_identical"] == {
+            "name": "cosine_identical",
+            "outcome": "passed",
+            "duration_ms": records["cosine_identical"]["duration_ms"],
+        }
+        error = records["cosine_zero_vector"]["error"]
+        assert error.startswith("Traceback (most recent call last):")
+        assert 'File "snippetD.py", line 11, in cosine' in error
+        assert error.endswith("KeyError: 'boom'")
+        assert "user_runner" not in error and "harness" not in error
+        assert records["cosine_different_lengths"]["outcome"] == "error"
+
+    def test_snippet_without_cases_uses_unittest(self):
+        """Test that snippets without test cases are still run against their test class."""
+        assert SNIPPETS["C"].cases is None
+        assert evaluate_code(SNIPPETS["C"].solution, "C")[0] == "success"
+
+    def test_run_cases(self, tmp_path):
+        """Test the comparison of return values and raised exceptions with the cases."""
+        path = tmp_path / "mod.py"
+        source = "def pair(x):\n    return (x, x / 3)\n\ndef fail(x):\n    return x\n"
+        code = compile(source, str(path), "exec")
+        module = load_user_module(code, str(path))
+        cases = [
+            {"name": "tuple", "call": "pair", "args": [3], "expected": [3, 1.0]},
+            {"name": "close", "call": "pair", "args": [1], "expected": [1, 0.333]},
+            {"name": "places", "call": "fail", "args": [0.3334], "expected": 0.333},
+            {"name": "raises", "call": "fail", "args": [1], "raises": "ValueError"},
+            {"name": "missing", "call": "nope", "expected": 1},
+        ]
+        cases[2]["places"] = 3
+        outcome = run_cases(module, cases)
+        outcomes = [r["outcome"] for r in outcome["tests"]]
+        assert outcomes == ["failed", "failed", "passed", "failed", "error"]
+        assert (outcome["passed"], outcome["total"]) == (1, 5)
+        assert not outcome["successful"]
+        # Like assertEqual, a returned tuple does not equal an expected list
+        assert outcome["tests"][0]["error"] == "Expected [3, 1.0], got (3, 1.0)"
+        assert outcome["tests"][3]["error"] == "ValueError not raised (returned 1)"
+        assert outcome["tests"][4]["error"].startswith("AttributeError")
+
+    def test_run_case_steps(self, tmp_path):
+        """Test cases made of several steps, sharing the values they store."""
+        path = tmp_path / "mod.py"
+        source = (
+            "import unittest\n\n"
+            "class Box:\n"
+            "    def __init__(self, items):\n"
+            "        self.items = items\n"
+            "    def add(self, item):\n"
+            "        if item is None: raise unittest.SkipTest('no item')\n"
+            "        if item < 0: raise SystemExit(1)\n"
+            "        self.items.append(item)\n"
+            "    def first(self):\n"
+            "        return self.items[0]\n\n"
+            "def merge(boxes):\n"
+            "    return {'items': [i for b in boxes for i in b.items]}\n"
+        )
+        module = load_user_module(compile(source, str(path), "exec"), str(path))
+        new_box = {"call": "Box", "args": [[1]], "as": "box"}
+        cases = [
+            {
+                "name": "add",
+                "steps": [
+                    new_box,
+                    {"call": "box.add", "args": [2]},
+                    {"get": "box.items", "expected": [1, 2]},
+                    {"call": "box.first", "expected": 1},
+                ],
+            },
+            {
+                "name": "merge",
+                "steps": [
+                    new_box,
+                    {"call": "merge", "args": [[{"$ref": "box"}, {"$ref": "box"}]]},
+                    {"call": "merge", "args": [[{"$ref": "box"}]], "key": "items"},
+                    {
+                        "call": "merge",
+                        "args": [[]],
+                        "key": "x",
+                        "raises": "LookupError",
+                    },
+                ],
+            },
+            {"name": "skip", "steps": [new_box, {"call": "box.add", "args": [None]}]},
+            {"name": "exit", "steps": [new_box, {"call": "box.add", "args": [-1]}]},
+            {"name": "stops", "steps": [new_box, {"get": "box.items", "expected": []}]},
+        ]
+        outcome = run_cases(module, cases, {"Box": module.Box})
+        outcomes = [r["outcome"] for r in outcome["tests"]]
+        assert outcomes == ["passed", "passed", "skipped", "error", "failed"]
+        assert (outcome["passed"], outcome["total"]) == (3, 5)
+        assert outcome["tests"][3]["error"].endswith("SystemExit: 1")
+        assert outcome["tests"][4]["error"] == "Expected [], got [1]"
+
+
+class TestEngineEquivalence:
+    """Test suite checking that every engine grades the snippets alike."""
+
+    @pytest.mark.parametrize("snippet_id", sorted(BAD_FIXES))
+    def test_same_grades_as_unittest(self, monkeypatch, snippet_id):
+        """Test that the `function` engine grades solutions and bad fixes like unittest."""
+        solution = SNIPPETS[snippet_id].solution
+        submissions = [
+            solution,
+            solution.replace(*BAD_FIXES[snippet_id]),
+            read_original(snippet_id),
+        ]
+        results = {}
+        for engine in ("function", "subprocess"):
+            monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", engine)
+            results[engine] = [
+                (status, passed, total)
+                for status, _, passed, total in (
+                    evaluate_code(code, snippet_id) for code in submissions
+                )
+            ]
+        assert results["function"] == results["subprocess"]
+        assert results["subprocess"][0][0] == "success"
+        assert results["subprocess"][1][0] == "test_failure"
+
+    @pytest.mark.parametrize(
+        "change",
+        [
+            ("self.scores = scores", "self.scores = tuple(scores)"),
+            ("self.scores = scores", "self.scores = list(scores)"),
+            ("self.scores = scores", "self.scores = sorted(scores)"),
+            ("if self.scores else 0", "if self.scores else None"),
+            ("max(self.scores)", "float(max(self.scores))"),
+            ("max(self.scores)", "str(max(self.scores))"),
+            ("max(self.scores)", "self.scores[-1]"),
+            ("self.scores.append(score)", "self.scores.insert(0, score)"),
+            ("self.scores.append(score)", "self.scores = self.scores + [score]"),
+            ("self.scores.append(score)", "raise SystemExit(1)"),
+            ("self.scores.append(score)", "return self.scores.append(score)"),
+            ("def summarize_scores(", "def summarise_scores("),
+            (
+                "{u.name: u.top_score() for u in users}",
+                "[u.top_score() for u in users]",
+            ),
+            ("{u.name: u.top_score() for u in users}", "{u.name: 0 for u in users}"),
+            (
+                "def summarize_scores(users):",
+                "if __name__ != '__main__':\n    raise RuntimeError\n\n\n"
+                "def summarize_scores(users):",
+            ),
+            (
+                "return max(self.scores)",
+                "score = type('Score', (float,), {'__eq__': lambda s, o: True})\n"
+                "        return score(max(self.scores))",
+            ),
+        ],
+    )
+    def test_snippet_b_mutants(self, monkeypatch, change):
+        """Test that snippet B's test cases grade broken fixes exactly like its test class."""
+        code = SNIPPETS["B"].solution.replace(*change)
+        assert code != SNIPPETS["B"].solution
+        scripts = []
+        run_child = evaluator._run_child
+        monkeypatch.setattr(
+            evaluator,
+            "_run_child",
+            lambda script, *args: scripts.append(script) or run_child(script, *args),
+        )
+        results = {}
+        for engine in ("function", "subprocess"):
+            monkeypatch.setattr(evaluator, "EVALUATOR_ENGINE", engine)
+            result = evaluate_code(code, "B")
+            records = getattr(result, "details", {}).get("test_results") or []
+            passed = {
+                r["name"] for r in records if r["outcome"] in ("passed", "skipped")
+            }
+            results[engine] = (result[0], result[2], result[3], passed)
+        assert scripts == [evaluator.RUNNER_PATH, evaluator.HARNESS_PATH]
+        assert results["function"] == results["subprocess"]
+
+
+class TestEvaluationCache:
+    """Test suite for the content-addressed evaluation cache."""
+
+    @pytest.fixture
+    def session_factory(self):
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        return sessionmaker(bind=engine)
+
+    @pytest.fixture
+    def cache(self, monkeypatch, session_factory):
+        cache = EvaluationCache(8, session_factory)
+        monkeypatch.setattr(evaluator, "evaluation_cache", cache)
+        return cache
+
+    def test_whitespace_only_changes_hit(self, cache, monkeypatch):
+        """Test that resubmitting code with other trailing whitespace is not re-evaluated."""
+        expected = evaluate_code(FIXED_B, "B")
+        monkeypatch.setattr(evaluator, "_evaluate_uncached", None)
+        hits = CACHE_HITS.value(tier="memory")
+        assert evaluate_code(FIXED_B.replace("\n", "  \r\n"), "B") == expected
+        assert CACHE_HITS.value(tier="memory") == hits + 1
+
+    def test_whitespace_in_strings_is_kept(self):
+        """Test that normalization never changes what the code means."""
+        code = 's = """a  \nb"""\n'
+        assert normalize_code(code) == code
+        assert normalize_code("x = 1   \r\n") == "x = 1\n"
+
+    def test_persistent_tier(self, cache, session_factory):
+        """Test that results survive a restart through the database tier."""
+        cache.put("key", "B", "v1", ("test_failure", "", 3, 15))
+        fresh = EvaluationCache(8, session_factory)
+        hits = CACHE_HITS.value(tier="database")
+        assert fresh.get("key") == ("test_failure", "", 3, 15)
+        assert CACHE_HITS.value(tier="database") == hits + 1
+
+    def test_persistent_tier_keeps_details(self, cache, session_factory):
+        """Test that per-test records are cached along with the status tuple."""
+        records = [{"name": "test_a", "outcome": "passed", "duration_ms": 0.1}]
+        result = DetailedResult("success", "", 1, 1, test_results=records)
+        cache.put("key", "B", "v1", result)
+        cached = EvaluationCache(8, session_factory).get("key")
+        assert cached == ("success", "", 1, 1)
+        assert cached.details == {"test_results": records}
+
+    def test_run_details_not_cached(self, cache):
+        """Test that the resource usage, timeout and timings of the run are not cached."""
+        result = DetailedResult(
+            "success",
+            "",
+            1,
+            1,
+            cpu_user_ms=5,
+            timeout_seconds=2.0,
+            timed_out=False,
+            phase_timings={"run_ms": 1.0},
+        )
+        cache.put("key", "B", "v1", result)
+        assert cache.get("key").details == {}
+
+    def test_uncacheable_results(self, cache):
+        """Test that timeouts and other infrastructure errors are not cached."""
+        misses = CACHE_MISSES.value()
+        cache.put(
+            "key", "B", "v1", ("runtime_error", "Execution timed out", None, None)
+        )
+        assert cache.get("key") is None
+        assert CACHE_MISSES.value() == misses + 1
+
+    @pytest.mark.parametrize(
+        "error",
+        [
+            "Traceback (most recent call last):\n  ...\nMemoryError\n",
+            "Traceback (most recent call last):\n  ...\n"
+            "OSError: [Errno 27] File too large\n",
+        ],
+    )
+    def test_limit_errors_not_cached(self, cache, error):
+        """Test that errors raised by hitting a resource limit are not cached."""
+        cache.put("key", "B", "v1", ("runtime_error", error, None, None))
+        assert cache.get("key") is None
+
+    def test_settings_in_key(self, cache, monkeypatch):
+        """Test that results obtained under other limits or coverage are not replayed."""
+        evaluate_code(FIXED_B, "B")
+        evaluated = []
+        evaluate_uncached = evaluator._evaluate_uncached
+
+        def spy(*args):
+            evaluated.append(args[0])
+            return evaluate_uncached(*args)
+
+        monkeypatch.setattr(evaluator, "_evaluate_uncached", spy)
+        monkeypatch.setitem(evaluator.RESOURCE_LIMITS, "max_memory_mb", 256)
+        evaluate_code(FIXED_B, "B")
+        monkeypatch.setattr(evaluator, "EVALUATOR_LINE_COVERAGE", True)
+        result = evaluate_code(FIXED_B, "B")
+        assert len(evaluated) == 2
+        assert "lines_executed" in result.details
+
+    def test_lru_eviction(self):
+        """Test that the least recently used entry is evicted from memory."""
+        cache = EvaluationCache(2)
+        cache.put("a", "B", "v1", ("success", "", 15, 15))
+        cache.put("b", "B", "v1", ("success", "", 15, 15))
+        cache.get("a")
+        cache.put("c", "B", "v1", ("success", "", 15, 15))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+
+    def test_invalidated_when_tests_change(self, cache, tmp_path):
+        """Test that editing a test file changes the suite version and drops old entries."""
+        test_file = tmp_path / "test_snippetB.py"
+        test_file.write_text("# version 1\n")
+        versions = SuiteVersions(str(tmp_path), {"B": "test_snippetB.py"})
+        old_version, _ = versions.get("B")
+        cache.put("key", "B", old_version, ("success", "", 15, 15))
+        assert versions.get("B") == (old_version, False)
+
+        test_file.write_text("# version 2, longer\n")
+        new_version, changed = versions.get("B")
+        assert changed and new_version != old_version
+        cache.invalidate("B", new_version)
+        assert cache.get("key") is None
+
+
+class TestReferenceOutcomes:
+    """Test suite for the precomputed outcomes of the original snippets."""
+
+    @pytest.fixture
+    def references(self, monkeypatch):
+        """Compute the outcomes of the original snippets, then forbid any evaluation."""
+        references = ReferenceOutcomes(CODE_DIR, evaluator.suite_versions.test_files)
+        monkeypatch.setattr(evaluator, "reference_outcomes", references)
+        statuses = evaluator.compute_reference_outcomes()
+        assert statuses == {
+            "A": "syntax_error",
+            "B": "runtime_error",
+            "C": "runtime_error",
+            "D": "runtime_error",
+        }
+
+        def no_evaluation(code, snippet_id, timings=None):
+            raise AssertionError("evaluated")
+
+        monkeypatch.setattr(evaluator, "_evaluate_uncached", no_evaluation)
+        return references
+
+    @pytest.mark.parametrize("snippet_id", ["A", "B"])
+    def test_cosmetic_edits_answered(self, references, snippet_id):
+        """Test that the original code, up to invisible edits, is answered without running."""
+        code = read_original(snippet_id)
+        expected = evaluate_code(code, snippet_id)
+        if snippet_id == "B":
+            code = code.replace("\n", "  \n", 1) + "\n\n"
+        assert evaluate_code(code, snippet_id) == expected
+        assert "reference_ms" in expected.details["phase_timings"]
+
+    @pytest.mark.parametrize(
+        "edit",
+        [
+            lambda code: FIXED_B,
+            lambda code: "\n" + code,  # Moves code to other lines
+            lambda code: code.replace(
+                "maximum(", "maximum ("
+            ),  # Moves the error's column
+            lambda code: code.replace(
+                "else 0", "else 0  # Default"
+            ),  # Quoted by errors
+        ],
+    )
+    def test_changed_code_evaluated(self, references, edit):
+        """Test that fixes, and edits that may show in the outcome, are evaluated."""
+        with pytest.raises(AssertionError, match="evaluated"):
+            evaluate_code(edit(read_original("B")), "B")
+
+    def test_dropped_when_tests_change(self, tmp_path):
+        """Test that an outcome is dropped once the snippet's test file changes."""
+        test_file = tmp_path / "test_snippetB.py"
+        test_file.write_text("# version 1\n")
+        references = ReferenceOutcomes(str(tmp_path), {"B": "test_snippetB.py"})
+        references.compute({"B": "x = 1\n"}, lambda code, sid: ("success", "", 1, 1))
+        assert references.get("x = 1  \n\n", "B") == ("success", "", 1, 1)
+
+        test_file.write_text("# version 2, longer\n")
+        assert references.get("x = 1\n", "B") is None
+
+
+class TestLineCoverage:
+    """Test suite for recording which lines of a submission ran."""
+
+    @pytest.mark.parametrize(
+        "api",
+        [
+            pytest.param(
+                "monitoring",
+                marks=pytest.mark.skipif(
+                    not hasattr(sys, "monitoring"), reason="Python 3.12+ only"
+                ),
+            ),
+            "settrace",
+        ],
+    )
+    def test_lines_recorded(self, tmp_path, api):
+        """Test that each line that ran is recorded once, and only lines of the user file."""
+        path = str(tmp_path / "user.py")
+        source = "def f(x):\n    if x:\n        return 1\n    return 2\n\nf(True)\n"
+        code = compile(source, path, "exec")
+        lines = LineCoverage(path)
+        if api == "settrace":
+            lines._monitoring = None
+        lines.start()
+        try:
+            exec(code, {})  # Lines of this file (running too) are ignored
+        finally:
+            lines.stop()
+        assert lines.lines == {1, 2, 3, 6}
+        assert lines_run(lines.bitmap()) == {1, 2, 3, 6}
+
+    def test_evaluation_records_lines(self, monkeypatch):
+        """Test that evaluations store the lines run by the module and its tests."""
+        monkeypatch.setattr(evaluator, "EVALUATOR_LINE_COVERAGE", True)
+        broken = lines_run(
+            evaluate_code(read_original("B"), "B").details["lines_executed"]
+        )
+        # The module stopped at the NameError, before the tests (calling add_score) ran
+        assert {1, 8, 13, 20, 25, 26} <= broken
+        assert not {16, 27, 28} & broken
+        fixed = lines_run(evaluate_code(FIXED_B, "B").details["lines_executed"])
+        assert {13, 16, 27, 28} <= fixed
+
+    def test_pool_records_lines(self):
+        """Test that pool workers record the lines run like a fresh interpreter."""
+        pool = EvaluatorPool(
+            size=1,
+            max_jobs=3,
+            code_dir=CODE_DIR,
+            snippet_tests=SNIPPET_TESTS,
+            timeout=2,
+            coverage=True,
+        )
+        pool.start()
+        try:
+            result = pool.evaluate(FIXED_B, "B")
+        finally:
+            pool.shutdown()
+        assert {13, 16, 27, 28} <= lines_run(result.details["lines_executed"])
+
+
+class TestHeadTailBuffer:
+    """Test suite for the bounded capture of child output."""
+
+    def test_short_output_kept(self):
+        """Test that output fitting in the head and tail is kept as is, even if split."""
+        buffer = HeadTailBuffer(4, 8)
+        for chunk in (b"ab", "cdé".encode(), b"fgh"):
+            buffer.write(chunk)
+        assert buffer.getvalue() == "abcdéfgh"
+        assert buffer.omitted == 0
+
+    def test_middle_dropped(self):
+        """Test that only the head and tail of a long output are kept, with a marker."""
+        buffer = HeadTailBuffer(4, 8)
+        for i in range(100):
+            buffer.write(b"%03d," % i)
+        assert buffer.total == 400
+        assert buffer.getvalue() == "000," + truncation_marker(388) + "098,099,"
+
+
+class TestPhaseTimings:
+    """Test suite for the per-phase timing of evaluations."""
+
+    def test_histogram_render(self, monkeypatch):
+        """Test that observations are rendered as cumulative Prometheus buckets."""
+        monkeypatch.setattr(metrics, "REGISTRY", [])
+        histogram = Histogram("phase_seconds", "Test", ("phase",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, phase="scan")
+        histogram.observe(0.5, phase="scan")
+        lines = histogram.render()
+        assert 'phase_seconds_bucket{phase="scan",le="0.1"} 1' in lines
+        assert 'phase_seconds_bucket{phase="scan",le="1"} 2' in lines
+        assert 'phase_seconds_bucket{phase="scan",le="+Inf"} 2' in lines
+        assert 'phase_seconds_count{phase="scan"} 2' in lines
+        assert histogram.count(phase="scan") == 2
+
+    def test_cached_result_timed(self, monkeypatch):
+        """Test that a cache hit reports the lookup, without the timings of the original run."""
+        monkeypatch.setattr(evaluator, "evaluation_cache", EvaluationCache(8))
+        evaluate_code(FIXED_B, "B")
+        result = evaluate_code(FIXED_B, "B")
+        assert set(result.details["phase_timings"]) == {"reference_ms", "cache_ms"}
+
+
+class TestTestSharding:
+    """Test suite for splitting a test class across several processes."""
+
+    def test_list_test_methods(self):
+        """Test that the test methods are listed from the compiled module, in run order."""
+        snippet = SNIPPETS["A"]
+        names = list_test_methods(snippet.test_code, snippet.test_class)
+        assert len(names) == 15 and names == sorted(names)
+        assert "test_preview" in names and "setUp" not in names
+
+    def test_plan_balances_durations(self):
+        """Test that shards get about the same total duration, fast suites staying whole."""
+        estimates = {"a": 100.0, "b": 60.0, "c": 50.0, "d": 10.0}
+        assert plan_shards(estimates, 2) == [["a", "d"], ["b", "c"]]
+        assert plan_shards(estimates, 8) == [["a"], ["b"], ["c"], ["d"]]
+        assert plan_shards({"a": 1.0, "b": 2.0}, 2) == [["a", "b"]]
+
+    def test_durations_loaded_from_database(self):
+        """Test that durations are learned from the per-test records of stored submissions."""
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+        session_factory = sessionmaker(bind=engine)
+        with session_factory() as db:
+            for attempt, duration in ((1, 10.0), (2, 20.0)):
+                records = [
+                    {"name": "test_a", "outcome": "passed", "duration_ms": duration}
+                ]
+                db.add(
+                    models.CodeSubmission(
+                        participant_id="p",
+                        snippet_id="A",
+                        attempt_number=attempt,
+                        test_results=records,
+                    )
+                )
+            db.commit()
+        durations = DurationHistory(smoothing=0.5)
+        durations.load(session_factory)
+        assert durations.estimates("A", ["test_a", "test_b"]) == {
+            "test_a": 15.0,
+            "test_b": 15.0,
+        }
+
+    @pytest.mark.parametrize(
+        "code",
+        [
+            SNIPPETS["A"].solution,
+            SNIPPETS["A"].solution.replace("Books logged:", "Books:"),
+            "x = 1\n",  # The tests cannot import the module
+        ],
+    )
+    def test_same_results_as_single_process(self, monkeypatch, code):
+        """Test that sharded test runs (in separate directories) merge into a single run."""
+        monkeypatch.setattr(evaluator, "test_durations", DurationHistory())
+        monkeypatch.setattr(evaluator, "EVALUATOR_LINE_COVERAGE", True)
+        expected = evaluate_code(code, "A")
+
+        # Pretend the tests are slow, so that the suite gets split
+        durations = DurationHistory()
+        slow = [
+            {"name": name, "duration_ms": 20.0}
+            for name in list_test_methods(SNIPPETS["A"].test_code, "TestSnippetA")
+        ]
+        durations.record("A", slow)
+        monkeypatch.setattr(evaluator, "test_durations", durations)
+        monkeypatch.setattr(evaluator, "EVALUATOR_TEST_SHARDS", 3)
+        shard_runs = []
+        run_shards = evaluator._run_shards
+
+        def spy(code, snippet_id, shards, *args):
+            shard_runs.append(shards)
+            return run_shards(code, snippet_id, shards, *args)
+
+        monkeypatch.setattr(evaluator, "_run_shards", spy)
+        actual = evaluate_code(code, "A")
+        assert [len(shard) for shard in shard_runs[0]] == [5, 5, 5]
+        assert actual == expected
+        assert (
+            actual.details["tests_passed_mask"] == expected.details["tests_passed_mask"]
+        )
+        # The shards ran the lines of the tests they ran, together those of a single run
+        assert actual.details["lines_executed"] == expected.details["lines_executed"]
+        outcomes = lambda result: [
+            (record["name"], record["outcome"])
+            for record in result.details["test_results"]
+        ]
+        assert outcomes(actual) == outcomes(expected)
+
+    def test_edited_test_file(self, monkeypatch, tmp_path):
+        """Test that a test method added to the test file is run without a restart."""
+        code_dir = str(tmp_path / "code")
+        shutil.copytree(CODE_DIR, code_dir)
+        templates = SandboxTemplates(code_dir, SNIPPET_TESTS)
+        monkeypatch.setattr(evaluator, "sandbox_templates", templates)
+        monkeypatch.setattr(
+            evaluator, "refresh_tests", lambda sid: refresh_tests(sid, code_dir)
+        )
+        monkeypatch.setitem(SNIPPETS, "B", SNIPPETS["B"])
+        monkeypatch.setattr(evaluator, "EVALUATOR_TEST_SHARDS", 2)
+        durations = DurationHistory()
+        slow = [
+            {"name": name, "duration_ms": 20.0}
+            for name in list_test_methods(SNIPPETS["B"].test_code, "TestSnippetB")
+        ]
+        durations.record("B", slow)
+        monkeypatch.setattr(evaluator, "test_durations", durations)
+        shard_runs = []
+        run_shards = evaluator._run_shards
+
+        def spy(code, snippet_id, shards, *args):
+            shard_runs.append(shards)
+            return run_shards(code, snippet_id, shards, *args)
+
+        monkeypatch.setattr(evaluator, "_run_shards", spy)
+        try:
+            assert evaluate_code(FIXED_B, "B") == ("success", "", 15, 15)
+            with open(os.path.join(code_dir, SNIPPETS["B"].test_file), "a") as f:
+                f.write(NEW_TEST_METHOD)
+            result = evaluate_code(FIXED_B, "B")
+            assert result == ("test_failure", "", 15, 16)
+            assert result.details["test_results"][-1]["name"] == "test_zz_added"
+            # Sharded by the methods of the edited test class
+            assert [sum(map(len, shards)) for shards in shard_runs] == [15, 16]
+        finally:
+            templates.cleanup()
+
+
+class TestAdaptiveTimeouts:
+    """Test suite for the per-snippet timeouts calibrated against reference solutions."""
+
+    @staticmethod
+    def calibrated(baseline: float, multiplier: float = 10, floor: float = 2):
+        timeouts = AdaptiveTimeouts(multiplier, floor, 20)
+        timeouts._baselines["B"] = baseline
+        return timeouts
+
+    def test_derived_from_baseline(self):
+        """Test that the timeout is the baseline times the multiplier, within the bounds."""
+        assert AdaptiveTimeouts(10, 2, 20).timeout("B") == 20
+        assert self.calibrated(0.5).timeout("B") == 5
+        assert self.calibrated(0.05).timeout("B") == 2
+        assert self.calibrated(5).timeout("B") == 20
+
+    def test_failing_reference_keeps_ceiling(self):
+        """Test that a reference solution that does not pass leaves the snippet uncalibrated."""
+        timeouts = AdaptiveTimeouts(10, 2, 20)
+        failure = ("test_failure", "", 0, 1)
+        assert timeouts.calibrate("B", lambda: failure) is None
+        assert timeouts.timeout("B") == 20
+
+    def test_reference_solutions_pass(self, monkeypatch):
+        """Test that every snippet's reference solution passes and calibrates its timeout."""
+        monkeypatch.setattr(evaluator, "adaptive_timeouts", AdaptiveTimeouts(10, 2, 20))
+        timeouts = evaluator.calibrate_timeouts()
+        assert sorted(timeouts) == sorted(SNIPPETS)
+        assert all(2 <= timeout < 20 for timeout in timeouts.values())
+
+    def test_calibrated_timeout_is_applied(self, engine, monkeypatch):
+        """Test that a run is stopped after the calibrated timeout, and reported as such."""
+        monkeypatch.setattr(
+            evaluator, "adaptive_timeouts", self.calibrated(0.01, floor=1)
+        )
+        result = evaluate_code("while True:\n    pass\n", "B")
+        assert result == ("runtime_error", timeout_message(1), None, None)
+        assert result.details["timeout_seconds"] == 1
+        assert result.details["timed_out"] is True
+
+
+class TestEvaluationDispatcher:
+    """Test suite for the admission control of the evaluation dispatcher."""
+
+    def test_rejects_when_queue_is_full(self):
+        """Test that evaluations beyond the workers and queue are rejected until one completes."""
+        dispatcher = EvaluationDispatcher(max_workers=2, max_queue=1)
+        admissions = [dispatcher.admit() for _ in range(3)]
+        assert dispatcher.queue_depth == 1
+        with pytest.raises(EvaluationQueueFull):
+            dispatcher.admit()
+        admissions[0].release()
+        admissions[0].release()  # Releasing twice frees a single slot
+        dispatcher.admit()
+        with pytest.raises(EvaluationQueueFull):
+            dispatcher.admit()
+
+    def test_retry_after_from_queue_depth_and_mean_time(self):
+        """Test that Retry-After grows with the queue depth and the mean evaluation time."""
+        dispatcher = EvaluationDispatcher(max_workers=2, max_queue=4)
+        dispatcher._durations.extend([3.0, 5.0])
+        for _ in range(6):
+            dispatcher.admit()
+        with pytest.raises(EvaluationQueueFull) as e:
+            dispatcher.admit()
+        # 4 queued + the rejected one, drained 2 at a time, 4 seconds each
+        assert e.value.retry_after == 10
+
+    def test_run_releases_slot(self):
+        """Test that a completed evaluation frees its slot and is timed."""
+        dispatcher = EvaluationDispatcher(max_workers=1)
+        result = asyncio.run(dispatcher.run(lambda code, sid: (code, sid), "a", "B"))
+        assert result == ("a", "B")
+        assert len(dispatcher._durations) == 1
+        dispatcher.admit()
+
+    def test_fair_share_across_participants(self):
+        """Test that a participant with many queued evaluations does not delay everyone else."""
+        dispatcher = EvaluationDispatcher(max_workers=1, max_queue=8)
+        started = []
+        firsts = QUEUE_WAIT_SECONDS.count(snippet_id="B", attempt="first")
+        retries = QUEUE_WAIT_SECONDS.count(snippet_id="B", attempt="retry")
+
+        async def submit_all():
+            first = asyncio.Event()
+            loop = asyncio.get_running_loop()
+
+            def evaluate(code, snippet_id):
+                started.append(code)
+                if code == "greedy-0":
+                    # Keep the worker busy until every other evaluation is queued
+                    asyncio.run_coroutine_threadsafe(first.wait(), loop).result()
+                return "success", "", 1, 1
+
+            runs = [
+                asyncio.ensure_future(
+                    dispatcher.run(evaluate, f"greedy-{i}", "B", None, "greedy", i + 1)
+                )
+                for i in range(3)
+            ]
+            await asyncio.sleep(0.05)
+            runs.append(
+                asyncio.ensure_future(
+                    dispatcher.run(evaluate, "calm-0", "B", None, "calm", 1)
+                )
+            )
+            await asyncio.sleep(0.05)
+            first.set()
+            await asyncio.gather(*runs)
+
+        asyncio.run(submit_all())
+        # The calm participant's first attempt goes before the greedy one's retries
+        assert started == ["greedy-0", "calm-0", "greedy-1", "greedy-2"]
+        # Waits are labelled by snippet and kind of attempt, never by participant
+        assert QUEUE_WAIT_SECONDS.count(snippet_id="B", attempt="first") == firsts + 2
+        assert QUEUE_WAIT_SECONDS.count(snippet_id="B", attempt="retry") == retries + 2
+
+
+class TestFairQueue:
+    """Test suite for the deficit round-robin order of waiting evaluations."""
+
+    def test_round_robin_across_participants(self):
+        """Test that participants take turns, whatever the order evaluations were queued in."""
+        queue = FairQueue()
+        for i in range(3):
+            queue.push("greedy", False, f"greedy-{i}")
+        queue.push("calm", False, "calm-0")
+        order = [queue.pop(1.0, 1.0) for _ in range(4)]
+        assert [item for _, item in order] == [
+            "greedy-0",
+            "calm-0",
+            "greedy-1",
+            "greedy-2",
+        ]
+        assert queue.pop(1.0, 1.0) is None
+
+    def test_first_attempts_before_retries(self):
+        """Test that first attempts are served before any retry."""
+        queue = FairQueue()
+        queue.push("a", True, "a-retry")
+        queue.push("b", False, "b-first")
+        assert queue.pop(1.0, 1.0) == ("b", "b-first")
+        assert queue.pop(1.0, 1.0) == ("a", "a-retry")
+
+    def test_slow_evaluations_charged(self):
+        """Test that a participant whose evaluations ran long waits more turns for the next."""
+        queue = FairQueue()
+        for participant_id in ("slow", "fast"):
+            for i in range(3):
+                queue.push(participant_id, False, f"{participant_id}-{i}")
+        assert queue.pop(1.0, 1.0) == ("slow", "slow-0")
+        queue.done("slow", 2.0)  # Took 3 seconds instead of 1
+        order = []
+        while len(queue):
+            participant_id, item = queue.pop(1.0, 1.0)
+            order.append(item)
+            queue.done(participant_id, 0.0)
+        assert order == ["fast-0", "fast-1", "fast-2", "slow-1", "slow-2"]
+
+
+class TestSandboxTemplates:
+    """Test suite for the per-snippet sandbox templates."""
+
+    @pytest.fixture
+    def templates(self, tmp_path):
+        templates = SandboxTemplates(CODE_DIR, SNIPPET_TESTS, str(tmp_path))
+        yield templates
+        templates.cleanup()
+
+    def test_template_contents(self, templates):
+        """Test that a template holds the other snippets and the precompiled test module."""
+        template = templates.template_dir("B")
+        files = set(os.listdir(template))
+        assert files == {
+            "snippetA.py",
+            "snippetC.py",
+            "snippetD.py",
+            "test_snippetB.py",
+            "__pycache__",
+        }
+        cached = os.listdir(os.path.join(template, "__pycache__"))
+        assert any(name.startswith("test_snippetB.") for name in cached)
+
+    def test_submission_only_writes_user_file(self, templates):
+        """Test that a submission directory only holds the user file."""
+        with templates.submission_dir("B", "x = 1\n") as (td, user_code_path):
+            assert os.listdir(td) == ["snippetB.py"]
+            assert user_code_path == os.path.join(td, "snippetB.py")
+        assert not os.path.exists(td)
+
+    def test_rebuilt_when_tests_change(self, tmp_path):
+        """Test that a template is rebuilt once its test file changes."""
+        code_dir = tmp_path / "code"
+        code_dir.mkdir()
+        (code_dir / "snippetB.py").write_text("x = 1\n")
+        (code_dir / "test_snippetB.py").write_text("# version 1\n")
+        templates = SandboxTemplates(
+            str(code_dir), {"B": ("snippetB.py", "test_snippetB.py", "T")}
+        )
+        first = templates.template_dir("B")
+        assert templates.template_dir("B") == first
+        (code_dir / "test_snippetB.py").write_text("# version 2, longer\n")
+        assert templates.template_dir("B") != first
+        templates.cleanup()
+
+    def test_small_root_not_used(self, templates, monkeypatch):
+        """Test that a root with too little free space (e.g., Docker's /dev/shm) is not used."""
+        monkeypatch.setattr(sandbox, "MIN_ROOT_FREE_BYTES", float("inf"))
+        root = os.path.dirname(templates.template_dir("B"))
+        assert os.path.dirname(root) == tempfile.gettempdir()
+
+
+class TestScanner:
+    """Test suite for the malicious code scanner."""
+
+    @pytest.mark.parametrize(
+        "code, risky",
+        [
+            ("import subprocess\n", True),
+            ("import os.path, ctypes.util\n", True),
+            ("from multiprocessing import Pool\n", True),
+            ("from . import helpers\n", False),
+            ("import os\nos.system('ls')\n", True),
+            ("eval('1 + 1')\n", True),
+            ("x = [__import__('os')]\n", True),
+            ("def f(obj):\n    return obj.eval('1')\n", True),
+            ("import os\nprint(os.path.exists('a.txt'))\n", False),
+            ("import os\nos.path.exists(eval('1'))\n", True),
+            ("import os, math\nprint(os.getcwd(), math.pi)\n", False),
+            ("compile = 1\nprint(compile)\n", False),
+        ],
+    )
+    def test_verdicts(self, code, risky):
+        """Test that the scanner flags exactly the risky imports and calls."""
+        assert is_high_risk_tree(ast.parse(code)) is risky
+
+    def test_deeply_nested_code(self):
+        """Test that deeply nested code is scanned without exhausting the recursion limit."""
+        tree = ast.parse("x = " + " + ".join(["1"] * 2000) + " + eval('1')\n")
+        assert is_high_risk_tree(tree)
+
+    def test_verdict_remembered(self):
+        """Test that code is only parsed and scanned once."""
+        code = "import socket  # remembered\n"
+        assert detect_malicious_code(code)[0] is True
+        assert detect_malicious_code(code) == (True, None)
+
+    def test_runs_before_sandbox(self, monkeypatch):
+        """Test that high-risk code is rejected before any file is written."""
+
+        def no_sandbox(*args):
+            raise AssertionError("sandbox created for high-risk code")
+
+        monkeypatch.setattr(evaluator.sandbox_templates, "submission_dir", no_sandbox)
+        status, _, _, _ = evaluate_code("import pickle\n", "B")
+        assert status == "high_risk_code"
+
+
+class TestSyntaxCheck:
+    """Test suite for the in-process syntax check."""
+
+    @pytest.mark.parametrize(
+        "code",
+        [
+            read_original("A"),
+            "x = (\n",
+            "def f():\n    pass\nreturn 1\n",
+            "def f(a, a):\n    pass\n",
+            "if True:\nprint('unindented')\n",
+        ],
+    )
+    def test_matches_py_compile(self, code, tmp_path):
+        """Test that errors are reported exactly as `python -m py_compile` reports them."""
+        path = tmp_path / "snippet.py"
+        result = check_syntax(code, str(path))
+        path.write_text(code)
+        expected = subprocess.run(
+            [sys.executable, "-m", "py_compile", str(path)],
+            capture_output=True,
+            text=True,
+        ).stderr
+        assert result.error == expected
+
+    def test_valid_code(self):
+        """Test that valid code yields both a tree and a code object."""
+        result = check_syntax(FIXED_B, "snippetB.py")
+        assert result.error is None
+        assert result.tree is not None and result.code is not None
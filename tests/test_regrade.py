@@ -0,0 +1,170 @@
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.data.snippets import SNIPPETS
+from app.db import models
+from app.db.base import Base
+from app.services.evaluator import regrade as regrade_module
+from app.services.evaluator import sandbox
+from app.services.evaluator.evaluator import evaluate_code
+from app.services.evaluator.regrade import (
+    checkpoint_header,
+    diff_report,
+    load_checkpoint,
+    regrade,
+    stream_submissions,
+    worker_pool,
+)
+from tests.conftest import TestingSessionLocal, engine
+
+FIXED_B = SNIPPETS["B"].code.replace("maximum(", "max(")
+
+
+@pytest.fixture
+def submissions():
+    """Store a few graded (and one pending) submissions in a clean test database."""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    rows = [
+        ("p1", "B", 1, SNIPPETS["B"].code, "runtime_error", None, None),
+        ("p1", "B", 2, FIXED_B, "test_failure", 14, 15),
+        ("p2", "B", 1, FIXED_B, "success", 15, 15),
+        ("p2", "C", 1, "x = 1\n", "pending", None, None),
+    ]
+    with TestingSessionLocal() as db:
+        for pid, sid, attempt, code, status, passed, total in rows:
+            db.add(
+                models.CodeSubmission(
+                    participant_id=pid,
+                    snippet_id=sid,
+                    attempt_number=attempt,
+                    code=code,
+                    status=status,
+                    tests_passed=passed,
+                    tests_total=total,
+                )
+            )
+        db.commit()
+
+
+class TestRegrade:
+    """Test suite for re-grading stored submissions."""
+
+    def test_streams_graded_submissions(self, submissions):
+        """Test that graded submissions are streamed in key order, skipping pending ones."""
+        streamed = list(stream_submissions(TestingSessionLocal, batch_size=1))
+        assert [key for key, _, _ in streamed] == [
+            ("p1", "B", 1),
+            ("p1", "B", 2),
+            ("p2", "B", 1),
+        ]
+        assert streamed[1][2] == ("test_failure", 14, 15)
+        assert [key for key, _, _ in stream_submissions(TestingSessionLocal, "C")] == []
+
+    def test_diff_report(self, submissions, tmp_path):
+        """Test that only submissions whose status or test counts changed are reported."""
+        with ThreadPoolExecutor(2) as executor:
+            records = regrade(
+                stream_submissions(TestingSessionLocal),
+                evaluate_code,
+                executor,
+                str(tmp_path / "checkpoint.jsonl"),
+            )
+        report = diff_report(records)
+        assert (report["graded"], report["changed"]) == (3, 1)
+        assert report["transitions"] == {"test_failure -> success": 1}
+        assert report["changes"][0]["attempt_number"] == 2
+        assert report["changes"][0]["new"] == {
+            "status": "success",
+            "tests_passed": 15,
+            "tests_total": 15,
+        }
+
+    def test_resumes_from_checkpoint(self, submissions, tmp_path):
+        """Test that submissions recorded in the checkpoint are not evaluated again."""
+        checkpoint = tmp_path / "checkpoint.jsonl"
+        done = {"key": ["p1", "B", 1], "old": ["runtime_error", None, None]}
+        done["new"] = ["runtime_error", None, None]
+        header = json.dumps({"header": checkpoint_header()})
+        # An interrupted run may leave a partial last line behind
+        checkpoint.write_text(
+            header + "\n" + json.dumps(done) + "\n" + '{"key": ["p1", "B"'
+        )
+        evaluated = []
+
+        def evaluate(code, snippet_id):
+            evaluated.append(code)
+            return "success", "", 15, 15
+
+        with ThreadPoolExecutor(1) as executor:
+            records = regrade(
+                stream_submissions(TestingSessionLocal),
+                evaluate,
+                executor,
+                str(checkpoint),
+                max_in_flight=1,
+            )
+        assert evaluated == [FIXED_B, FIXED_B]
+        assert len(records) == 3
+        assert load_checkpoint(str(checkpoint), checkpoint_header()) == records
+
+    @pytest.mark.parametrize(
+        "header",
+        [
+            None,  # Written before checkpoints had headers
+            {"snippet": None, "suite_versions": {"B": "0123456789abcdef"}},
+            checkpoint_header("B"),  # Only re-graded the submissions for snippet B
+        ],
+    )
+    def test_refuses_stale_checkpoint(self, submissions, tmp_path, header):
+        """Test that results graded against other test suites or submissions are not reused."""
+        checkpoint = tmp_path / "checkpoint.jsonl"
+        lines = [] if header is None else [json.dumps({"header": header})]
+        done = {"key": ["p1", "B", 1], "old": ["runtime_error", None, None]}
+        done["new"] = ["success", 15, 15]
+        checkpoint.write_text("\n".join(lines + [json.dumps(done)]) + "\n")
+        with ThreadPoolExecutor(1) as executor:
+            with pytest.raises(ValueError):
+                regrade(
+                    stream_submissions(TestingSessionLocal),
+                    evaluate_code,
+                    executor,
+                    str(checkpoint),
+                )
+
+    def test_main_fresh(self, tmp_path, monkeypatch, capsys):
+        """Test that the command refuses a stale checkpoint unless told to discard it."""
+        checkpoint, report = tmp_path / "checkpoint.jsonl", tmp_path / "report.json"
+        stale = {"key": ["p1", "B", 1], "old": ["success", 15, 15]}
+        checkpoint.write_text(json.dumps({**stale, "new": ["success", 15, 15]}) + "\n")
+        monkeypatch.setattr(
+            regrade_module, "stream_submissions", lambda *args: iter([])
+        )
+        monkeypatch.setattr(
+            regrade_module, "worker_pool", lambda *args: ThreadPoolExecutor(1)
+        )
+        argv = ["regrade", "--checkpoint", str(checkpoint), "--report", str(report)]
+        monkeypatch.setattr(sys, "argv", argv)
+        assert regrade_module.main() == 1
+        assert "use --fresh" in capsys.readouterr().err
+        assert not report.exists()
+
+        monkeypatch.setattr(sys, "argv", argv + ["--fresh"])
+        assert regrade_module.main() == 0
+        assert json.loads(report.read_text())["graded"] == 0
+        lines = checkpoint.read_text().splitlines()
+        assert [json.loads(line) for line in lines] == [{"header": checkpoint_header()}]
+
+    def test_worker_templates_removed(self, tmp_path, monkeypatch):
+        """Test that the sandbox templates built by the worker processes are removed."""
+        monkeypatch.setattr(regrade_module, "EVALUATOR_SANDBOX_DIR", str(tmp_path))
+        monkeypatch.setattr(sandbox, "MIN_ROOT_FREE_BYTES", 0)
+        with worker_pool(1, use_cache=False) as executor:
+            assert executor.submit(evaluate_code, FIXED_B, "B").result()[0] == "success"
+            (root,) = os.listdir(tmp_path)
+            assert os.listdir(tmp_path / root)  # The worker's templates
+        assert os.listdir(tmp_path) == []
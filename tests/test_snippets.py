@@ -0,0 +1,108 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from app.data.snippets import (
+    CODE_DIR,
+    SNIPPETS,
+    get_snippet,
+    load_snippets,
+    refresh_tests,
+)
+from app.services.evaluator.evaluator import SNIPPET_TESTS
+from app.services.evaluator.sharding import list_test_methods
+
+
+def write_snippet(code_dir, folder: str, test_class: str) -> None:
+    """Write the files of a minimal snippet into its folder."""
+    os.makedirs(code_dir / folder)
+    (code_dir / folder / f"{folder}.py").write_text("print('hi')\n")
+    (code_dir / folder / f"{folder}_error.txt").write_text("NameError: x\n")
+    (code_dir / folder / f"test_{folder}.py").write_text(
+        f"import unittest\n\nclass {test_class}(unittest.TestCase):\n    pass\n"
+    )
+
+
+class TestSnippetRegistry:
+    """Tests for the manifest-driven snippet registry."""
+
+    def test_registry_matches_snippet_files(self):
+        """Test that every registered snippet holds the contents of its files."""
+        assert list(SNIPPETS) == ["A", "B", "C", "D"]
+        for snippet in SNIPPETS.values():
+            with open(os.path.join(CODE_DIR, snippet.source_file)) as f:
+                assert snippet.code == f.read()
+            with open(os.path.join(CODE_DIR, snippet.error_file)) as f:
+                assert snippet.error == f.read()
+            # The test module is compiled (not executed, it imports the snippet)
+            assert snippet.test_code.co_filename.endswith(snippet.test_file)
+            assert snippet.test_class in snippet.test_code.co_names
+
+    def test_evaluator_and_get_snippet_share_registry(self):
+        """Test that the evaluator's test suites and get_snippet come from the registry."""
+        assert SNIPPET_TESTS == {
+            snippet_id: snippet.test_spec for snippet_id, snippet in SNIPPETS.items()
+        }
+        assert get_snippet("B") is SNIPPETS["B"]
+        assert get_snippet("unknown") is None
+
+    def test_load_snippets_from_manifest(self, tmp_path):
+        """Test that a new snippet only needs its folder and a manifest entry."""
+        write_snippet(tmp_path, "snippetE", "TestSnippetE")
+        write_snippet(tmp_path, "other", "TestOther")
+        os.rename(tmp_path / "other" / "other.py", tmp_path / "other" / "main.py")
+        manifest = {
+            "snippets": [
+                {"id": "E", "folder": "snippetE", "test_class": "TestSnippetE"},
+                {
+                    "id": "F",
+                    "folder": "other",
+                    "source": "other/main.py",
+                    "test_class": "TestOther",
+                },
+            ]
+        }
+        (tmp_path / "manifest.json").write_text(json.dumps(manifest))
+
+        snippets = load_snippets(str(tmp_path / "manifest.json"))
+        assert list(snippets) == ["E", "F"]
+        assert snippets["E"].test_spec == (
+            "snippetE/snippetE.py",
+            "snippetE/test_snippetE.py",
+            "TestSnippetE",
+        )
+        assert snippets["E"].error == "NameError: x\n"
+        assert snippets["F"].source_file == "other/main.py"
+        assert snippets["F"].code == "print('hi')\n"
+
+    def test_load_snippets_rejects_duplicate_ids(self, tmp_path):
+        """Test that a manifest listing the same snippet ID twice is rejected."""
+        write_snippet(tmp_path, "snippetE", "TestSnippetE")
+        entry = {"id": "E", "folder": "snippetE", "test_class": "TestSnippetE"}
+        (tmp_path / "manifest.json").write_text(
+            json.dumps({"snippets": [entry, entry]})
+        )
+        with pytest.raises(ValueError):
+            load_snippets(str(tmp_path / "manifest.json"))
+
+    def test_refresh_tests_reloads_edited_files(self, monkeypatch, tmp_path):
+        """Test that edited test files and test cases are reloaded, and only then."""
+        shutil.copytree(CODE_DIR, tmp_path / "code")
+        code_dir = str(tmp_path / "code")
+        snippet = SNIPPETS["B"]
+        monkeypatch.setitem(SNIPPETS, "B", snippet)
+        assert refresh_tests("B", code_dir) is snippet
+
+        with open(os.path.join(code_dir, snippet.test_file), "a") as f:
+            f.write("\n    def test_added(self):\n        pass\n")
+        cases = {**snippet.cases, "cases": snippet.cases["cases"][:1]}
+        with open(os.path.join(code_dir, snippet.cases_file), "w") as f:
+            json.dump(cases, f)
+        refreshed = refresh_tests("B", code_dir)
+        assert SNIPPETS["B"] is refreshed
+        assert refreshed.code == snippet.code
+        assert "test_added" in list_test_methods(refreshed.test_code, "TestSnippetB")
+        assert refreshed.cases == cases
+        assert refresh_tests("B", code_dir) is refreshed
@@ -0,0 +1,194 @@
+import threading
+
+import pytest
+
+from app.db import models
+from app.services.evaluator import work_queue
+from app.services.evaluator.work_queue import EvaluationWorker, requeue_orphaned_jobs
+from tests import test_code_submission
+from tests.conftest import TestingSessionLocal
+
+
+@pytest.fixture
+def queued_job(client, monkeypatch):
+    """Submit code in job mode with the evaluation queue enabled, returning the job ID."""
+    monkeypatch.setattr("app.api.code.EVALUATION_QUEUE", True)
+    setup = test_code_submission.TestCodeSubmission.setup_participant
+    snippet_id = setup(client, monkeypatch, "queueuser")
+    response = client.post(
+        "/api/code/submit",
+        params={"mode": "job"},
+        json={
+            "participant_id": "queueuser",
+            "snippet_id": snippet_id,
+            "code": "print('hello')",
+            "time_taken_ms": 1234,
+        },
+    )
+    assert response.status_code == 202
+    return response.json()["job_id"]
+
+
+def job_state(job_id: str) -> tuple:
+    """Return the status of a job's submission and its queue entry (None once dequeued)."""
+    with TestingSessionLocal() as db:
+        sub = db.query(models.CodeSubmission).filter_by(job_id=job_id).one()
+        entry = (
+            db.query(models.EvaluationQueueEntry).filter_by(job_id=job_id).one_or_none()
+        )
+        if entry is None:
+            return sub.status, None
+        return sub.status, (entry.attempts, entry.leased_by)
+
+
+class TestEvaluationQueue:
+    """Test suite for the evaluation work queue and its workers."""
+
+    def test_worker_evaluates_queued_job(self, client, queued_job):
+        """Test that a queued job is left pending by the API and evaluated by a worker."""
+        assert job_state(queued_job) == ("pending", (0, None))
+
+        worker = EvaluationWorker(
+            TestingSessionLocal, lambda code, sid: ("test_failure", "", 3, 5), "w1"
+        )
+        assert worker.claim(4) == [queued_job]
+        assert worker.claim(4) == []
+        worker.process(queued_job)
+
+        assert job_state(queued_job) == ("test_failure", None)
+        data = client.get(f"/api/code/submit/{queued_job}").json()
+        assert (data["tests_passed"], data["tests_total"]) == (3, 5)
+
+    def test_expired_lease_reclaimed(self, queued_job):
+        """Test that the job of a crashed worker is claimed again once its lease expires."""
+        crashed = EvaluationWorker(
+            TestingSessionLocal, lambda code, sid: ("success", "", 1, 1), "w1", 1, 0
+        )
+        assert crashed.claim(1) == [queued_job]
+        other = EvaluationWorker(
+            TestingSessionLocal, lambda code, sid: ("test_failure", "", 0, 1), "w2"
+        )
+        assert other.claim(1) == [queued_job]
+        assert job_state(queued_job) == ("pending", (2, "w2"))
+
+        # The worker that lost its lease does not record its (late) result
+        crashed.process(queued_job)
+        assert job_state(queued_job) == ("pending", (2, "w2"))
+        other.process(queued_job)
+        assert job_state(queued_job) == ("test_failure", None)
+
+    def test_failed_job_retried_then_given_up(self, queued_job, monkeypatch):
+        """Test that a failing job is retried with a backoff, and recorded as failed in the end."""
+        monkeypatch.setattr(work_queue, "RETRY_BACKOFF_SECONDS", 0)
+
+        def evaluate(code, snippet_id):
+            raise RuntimeError("worker out of memory")
+
+        worker = EvaluationWorker(TestingSessionLocal, evaluate, "w1", max_attempts=2)
+        for _ in range(2):
+            assert worker.claim(1) == [queued_job]
+            worker.process(queued_job)
+        assert job_state(queued_job) == ("runtime_error", None)
+        with TestingSessionLocal() as db:
+            sub = db.query(models.CodeSubmission).filter_by(job_id=queued_job).one()
+            assert sub.error == "Evaluation failed: worker out of memory"
+
+    def test_run_until_stopped(self, queued_job):
+        """Test that a running worker drains the queue and stops when asked to."""
+        stop = threading.Event()
+
+        def evaluate(code, snippet_id):
+            stop.set()
+            return "success", "", 1, 1
+
+        EvaluationWorker(TestingSessionLocal, evaluate, "w1").run(stop)
+        assert job_state(queued_job) == ("success", None)
+
+    def test_orphaned_jobs_requeued(self, queued_job):
+        """Test that pending jobs missing from the queue (e.g., after a restart) are requeued."""
+        with TestingSessionLocal() as db:
+            sub = db.query(models.CodeSubmission).filter_by(job_id=queued_job).one()
+            db.add(
+                models.CodeSubmission(
+                    participant_id=sub.participant_id,
+                    snippet_id=sub.snippet_id,
+                    attempt_number=2,
+                    code="print('again')",
+                    status="pending",
+                    job_id="orphan",
+                )
+            )
+            db.commit()
+        assert requeue_orphaned_jobs(TestingSessionLocal) == 1
+        assert job_state("orphan") == ("pending", (0, None))
+        assert job_state(queued_job) == ("pending", (0, None))
+        assert requeue_orphaned_jobs(TestingSessionLocal) == 0
+
+    def test_claim_takes_turns_between_participants(self, queued_job):
+        """Test that workers claim first attempts first, and take turns between participants."""
+        with TestingSessionLocal() as db:
+            sub = db.query(models.CodeSubmission).filter_by(job_id=queued_job).one()
+            for participant_id, attempt_number in [
+                ("busy", 1),
+                ("busy", 2),
+                ("busy", 3),
+                ("other", 2),
+                ("late", 1),
+            ]:
+                job_id = f"{participant_id}-{attempt_number}"
+                db.add(
+                    models.CodeSubmission(
+                        participant_id=participant_id,
+                        snippet_id=sub.snippet_id,
+                        attempt_number=attempt_number,
+                        code="print('hello')",
+                        status="pending",
+                        job_id=job_id,
+                    )
+                )
+                work_queue.enqueue_job(db, job_id)
+            db.commit()
+
+        worker = EvaluationWorker(
+            TestingSessionLocal, lambda code, sid: ("success", "", 1, 1), "w1"
+        )
+        assert worker.claim(3) == [queued_job, "busy-1", "late-1"]
+        assert worker.claim(3) == ["busy-2", "other-2", "busy-3"]
+
+    def test_full_queue_rejects_submissions(self, client, queued_job, monkeypatch):
+        """Test that submissions are rejected, without counting, while the queue is full."""
+        monkeypatch.setattr(
+            "app.api.code.check_queue_room",
+            lambda db: work_queue.check_queue_room(db, max_waiting=1),
+        )
+        with TestingSessionLocal() as db:
+            snippet_id = (
+                db.query(models.CodeSubmission).filter_by(job_id=queued_job).one()
+            ).snippet_id
+        submission = {
+            "participant_id": "queueuser",
+            "snippet_id": snippet_id,
+            "code": "print('again')",
+            "time_taken_ms": 1234,
+        }
+
+        response = client.post(
+            "/api/code/submit", params={"mode": "job"}, json=submission
+        )
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+
+        # Once a worker claims the waiting job, there is room for the next one
+        worker = EvaluationWorker(
+            TestingSessionLocal, lambda code, sid: ("success", "", 1, 1), "w1"
+        )
+        assert worker.claim(1) == [queued_job]
+        response = client.post(
+            "/api/code/submit", params={"mode": "job"}, json=submission
+        )
+        assert response.status_code == 202
+        with TestingSessionLocal() as db:
+            attempts = db.query(models.CodeSubmission).filter_by(
+                participant_id="queueuser"
+            )
+            assert sorted(sub.attempt_number for sub in attempts) == [1, 2]